@@ -1,8 +1,9 @@
 import os
 import logging
+import threading
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, configure_mappers
 from flask_login import LoginManager
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -40,9 +41,12 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Import models and create tables
-with app.app_context():
-    from models import User, Ride, Booking, Review
+def init_db():
+    """Create missing tables and search/caching bookkeeping rows"""
+    from models import (User, Ride, Booking, Review, RideLocationToken, CollectionVersion, ChainJob,
+                        ChainRide, ChainEvent, IndexerCheckpoint, ProfilePublish)
+    from location_search import ensure_search_index
+    from http_cache import ensure_collection_versions
     
     # Only create tables if they don't exist yet
     try:
@@ -50,11 +54,78 @@ with app.app_context():
         Ride.__table__.create(db.engine, checkfirst=True)
         Booking.__table__.create(db.engine, checkfirst=True)
         Review.__table__.create(db.engine, checkfirst=True)
+        RideLocationToken.__table__.create(db.engine, checkfirst=True)
+        CollectionVersion.__table__.create(db.engine, checkfirst=True)
+        ChainJob.__table__.create(db.engine, checkfirst=True)
+        ChainRide.__table__.create(db.engine, checkfirst=True)
+        ChainEvent.__table__.create(db.engine, checkfirst=True)
+        IndexerCheckpoint.__table__.create(db.engine, checkfirst=True)
+        ProfilePublish.__table__.create(db.engine, checkfirst=True)
         logger.info("Database tables created or already exist")
     except Exception as e:
         # In case the direct table creation fails, fallback to create_all
         db.create_all()
         logger.info("Database tables created using create_all()")
+    
+    try:
+        ensure_search_index()
+    except Exception as e:
+        logger.warning(f"Could not prepare location search index: {str(e)}")
+    
+    ensure_collection_versions()
+
+_startup_lock = threading.Lock()
+_db_ready = False
+_background_started = False
+
+def create_app(start_background=True):
+    """
+    Prepare the application for serving
+    
+    Importing this module only configures Flask and registers routes.
+    Creating tables and starting background threads happens here, once per
+    process, so scripts and workers decide when to pay for it. Blockchain
+    and IPFS connections are not made here: their health probes connect in
+    the background and requests that need them sooner connect on demand.
+    
+    Args:
+        start_background: Also start the transaction pipeline, the chain
+            indexer, the profile publisher and the service health probes
+    
+    Returns:
+        The Flask application
+    """
+    global _db_ready, _background_started
+    with _startup_lock:
+        if not _db_ready:
+            with app.app_context():
+                init_db()
+            _db_ready = True
+        
+        if start_background and not _background_started:
+            from blockchain_service import blockchain_service
+            from ipfs_service import ipfs_storage
+            from tx_pipeline import tx_pipeline
+            from chain_indexer import chain_indexer
+            from reconciliation import reconciler
+            from profile_outbox import profile_outbox
+            
+            blockchain_service.start_health_probe()
+            ipfs_storage.start_health_probe()
+            # Confirm blockchain transactions in the background
+            tx_pipeline.start()
+            # Mirror contract events into the database (when INDEXER_ENABLED is set)
+            chain_indexer.start()
+            # Repair rides and bookings out of sync with the chain (when RECONCILE_ENABLED is set)
+            reconciler.start()
+            # Upload queued profile documents to IPFS
+            profile_outbox.start()
+            _background_started = True
+    return app
+
+# Resolve backrefs such as Ride.driver, which route modules use at import time
+import models
+configure_mappers()
 
 # Import and register routes
 from routes import *
@@ -62,5 +133,5 @@ from routes import *
 # Configure login manager user loader
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    from user_cache import user_cache
+    return user_cache.load(int(user_id))
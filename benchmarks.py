@@ -0,0 +1,1444 @@
+"""
+Benchmarks for DeCarpooling hot paths
+
+Each benchmark runs against a throwaway SQLite database in dev mode, so no
+Ethereum node or IPFS gateway is needed. They only measure; behaviour is
+checked by the tests in tests/ (python -m pytest).
+
+Usage:
+    python benchmarks.py <benchmark> [options]
+    python benchmarks.py --list
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+BENCHMARKS = {}
+
+SYLLABLES = ['ka', 'la', 'ma', 'na', 'pa', 'ra', 'sa', 'ta', 'va', 'ban', 'gar', 'pur', 'nag', 'ko', 'di', 'mi']
+AREAS = ['Central', 'Airport', 'Station', 'North', 'South', 'East', 'West', 'Old Town']
+
+def benchmark(name):
+    """Register a benchmark function under a command-line name"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+def setup_environment(database_url=None):
+    """Point the app at a scratch database and simulated services, then import it"""
+    scratch = tempfile.mkdtemp(prefix='carpool-bench-')
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('DEV_CHAIN_STATE_PATH', os.path.join(scratch, 'dev_chain.json'))
+    os.environ.setdefault('DEV_MODE', 'true')
+    os.environ.setdefault('TX_PIPELINE_ENABLED', 'false')
+    logging.disable(logging.WARNING)
+
+    from app import create_app
+    return create_app(start_background=False)
+
+def timed(func, repeat):
+    """Run func repeat times and return per-call latencies in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def report(label, samples):
+    """Print median and p95 latency for a set of samples"""
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:<40} median {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms")
+
+def random_location(rng):
+    """A plausible locality name drawn from a large synthetic vocabulary"""
+    place = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+    return f"{place} {rng.choice(AREAS)}"
+
+def seed_rides(count, rng, driver_id=None, batch_size=2000, route=None):
+    """Insert count active rides through the ORM so index hooks fire"""
+    from app import db
+    from models import User, Ride
+
+    if driver_id is None:
+        driver = User(username=f'driver{rng.random()}', email=f'{rng.random()}@example.com')
+        driver.set_password('password')
+        db.session.add(driver)
+        db.session.commit()
+        driver_id = driver.id
+
+    now = datetime.utcnow()
+    for offset in range(0, count, batch_size):
+        for _ in range(min(batch_size, count - offset)):
+            db.session.add(Ride(
+                driver_id=driver_id,
+                start_location=route[0] if route else random_location(rng),
+                end_location=route[1] if route else random_location(rng),
+                departure_time=now + timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                price=round(rng.uniform(0.01, 0.5), 3),
+                available_seats=rng.randint(1, 4),
+                is_active=True,
+            ))
+        db.session.commit()
+    return driver_id
+
+@benchmark('search')
+def bench_search(args):
+    """Location search vs. leading-wildcard ILIKE as the ride table grows"""
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import Ride
+    from location_search import search_rides
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    # A fixed set of matching rides buried in a growing table of other routes
+    routes = [('Lonavala Hills', 'Khandala Station'), ('Panvel Old Town', 'Alibag Beach')]
+    # 'avala' starts no location word, so it takes the substring fallback
+    queries = [('lonav', 'khandala'), ('panvel', 'alibag'), ('', 'khand'), ('avala', 'khand')]
+
+    with app.app_context():
+        for route in routes:
+            seed_rides(25, rng, route=route)
+
+        seeded = 0
+        for size in sizes:
+            seed_rides(size - seeded, rng)
+            seeded = size
+
+            def run_ilike():
+                start, end = rng.choice(queries)
+                Ride.query.filter_by(is_active=True).filter(
+                    Ride.start_location.ilike(f'%{start}%'),
+                    Ride.end_location.ilike(f'%{end}%'),
+                ).order_by(Ride.departure_time).all()
+
+            def run_index():
+                start, end = rng.choice(queries)
+                search_rides(Ride.query.filter_by(is_active=True), start, end).all()
+
+            print(f"-- {size} rides")
+            report('ilike scan', timed(run_ilike, args.repeat))
+            report('location index', timed(run_index, args.repeat))
+            with count_queries(db.engine) as statements:
+                for start, end in queries:
+                    search_rides(Ride.query.filter_by(is_active=True), start, end).all()
+            print(f"location index statements per search: {len(statements) / len(queries):.2f}")
+            db.session.remove()
+
+def count_queries(engine):
+    """Context manager yielding a list that collects every SQL statement run"""
+    from contextlib import contextmanager
+    from sqlalchemy import event
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    return counter()
+
+# Stand-ins for templates/profile.html: the rows it shows for each offered ride and booking,
+# read through the dynamic relationships or through what the /profile view passes
+PROFILE_TEMPLATES = {
+    'dynamic relationships': (
+        "{% for ride in offered_rides %}{{ ride.driver.username }}"
+        "{% for booking in ride.bookings %}{{ booking.passenger.username }}{% endfor %}"
+        "{{ ride.bookings.count() }}{% endfor %}"
+        "{% for booking in bookings %}{{ booking.ride.start_location }}{{ booking.ride.driver.username }}{% endfor %}"
+    ),
+    'view data (booking_list, ride_stats)': (
+        "{% for ride in offered_rides %}{{ ride.driver.username }}"
+        "{% for booking in ride.booking_list %}{{ booking.passenger.username }}{% endfor %}"
+        "{{ ride_stats[ride.id].seats_booked }}{% endfor %}"
+        "{% for booking in bookings %}{{ booking.ride.start_location }}{{ booking.ride.driver.username }}{% endfor %}"
+    ),
+}
+
+@benchmark('profile')
+def bench_profile(args):
+    """Queries and latency of GET /profile for growing ride counts"""
+    app = setup_environment(args.database_url)
+    from jinja2 import DictLoader
+    from app import db
+    from models import User, Ride, Booking
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    client = app.test_client()
+
+    def get_profile(user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        response = client.get('/profile')
+        assert response.status_code == 200, f"/profile returned {response.status_code}"
+
+    # Requests run outside an app context of our own, which they would share (and with it Flask-Login's user)
+    with app.app_context():
+        engine = db.engine
+
+    for size in sizes:
+        # A driver with `size` rides, each booked by a passenger who also
+        # books `size` rides from other drivers
+        with app.app_context():
+            driver_id = seed_rides(size, rng)
+            other_driver_id = seed_rides(size, rng)
+            passenger = User(username=f'passenger{size}', email=f'passenger{size}@example.com')
+            passenger.set_password('password')
+            db.session.add(passenger)
+            db.session.commit()
+            for ride in Ride.query.filter(Ride.driver_id.in_([driver_id, other_driver_id])):
+                db.session.add(Booking(ride_id=ride.id, passenger_id=passenger.id, seats_booked=1))
+            db.session.commit()
+            passenger_id = passenger.id
+
+        results = []
+        for label, source in PROFILE_TEMPLATES.items():
+            app.jinja_env.loader = DictLoader({'profile.html': source})
+            for user_id in (driver_id, passenger_id):
+                get_profile(user_id)  # first visit creates the OTP secret
+                with count_queries(engine) as statements:
+                    get_profile(user_id)
+                results.append((label, user_id, len(statements)))
+                report(f'{label} ({size} rides, user {user_id})',
+                       timed(lambda: get_profile(user_id), args.repeat))
+
+        for label, user_id, queries in results:
+            print(f"   {label:<40} user {user_id}: {queries} queries")
+
+@benchmark('booking')
+def bench_booking(args):
+    """Concurrent bookings: oversell check and bookings/sec for atomic reservations"""
+    app = setup_environment(args.database_url)
+    import threading
+    from app import db
+    from models import User, Ride, Booking
+    from reservations import reserve_seats, ReservationError
+
+    rng = random.Random(args.seed)
+    seats = args.seats
+    passengers = seats * 3
+
+    def naive_reserve(ride_id, passenger_id, count):
+        # The pre-reservation book_ride flow: read, check in Python, write
+        ride = db.session.get(Ride, ride_id)
+        if ride.available_seats < count:
+            raise ReservationError('Not enough seats available on this ride')
+        time.sleep(0.001)  # request handling between the check and the commit
+        ride.available_seats -= count
+        db.session.add(Booking(ride_id=ride_id, passenger_id=passenger_id, seats_booked=count))
+        db.session.commit()
+
+    with app.app_context():
+        users = [User(username=f'rider{i}', email=f'rider{i}@example.com') for i in range(passengers)]
+        for user in users:
+            user.set_password('password')
+        db.session.add_all(users)
+        db.session.commit()
+        passenger_ids = [user.id for user in users]
+
+    for label, reserve in (('read-check-write', naive_reserve), ('conditional UPDATE', reserve_seats)):
+        with app.app_context():
+            seed_rides(1, rng)
+            ride_id = db.session.query(db.func.max(Ride.id)).scalar()
+            db.session.get(Ride, ride_id).available_seats = seats
+            db.session.commit()
+
+        outcomes = {'booked': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.threads)
+
+        def worker(ids):
+            barrier.wait()
+            for passenger_id in ids:
+                with app.app_context():
+                    try:
+                        reserve(ride_id, passenger_id, 1)
+                        outcome = 'booked'
+                    except ReservationError:
+                        outcome = 'rejected'
+                    except Exception:
+                        db.session.rollback()
+                        outcome = 'errors'
+                with lock:
+                    outcomes[outcome] += 1
+
+        threads = [threading.Thread(target=worker, args=(passenger_ids[i::args.threads],))
+                   for i in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            ride = db.session.get(Ride, ride_id)
+            booked_seats = db.session.query(db.func.sum(Booking.seats_booked)).filter_by(ride_id=ride_id).scalar() or 0
+            oversold = booked_seats - seats
+            print(f"-- {label}: {args.threads} threads, {passengers} attempts on {seats} seats")
+            print(f"   booked {outcomes['booked']}, rejected {outcomes['rejected']}, errors {outcomes['errors']}")
+            print(f"   seats booked {booked_seats}, available_seats {ride.available_seats}, "
+                  f"oversold {max(oversold, 0)}")
+            print(f"   {passengers / elapsed:.1f} attempts/sec, {outcomes['booked'] / elapsed:.1f} bookings/sec")
+
+@benchmark('chain-cache')
+def bench_chain_cache(args):
+    """RPC calls and latency for ride reads with and without the block-aware cache"""
+    from chain_cache import ChainReadCache
+
+    rng = random.Random(args.seed)
+    rpc_latency = 0.002
+    block_time = 2.0  # compressed; mainnet blocks are ~12s
+    request_rate = 200  # reads/sec, paced so the run spans several blocks
+    requests = max(args.repeat, 1) * 20
+    started = time.monotonic()
+    calls = {'eth_call': 0, 'eth_blockNumber': 0}
+
+    def head_block():
+        calls['eth_blockNumber'] += 1
+        time.sleep(rpc_latency)
+        return int((time.monotonic() - started) / block_time)
+
+    def get_ride(ride_id):
+        calls['eth_call'] += 1
+        time.sleep(rpc_latency)
+        return {'id': ride_id, 'available_seats': 3}
+
+    # Page views skew towards a few popular rides, like a real listing
+    trace = [min(int(rng.paretovariate(1.2)), 500) for _ in range(requests)]
+
+    for label, cache in (('uncached', None),
+                         ('cached', ChainReadCache(head_block=head_block, max_entries=256,
+                                                   max_age=block_time * 4, head_refresh=block_time / 5))):
+        calls.update(eth_call=0, eth_blockNumber=0)
+        samples = []
+        run_start = time.perf_counter()
+        for i, ride_id in enumerate(trace):
+            delay = run_start + i / request_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            begin = time.perf_counter()
+            if cache is None:
+                get_ride(ride_id)
+            else:
+                cache.get(('ride', ride_id), lambda: get_ride(ride_id))
+            samples.append((time.perf_counter() - begin) * 1000)
+        rpc_calls = calls['eth_call'] + calls['eth_blockNumber']
+        report(f"{label:<9} {requests} reads, {rpc_calls} RPC calls", samples)
+        if cache is not None:
+            print(f"          hit rate {cache.stats()['hit_rate']}, "
+                  f"{calls['eth_call']} eth_call + {calls['eth_blockNumber']} eth_blockNumber")
+
+# getRide as the carpool contract exposes it, for the stand-in node
+STANDIN_RIDE_ABI = [{
+    'name': 'getRide',
+    'type': 'function',
+    'stateMutability': 'view',
+    'inputs': [{'name': 'rideId', 'type': 'uint256'}],
+    'outputs': [
+        {'name': 'driver', 'type': 'address'},
+        {'name': 'startLocation', 'type': 'string'},
+        {'name': 'endLocation', 'type': 'string'},
+        {'name': 'price', 'type': 'uint256'},
+        {'name': 'availableSeats', 'type': 'uint256'},
+        {'name': 'isAvailable', 'type': 'bool'}
+    ]
+}]
+STANDIN_RIDE_ABI.append({
+    'name': 'completeRide',
+    'type': 'function',
+    'stateMutability': 'nonpayable',
+    'inputs': [{'name': 'rideId', 'type': 'uint256'}],
+    'outputs': []
+})
+STANDIN_CONTRACT = '0x' + '11' * 20
+STANDIN_MULTICALL = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+def start_standin_node(round_trip):
+    """
+    Serve getRide, Multicall3.aggregate3 and node-signed transactions over
+    JSON-RPC on localhost
+
+    Every HTTP request sleeps for round_trip seconds, standing in for the
+    network latency to a hosted node. Transactions are checked against a
+    per-account nonce pool, and eth_call or eth_estimateGas of completeRide
+    reverts for ride ids in server.reverting_rides. eth_signTransaction
+    hands out a stand-in raw transaction that eth_sendRawTransaction
+    accepts; the replies to the next server.lost_replies of those sends are
+    lost (HTTP 504) after the transaction was accepted. GET /version answers like an IPFS API, POST
+    /add stores a single-file (optionally chunked) multipart upload on disk
+    or, with wrap-with-directory, every file of a small one, and GET /ipfs/<hash> serves server.ipfs[hash] or an upload like a
+    gateway; a server.slow_rate share of those reads take server.slow_delay
+    seconds longer. Returns (url, server); server.accounts and
+    server.calls expose the pool and per-method request counts.
+    """
+    import json
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from eth_abi import encode, decode
+    from eth_utils import function_signature_to_4byte_selector, keccak
+    from ipfs_cid import CHUNK_SIZE, cid_v0, cid_v0_of_chunks
+
+    get_ride = function_signature_to_4byte_selector('getRide(uint256)')
+    aggregate3 = function_signature_to_4byte_selector('aggregate3((address,bool,bytes)[])')
+    complete_ride = function_signature_to_4byte_selector('completeRide(uint256)')
+    driver = '0x' + '22' * 20
+
+    def ride_result(calldata):
+        (ride_id,) = decode(['uint256'], calldata[4:])
+        return encode(['address', 'string', 'string', 'uint256', 'uint256', 'bool'],
+                      [driver, f'Start {ride_id}', f'End {ride_id}',
+                       ride_id * 10 ** 15, 3, True])
+
+    def eth_call(params):
+        data = bytes.fromhex(params[0].get('data', params[0].get('input', '0x'))[2:])
+        if data[:4] == get_ride:
+            return ride_result(data)
+        if data[:4] == aggregate3:
+            (calls,) = decode(['(address,bool,bytes)[]'], data[4:])
+            return encode(['(bool,bytes)[]'], [[(True, ride_result(call[2])) for call in calls]])
+        if data[:4] == complete_ride:
+            if decode(['uint256'], data[4:])[0] in server.reverting_rides:
+                raise ValueError('execution reverted: ride does not exist')
+            return b''
+        raise ValueError('unknown function')
+
+    # Per-account transaction pool: next executable nonce and queued future nonces
+    accounts = {}
+    pool_lock = threading.Lock()
+    calls = {}
+    signed = {}  # raw transaction -> transaction
+    transactions = {}  # hash -> transaction sent with eth_sendRawTransaction
+
+    def send_raw_transaction(raw):
+        tx_hash = '0x' + keccak(hexstr=raw).hex()
+        with pool_lock:
+            if tx_hash in transactions:
+                raise ValueError('already known')
+            tx = signed[raw]
+        send_transaction(tx)
+        with pool_lock:
+            transactions[tx_hash] = dict(tx, hash=tx_hash)
+        return tx_hash
+
+    def send_transaction(tx):
+        with pool_lock:
+            account = accounts.setdefault(tx['from'].lower(), {'next': 0, 'queued': set()})
+            nonce = int(tx['nonce'], 16) if 'nonce' in tx else account['next']
+            if nonce < account['next'] or nonce in account['queued']:
+                raise ValueError('nonce too low')
+            account['queued'].add(nonce)
+            while account['next'] in account['queued']:
+                account['queued'].discard(account['next'])
+                account['next'] += 1
+            return '0x' + os.urandom(32).hex()
+
+    def handle(request):
+        method = request['method']
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        with pool_lock:
+            calls[method] = calls.get(method, 0) + 1
+        try:
+            if method == 'eth_chainId':
+                response['result'] = '0x539'
+            elif method == 'web3_clientVersion':
+                response['result'] = 'carpool-standin'
+            elif method == 'eth_blockNumber':
+                response['result'] = '0x1'
+            elif method == 'eth_call':
+                response['result'] = '0x' + eth_call(request['params']).hex()
+            elif method == 'eth_estimateGas':
+                eth_call(request['params'])
+                response['result'] = hex(150000)
+            elif method in ('eth_gasPrice', 'eth_maxPriorityFeePerGas'):
+                response['result'] = hex(10 ** 9)
+            elif method == 'eth_getBlockByNumber':
+                response['result'] = {'number': '0x1', 'baseFeePerGas': hex(10 ** 9), 'gasLimit': hex(30000000),
+                                      'hash': '0x' + '00' * 32, 'timestamp': hex(int(time.time()))}
+            elif method == 'eth_getTransactionCount':
+                with pool_lock:
+                    account = accounts.get(request['params'][0].lower())
+                    response['result'] = hex(account['next'] if account else 0)
+            elif method == 'eth_sendTransaction':
+                response['result'] = send_transaction(request['params'][0])
+            elif method == 'eth_signTransaction':
+                tx = request['params'][0]
+                raw = '0x' + json.dumps(tx, sort_keys=True).encode().hex()
+                with pool_lock:
+                    signed[raw] = tx
+                response['result'] = {'raw': raw, 'tx': tx}
+            elif method == 'eth_sendRawTransaction':
+                response['result'] = send_raw_transaction(request['params'][0])
+                with pool_lock:
+                    if server.lost_replies:
+                        server.lost_replies -= 1
+                        response = None
+            elif method == 'eth_getTransactionByHash':
+                with pool_lock:
+                    response['result'] = transactions.get(request['params'][0])
+            else:
+                response['error'] = {'code': -32601, 'message': 'method not found'}
+        except ValueError as e:
+            response['error'] = {'code': -32000, 'message': str(e)}
+        return response
+
+    def body_chunks(handler):
+        if handler.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(handler.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    handler.rfile.readline()
+                    return
+                yield handler.rfile.read(size)
+                handler.rfile.readline()
+        remaining = int(handler.headers.get('Content-Length', 0))
+        while remaining:
+            chunk = handler.rfile.read(min(remaining, 65536))
+            remaining -= len(chunk)
+            yield chunk
+
+    def file_chunks(path, offset, length, chunk_size=CHUNK_SIZE):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length:
+                chunk = f.read(min(length, chunk_size))
+                length -= len(chunk)
+                yield chunk
+
+    def add_wrapped(handler, boundary):
+        """Add every file part of a small multipart upload, then a stand-in directory entry"""
+        body = b''.join(body_chunks(handler))
+        lines = []
+        for part in body.split(b'--' + boundary)[1:-1]:
+            head, content = part.split(b'\r\n\r\n', 1)
+            name = head.split(b'filename="')[1].split(b'"')[0].decode()
+            content = content[:-2]  # CRLF before the next boundary
+            ipfs_hash = cid_v0(content)
+            server.ipfs[ipfs_hash] = content
+            lines.append({'Name': name, 'Hash': ipfs_hash, 'Size': str(len(content))})
+        directory = cid_v0(''.join(line['Hash'] for line in lines).encode())
+        lines.append({'Name': '', 'Hash': directory, 'Size': '0'})
+        return '\n'.join(json.dumps(line) for line in lines).encode() + b'\n'
+
+    def add(handler):
+        """Spool a multipart upload to disk and index its single file part"""
+        boundary = handler.headers['Content-Type'].split('boundary=')[1].encode()
+        if 'wrap-with-directory=true' in handler.path:
+            return add_wrapped(handler, boundary)
+        fd, path = tempfile.mkstemp(prefix='carpool-standin-ipfs-')
+        head = b''
+        total = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in body_chunks(handler):
+                if len(head) < 4096:
+                    head += chunk[:4096]
+                f.write(chunk)
+                total += len(chunk)
+        offset = head.index(b'\r\n\r\n') + 4
+        length = total - offset - len(b'\r\n--' + boundary + b'--\r\n')
+        ipfs_hash = cid_v0_of_chunks(file_chunks(path, offset, length))
+        server.files[ipfs_hash] = (path, offset, length)
+        return json.dumps({'Name': 'file', 'Hash': ipfs_hash, 'Size': str(length)}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.split('?')[0].endswith('/add'):
+                time.sleep(round_trip)
+                payload = add(self)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(round_trip)
+            result = [handle(item) for item in body] if isinstance(body, list) else handle(body)
+            if result is None:
+                # The request was handled but the reply never arrives
+                self.send_response(504)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            payload = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            time.sleep(round_trip)
+            payload = None
+            if self.path.startswith('/ipfs/'):
+                if random.random() < server.slow_rate:
+                    time.sleep(server.slow_delay)
+                ipfs_hash = self.path[len('/ipfs/'):]
+                if ipfs_hash in server.files:
+                    path, offset, length = server.files[ipfs_hash]
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(length))
+                    self.end_headers()
+                    for chunk in file_chunks(path, offset, length):
+                        self.wfile.write(chunk)
+                    return
+                payload = server.ipfs.get(ipfs_hash)
+            elif self.path.endswith('/version'):
+                payload = json.dumps({'Version': 'standin'}).encode()
+            self.send_response(200 if payload is not None else 404)
+            payload = payload or b''
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    # Clients that exit mid-request (e.g. a worker's health probe) are not errors here
+    server.handle_error = lambda request, client_address: None
+    server.accounts = accounts
+    server.calls = calls
+    server.transactions = transactions
+    server.lost_replies = 0
+    server.ipfs = {}
+    server.files = {}
+    server.reverting_rides = set()
+    server.slow_rate = 0.0
+    server.slow_delay = 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}', server
+
+@benchmark('chain-batch')
+def bench_chain_batch(args):
+    """Per-ride getRide calls vs JSON-RPC batches vs Multicall3 against a stand-in node"""
+    os.environ.setdefault('DEV_MODE', 'true')
+    logging.disable(logging.WARNING)
+    from web3 import Web3
+    from config import get_config
+    from blockchain_service import BlockchainService
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    service = BlockchainService()
+    service.dev_mode = False
+    service.w3 = Web3(Web3.HTTPProvider(url))
+    service.contract = service.w3.eth.contract(address=Web3.to_checksum_address(STANDIN_CONTRACT),
+                                               abi=STANDIN_RIDE_ABI)
+    config = get_config()
+    repeat = max(1, args.repeat // 10)
+
+    try:
+        for count in (1, 10, 100, 1000):
+            ride_ids = list(range(1, count + 1))
+            config.MULTICALL_ADDRESS = ''
+            expected = service.get_rides(ride_ids, use_cache=False)
+            report(f"{count:>5} rides  per-ride calls",
+                   timed(lambda: [service.get_ride(ride_id, use_cache=False) for ride_id in ride_ids], repeat))
+            report(f"{count:>5} rides  JSON-RPC batch",
+                   timed(lambda: service.get_rides(ride_ids, use_cache=False), repeat))
+            config.MULTICALL_ADDRESS = STANDIN_MULTICALL
+            report(f"{count:>5} rides  Multicall3",
+                   timed(lambda: service.get_rides(ride_ids, use_cache=False), repeat))
+            assert service.get_rides(ride_ids, use_cache=False) == expected, "bulk reads disagree"
+            assert expected[count] == service.get_ride(count, use_cache=False), "bulk and single reads disagree"
+    finally:
+        config.MULTICALL_ADDRESS = ''
+        server.shutdown()
+
+@benchmark('tx-submit')
+def bench_tx_submit(args):
+    """Concurrent transactions from one account: estimate+transact vs local nonces and cached gas"""
+    os.environ.setdefault('DEV_MODE', 'true')
+    logging.disable(logging.WARNING)
+    import threading
+    from web3 import Web3
+    from blockchain_service import BlockchainService
+    from web3_provider import PooledHTTPProvider
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    service = BlockchainService()
+    service.dev_mode = False
+    service.w3 = Web3(PooledHTTPProvider(url))
+    service.contract = service.w3.eth.contract(address=Web3.to_checksum_address(STANDIN_CONTRACT),
+                                               abi=STANDIN_RIDE_ABI)
+    sender = Web3.to_checksum_address('0x' + '33' * 20)
+    per_thread = max(1, args.repeat // 2)
+    total = per_thread * args.threads
+
+    def legacy(ride_id):
+        # The previous submit path: estimate, then let the node pick the nonce
+        call = service.contract.functions.completeRide(ride_id)
+        gas = call.estimate_gas({'from': sender})
+        return call.transact({'from': sender, 'gas': gas})
+
+    def managed(ride_id):
+        return service._send_transaction(service.contract.functions.completeRide(ride_id), {'from': sender})
+
+    def interloper():
+        # Another process sending from the same account mid-run
+        time.sleep(0.05)
+        with_node_nonce = Web3(Web3.HTTPProvider(url))
+        for _ in range(5):
+            with_node_nonce.eth.send_transaction({'from': sender, 'to': sender, 'gas': 21000})
+
+    try:
+        for label, send, external in (('estimate + transact', legacy, False),
+                                      ('local nonce + gas cache', managed, False),
+                                      ('... with another sender', managed, True)):
+            server.calls.clear()
+            start_nonce = server.accounts.get(sender.lower(), {'next': 0})['next']
+            errors = []
+
+            def worker(offset):
+                for i in range(per_thread):
+                    try:
+                        send(offset * per_thread + i + 1)
+                    except Exception as e:
+                        errors.append(str(e))
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+            if external:
+                threads.append(threading.Thread(target=interloper))
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            account = server.accounts[sender.lower()]
+            sent = account['next'] - start_nonce - (5 if external else 0)
+            rpc_calls = sum(server.calls.values())
+            print(f"-- {label}: {args.threads} threads x {per_thread} transactions")
+            print(f"   {total / elapsed:.1f} tx/sec, {rpc_calls / total:.2f} RPC calls per tx, "
+                  f"{len(errors)} errors, {sent} mined in order, {len(account['queued'])} stuck in queue")
+            assert not errors and sent == total and not account['queued'], "transactions lost or stuck"
+    finally:
+        server.shutdown()
+
+@benchmark('full-stack')
+def bench_full_stack(args):
+    """Offer, book and complete rides through the routes, settled against the dev chain simulator"""
+    os.environ.setdefault('DEV_CHAIN_LATENCY', str(args.rpc_latency))
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import User, Ride, Booking, ChainJob
+    from tx_pipeline import tx_pipeline
+    from blockchain_service import blockchain_service
+
+    rides = max(1, args.repeat)
+    passengers = 3
+    departure = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+    simulator = blockchain_service.simulator
+    simulator.reset()
+
+    with app.app_context():
+        for i in range(passengers + 1):
+            user = User(username=f'stack{i}', email=f'stack{i}@example.com',
+                        ethereum_address='0x' + f'{i + 1:040x}')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+
+    def login(index):
+        client.get('/logout')
+        client.post('/login', data={'username': f'stack{index}', 'password': 'password'})
+
+    def settle():
+        # Run the pipeline until every job has a receipt
+        start = time.perf_counter()
+        while True:
+            tx_pipeline.run_once()
+            with app.app_context():
+                if not ChainJob.query.filter(ChainJob.status.in_(['queued', 'submitting', 'submitted'])).count():
+                    return (time.perf_counter() - start) * 1000
+            time.sleep(min(0.05, simulator.block_time or 0))
+
+    login(0)
+    samples = timed(lambda: client.post('/offer-ride', data={
+        'start_location': 'Pune Station', 'end_location': 'Mumbai Airport', 'departure_time': departure,
+        'price': '0.05', 'available_seats': str(passengers)}), rides)
+    report(f"offer-ride x{rides}", samples)
+    print(f"{'   settle create_ride jobs':<40} {settle():8.1f} ms")
+
+    with app.app_context():
+        ride_ids = [ride_id for (ride_id,) in db.session.query(Ride.id).order_by(Ride.id)]
+    samples = []
+    for passenger in range(1, passengers + 1):
+        login(passenger)
+        for ride_id in ride_ids:
+            start = time.perf_counter()
+            client.post(f'/book-ride/{ride_id}', data={'seats': '1'})
+            samples.append((time.perf_counter() - start) * 1000)
+    report(f"book-ride x{len(samples)}", samples)
+    print(f"{'   settle book_ride jobs':<40} {settle():8.1f} ms")
+
+    report(f"ride details (chain read) x{len(ride_ids)}",
+           [timed(lambda: client.get(f'/api/ride/{ride_id}'), 1)[0] for ride_id in ride_ids])
+
+    login(0)
+    report(f"complete-ride x{len(ride_ids)}",
+           [timed(lambda: client.post(f'/complete-ride/{ride_id}'), 1)[0] for ride_id in ride_ids])
+    print(f"{'   settle complete_ride jobs':<40} {settle():8.1f} ms")
+
+    with app.app_context():
+        failed = ChainJob.query.filter_by(status='failed').count()
+        confirmed = Booking.query.filter_by(status='completed').count()
+    chain = simulator.stats()
+    expected_wei = len(ride_ids) * passengers * 5 * 10 ** 16
+    print(f"-- {chain['transactions']} transactions in {chain['block_number']} blocks, {chain['reverted']} reverted, "
+          f"{failed} failed jobs, {confirmed} completed bookings, {chain['paid_out_wei'] / 10 ** 18} ETH paid out")
+    assert failed == 0 and chain['paid_out_wei'] == expected_wei and chain['escrow_wei'] == 0, \
+        "chain and database disagree"
+
+@benchmark('settlement')
+def bench_settlement(args):
+    """Complete many rides: one completeRide and receipt wait at a time vs pipelined and batched settlement"""
+    os.environ.setdefault('DEV_CHAIN_LATENCY', str(args.rpc_latency))
+    os.environ.setdefault('DEV_CHAIN_BLOCK_TIME', '0.2')
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import User, Ride, Booking
+    from blockchain_service import blockchain_service
+    from settlement import RideSettlement
+
+    rides_per_run = max(1, args.repeat)
+    drivers, passengers = 5, 3
+    simulator = blockchain_service.simulator
+    simulator.reset()
+    rng = random.Random(args.seed)
+    departure = datetime.now() - timedelta(hours=1)
+
+    with app.app_context():
+        users = []
+        for i in range(drivers + passengers):
+            user = User(username=f'settle{i}', email=f'settle{i}@example.com',
+                        ethereum_address='0x' + f'{i + 1:040x}')
+            user.set_password('password')
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        user_ids = [(user.id, user.ethereum_address) for user in users]
+
+    def seed():
+        # Rides created and booked on the simulator, mirrored locally
+        price_wei = 10 ** 16
+        with app.app_context():
+            ride_ids = []
+            for _ in range(rides_per_run):
+                driver_id, driver_address = user_ids[rng.randrange(drivers)]
+                simulator.create_ride(driver_address, 'A', 'B', price_wei, passengers)
+                contract_id = len(simulator.rides)
+                ride = Ride(driver_id=driver_id, start_location='Pune Station', end_location='Mumbai Airport',
+                            departure_time=departure, price=0.01, available_seats=0,
+                            is_active=True, smart_contract_id=contract_id)
+                db.session.add(ride)
+                db.session.flush()
+                for passenger_id, passenger_address in user_ids[drivers:]:
+                    simulator.book_ride(passenger_address, contract_id, 1, price_wei)
+                    db.session.add(Booking(ride_id=ride.id, passenger_id=passenger_id, seats_booked=1,
+                                           status='confirmed'))
+                ride_ids.append(ride.id)
+            db.session.commit()
+        time.sleep(simulator.block_time * 2)
+        return ride_ids
+
+    def one_at_a_time(ride_ids):
+        # What the settlement job did before: per-ride transaction, receipt wait and booking loop
+        for ride_id in ride_ids:
+            ride = db.session.get(Ride, ride_id)
+            blockchain_service.complete_ride(ride.driver.ethereum_address, ride.smart_contract_id)
+            ride.is_active = False
+            for booking in Booking.query.filter_by(ride_id=ride.id).all():
+                booking.status = 'completed'
+            db.session.commit()
+        return len(ride_ids)
+
+    settlement = RideSettlement(poll_interval=simulator.block_time / 4)
+    runs = [
+        ('one completeRide at a time', one_at_a_time),
+        ('pipelined completeRide', lambda ids: len(settlement.settle(ids, use_batch_call=False)['completed'])),
+        ('batched completeRides', lambda ids: len(settlement.settle(ids)['completed'])),
+    ]
+    print(f"-- {rides_per_run} rides x {passengers} bookings, {drivers} drivers, "
+          f"{simulator.block_time}s blocks, {args.rpc_latency} ms per call")
+    for label, settle in runs:
+        ride_ids = seed()
+        transactions = simulator.tx_count
+        with app.app_context():
+            start = time.perf_counter()
+            completed = settle(ride_ids)
+            elapsed = time.perf_counter() - start
+            open_bookings = Booking.query.filter(Booking.ride_id.in_(ride_ids),
+                                                 Booking.status != 'completed').count()
+        print(f"{label:<30} {elapsed * 1000:9.1f} ms   {completed} completed, "
+              f"{simulator.tx_count - transactions} transactions, {open_bookings} open bookings")
+    chain = simulator.stats()
+    assert chain['escrow_wei'] == 0 and chain['reverted'] == 0, "settlement left escrow behind"
+
+@benchmark('reconcile')
+def bench_reconcile(args):
+    """Reconciliation pass throughput over rides and bookings with a few percent out of sync"""
+    os.environ.setdefault('DEV_CHAIN_LATENCY', '0')
+    os.environ.setdefault('RECONCILE_GRACE', '0')
+    app = setup_environment(args.database_url)
+    from sqlalchemy import insert
+    from app import db
+    from models import User, Ride, Booking
+    from blockchain_service import blockchain_service
+    from reconciliation import Reconciler
+
+    simulator = blockchain_service.simulator
+    rng = random.Random(args.seed)
+    created = datetime.utcnow() - timedelta(hours=1)
+    with app.app_context():
+        driver = User(username='recon-driver', email='recon-driver@example.com', ethereum_address='0x' + '11' * 20)
+        passenger = User(username='recon-passenger', email='recon-passenger@example.com',
+                         ethereum_address='0x' + '22' * 20)
+        for user in (driver, passenger):
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+        driver_id, passenger_id, driver_address = driver.id, passenger.id, driver.ethereum_address
+
+    total = 0
+    for size in [int(size) for size in args.sizes.split(',')]:
+        # Grow the tables to `size` rides; about 2% never reached the chain
+        with app.app_context():
+            rides = []
+            for _ in range(size - total):
+                linked = rng.random() > 0.02
+                if linked:
+                    simulator.create_ride(driver_address, 'A', 'B', 10 ** 16, 3)
+                rides.append({'driver_id': driver_id, 'start_location': 'A', 'end_location': 'B',
+                              'departure_time': created, 'price': 0.01, 'available_seats': 3, 'is_active': True,
+                              'created_at': created, 'smart_contract_id': len(simulator.rides) if linked else None})
+            first_id = (db.session.query(db.func.max(Ride.id)).scalar() or 0) + 1
+            db.session.execute(insert(Ride), rides)
+            db.session.execute(insert(Booking), [
+                {'ride_id': first_id + i, 'passenger_id': passenger_id, 'seats_booked': 1,
+                 'status': 'pending' if rng.random() < 0.02 else 'confirmed', 'created_at': created}
+                for i in range(len(rides))])
+            db.session.commit()
+        total = size
+
+        reconciler = Reconciler()
+        start = time.perf_counter()
+        scanned = reconciler.run_pass()
+        elapsed = time.perf_counter() - start
+        stats = reconciler.stats()
+        repairs = {key: value for key, value in stats['repairs'].items() if value}
+        print(f"{size:>8} rides  {scanned:>8} rows in {elapsed * 1000:9.1f} ms  "
+              f"{scanned / elapsed:9.0f} rows/sec  {repairs}")
+        with app.app_context():
+            print(f"{'':>8}        backlog after pass: {reconciler.backlog()}")
+
+@benchmark('ipfs-cache')
+def bench_ipfs_cache(args):
+    """Profile JSON reads from a slow IPFS gateway: uncached vs memory and disk cache hits"""
+    import json
+    setup_environment(args.database_url)
+    from ipfs_service import IPFSStorage
+    from ipfs_cache import IPFSCache
+    from ipfs_gateways import GatewayPool
+    from ipfs_cid import cid_v0
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    cache_dir = tempfile.mkdtemp(prefix='carpool-ipfs-cache-')
+    profiles = []
+    for i in range(max(1, args.repeat)):
+        content = json.dumps({'username': f'user{i}', 'bio': 'x' * 2000, 'rides': list(range(50))}).encode()
+        profiles.append(cid_v0(content))
+        server.ipfs[profiles[-1]] = content
+
+    def storage(**cache_options):
+        service = IPFSStorage()
+        service.ensure_initialized()
+        service.dev_mode = False
+        service.gateways = GatewayPool([f'{url}/ipfs/'])
+        service.cache = IPFSCache(**cache_options)
+        return service
+
+    print(f"-- {len(profiles)} profiles, gateway round trip {args.rpc_latency} ms")
+    uncached = storage(memory_bytes=0, disk_path='')
+    report("no cache", [timed(lambda: uncached.get_json(ipfs_hash), 1)[0] for ipfs_hash in profiles])
+
+    cached = storage(disk_path=cache_dir)
+    report("first read (fills cache)", [timed(lambda: cached.get_json(ipfs_hash), 1)[0] for ipfs_hash in profiles])
+    report("memory hit", [timed(lambda: cached.get_json(ipfs_hash), 1)[0] for ipfs_hash in profiles])
+
+    # A fresh worker process: empty memory tier, warm disk
+    restarted = storage(disk_path=cache_dir)
+    report("disk hit (new process)", [timed(lambda: restarted.get_json(ipfs_hash), 1)[0] for ipfs_hash in profiles])
+
+    verified = storage(disk_path=tempfile.mkdtemp(prefix='carpool-ipfs-cache-'), verify=True)
+    report("first read, CIDv0 verified", [timed(lambda: verified.get_json(ipfs_hash), 1)[0] for ipfs_hash in profiles])
+    print(f"-- cache stats: {cached.cache.stats()}")
+    server.shutdown()
+
+@benchmark('ipfs-stream')
+def bench_ipfs_stream(args):
+    """Peak Python memory for buffered vs streamed IPFS uploads, downloads and the /ipfs/<hash> proxy"""
+    import tracemalloc
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import User
+    from ipfs_service import ipfs_storage
+    from ipfs_cache import IPFSCache
+    from ipfs_gateways import GatewayPool
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    ipfs_storage.ensure_initialized()
+    ipfs_storage.dev_mode = False
+    ipfs_storage.ipfs_api = f'{url}/api/v0'
+    ipfs_storage.gateways = GatewayPool([f'{url}/ipfs/'])
+    client = app.test_client()
+
+    with app.app_context():
+        owner = User(username='uploader', email='uploader@example.com')
+        owner.set_password('password')
+        db.session.add(owner)
+        db.session.commit()
+        owner_id = owner.id
+
+    def publish(ipfs_hash):
+        # The proxy only serves hashes a profile refers to
+        with app.app_context():
+            db.session.get(User, owner_id).ipfs_profile_hash = ipfs_hash
+            db.session.commit()
+
+    def measure(label, func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<40} {elapsed * 1000:9.1f} ms   peak {peak / 2 ** 20:8.2f} MiB")
+        return result
+
+    def drain(chunks):
+        with chunks:
+            return sum(len(chunk) for chunk in chunks)
+
+    def proxy(ipfs_hash):
+        response = client.get(f'/ipfs/{ipfs_hash}', buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        return size
+
+    for mib in (8, 64):
+        path = os.path.join(tempfile.mkdtemp(prefix='carpool-bench-'), 'upload.bin')
+        with open(path, 'wb') as f:
+            for _ in range(mib):
+                f.write(os.urandom(2 ** 20))
+        print(f"-- {mib} MiB file")
+        # Fresh caches each time, so reads go to the gateway
+        ipfs_storage.cache = IPFSCache(disk_path='')
+        with open(path, 'rb') as f:
+            ipfs_hash = measure("add_file", lambda: ipfs_storage.add_file(f, 'upload.bin'))
+        ipfs_storage.cache = IPFSCache(disk_path='')
+        with open(path, 'rb') as f:
+            streamed = measure("add_stream", lambda: ipfs_storage.add_stream(f, 'upload.bin'))
+        assert streamed == ipfs_hash
+        ipfs_storage.cache = IPFSCache(memory_bytes=0, disk_path='')
+        measure("get_file", lambda: len(ipfs_storage.get_file(ipfs_hash)))
+        measure("open_stream", lambda: drain(ipfs_storage.open_stream(ipfs_hash)))
+        with app.app_context():
+            from routes import _is_known_hash
+            assert not _is_known_hash(ipfs_hash), "unreferenced hash would be proxied"
+        publish(ipfs_hash)
+        measure("GET /ipfs/<hash> (gateway)", lambda: proxy(ipfs_hash))
+        ipfs_storage.cache = IPFSCache(memory_bytes=0, disk_path='', verify=True)
+        assert measure("GET /ipfs/<hash> (verified)", lambda: proxy(ipfs_hash)) == mib * 2 ** 20
+        ipfs_storage.cache = IPFSCache(disk_path=tempfile.mkdtemp(prefix='carpool-ipfs-cache-'))
+        proxy(ipfs_hash)
+        measure("GET /ipfs/<hash> (disk cache)", lambda: proxy(ipfs_hash))
+    server.shutdown()
+
+@benchmark('dev-ipfs')
+def bench_dev_ipfs(args):
+    """Dev-mode IPFS blockstore: small-document adds with duplicates, and large-file add/read memory"""
+    import json
+    import tracemalloc
+    os.environ['IPFS_DEV_STORE_DIR'] = tempfile.mkdtemp(prefix='carpool-ipfs-blocks-')
+    setup_environment(args.database_url)
+    from ipfs_service import ipfs_storage
+    ipfs_storage.ensure_initialized()
+    store = ipfs_storage.blockstore
+    print(f"-- blockstore in {store.path}")
+
+    # Most documents repeat an earlier one, like re-published unchanged profiles
+    documents = [{'username': f'user{i % max(1, args.repeat // 2)}', 'bio': 'x' * 500} for i in range(args.repeat * 20)]
+    start = time.perf_counter()
+    hashes = [ipfs_storage.add_json(document) for document in documents]
+    elapsed = time.perf_counter() - start
+    stats = store.stats()
+    print(f"{len(documents)} add_json in {elapsed * 1000:.1f} ms ({len(documents) / elapsed:.0f}/sec), "
+          f"{stats['blocks_written']} blocks written, {stats['blocks_deduplicated']} deduplicated")
+    report("get_json", timed(lambda: ipfs_storage.get_json(hashes[0]), args.repeat))
+
+    def measure(label, func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<40} {elapsed * 1000:9.1f} ms   peak {peak / 2 ** 20:8.2f} MiB")
+        return result
+
+    def drain(stream):
+        with stream:
+            return sum(len(chunk) for chunk in stream)
+
+    for mib in (8, 64):
+        path = os.path.join(tempfile.mkdtemp(prefix='carpool-bench-'), 'upload.bin')
+        with open(path, 'wb') as f:
+            for _ in range(mib):
+                f.write(os.urandom(2 ** 20))
+        print(f"-- {mib} MiB file")
+        with open(path, 'rb') as f:
+            ipfs_hash = measure("add_stream", lambda: ipfs_storage.add_stream(f))
+        with open(path, 'rb') as f:
+            written = store.blocks_written
+            measure("add_stream again (deduplicated)", lambda: ipfs_storage.add_stream(f))
+            print(f"{'':<40} {store.blocks_written - written} new blocks")
+        measure("open_stream (mmap)", lambda: drain(ipfs_storage.open_stream(ipfs_hash)))
+
+@benchmark('profile-publish')
+def bench_profile_publish(args):
+    """Signup write path with an inline IPFS add vs the profile outbox, then outbox drain throughput"""
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import User
+    from ipfs_service import ipfs_storage
+    from ipfs_cache import IPFSCache
+    from ipfs_gateways import GatewayPool
+    from profile_outbox import profile_outbox
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    ipfs_storage.ensure_initialized()
+    ipfs_storage.dev_mode = False
+    ipfs_storage.ipfs_api = f'{url}/api/v0'
+    ipfs_storage.gateways = GatewayPool([f'{url}/ipfs/'])
+    ipfs_storage.cache = IPFSCache(disk_path='')
+    rng = random.Random(args.seed)
+    print(f"-- IPFS API round trip {args.rpc_latency} ms, {profile_outbox.workers} publish workers")
+
+    def new_user():
+        name = f'user{rng.random()}'
+        user = User(username=name, email=f'{name}@example.com', password_hash='x')
+        return user, {'username': name, 'email': user.email, 'created_at': datetime.utcnow().isoformat()}
+
+    def inline_signup():
+        # The request path before the outbox: upload, then commit
+        user, profile = new_user()
+        user.ipfs_profile_hash = ipfs_storage.add_json(profile)
+        db.session.add(user)
+        db.session.commit()
+
+    def outbox_signup():
+        user, profile = new_user()
+        db.session.add(user)
+        profile_outbox.enqueue(user, profile)
+
+    with app.app_context():
+        report("inline IPFS add + commit", timed(inline_signup, args.repeat))
+        report("outbox enqueue + commit", timed(outbox_signup, args.repeat))
+        start = time.perf_counter()
+        published = profile_outbox.drain()
+        elapsed = time.perf_counter() - start
+        print(f"-- drained {published} profiles in {elapsed * 1000:.1f} ms ({published / elapsed:.0f} adds/sec)")
+
+        # Several edits per user before the publisher catches up
+        users = User.query.order_by(User.id).limit(max(1, args.repeat // 5)).all()
+        for user in users:
+            for edit in range(5):
+                profile_outbox.enqueue(user, {'username': user.username, 'edit': edit})
+        superseded = profile_outbox.superseded
+        published = profile_outbox.drain()
+        print(f"-- {len(users) * 5} updates for {len(users)} users: {published} adds, "
+              f"{profile_outbox.superseded - superseded} coalesced away")
+        stats = profile_outbox.stats()
+        print(f"-- queue depth {stats['queue_depth']}, lag p50 {stats['lag_p50_seconds']} s, "
+              f"p95 {stats['lag_p95_seconds']} s")
+    server.shutdown()
+
+@benchmark('ipfs-add-many')
+def bench_ipfs_add_many(args):
+    """Profile backfill throughput: one /add per document vs batched, parallel add_many"""
+    app = setup_environment(args.database_url)
+    from app import db
+    from models import User
+    from ipfs_service import ipfs_storage
+    from ipfs_cache import IPFSCache
+    from ipfs_gateways import GatewayPool
+    from profile_outbox import profile_document, backfill_profiles
+    from config import get_config
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    ipfs_storage.ensure_initialized()
+    ipfs_storage.dev_mode = False
+    ipfs_storage.ipfs_api = f'{url}/api/v0'
+    ipfs_storage.gateways = GatewayPool([f'{url}/ipfs/'])
+    ipfs_storage.cache = IPFSCache(disk_path='')
+    count = max(100, args.repeat * 20)
+    print(f"-- {count} profiles, IPFS API round trip {args.rpc_latency} ms")
+
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'backfill{i}', 'email': f'backfill{i}@example.com', 'password_hash': 'x',
+             'created_at': datetime.utcnow()} for i in range(count)])
+        db.session.commit()
+        documents = {user.id: profile_document(user) for user in User.query.filter(User.username.like('backfill%'))}
+
+        def rate(label, func):
+            start = time.perf_counter()
+            added = func()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<40} {added:>6} in {elapsed * 1000:9.1f} ms   {added / elapsed:8.0f} objects/sec")
+
+        sample = dict(list(documents.items())[:max(20, count // 10)])
+        rate("add_json, one request each", lambda: sum(bool(ipfs_storage.add_json(doc)) for doc in sample.values()))
+        rate("add_many, 1 request in flight", lambda: len(ipfs_storage.add_many(documents, concurrency=1)))
+        rate(f"add_many, {get_config().IPFS_ADD_CONCURRENCY} requests in flight",
+             lambda: len(ipfs_storage.add_many(documents)))
+        result = backfill_profiles()
+        print(f"-- backfill_profiles: {result}")
+    server.shutdown()
+
+@benchmark('ipfs-codecs')
+def bench_ipfs_codecs(args):
+    """Profile document encodings: encode/decode time and stored bytes per codec and compression"""
+    os.environ.setdefault('DEV_MODE', 'true')
+    logging.disable(logging.WARNING)
+    from ipfs_codecs import CODECS, COMPRESSIONS, DocumentCodec, missing_package
+
+    rng = random.Random(args.seed)
+
+    def profile(rides, reviews):
+        return {
+            'username': f'rider{rng.randrange(100000)}',
+            'email': f'rider{rng.randrange(100000)}@example.com',
+            'wallet_address': '0x' + ''.join(rng.choice('0123456789abcdef') for _ in range(40)),
+            'phone_number': f'+1555{rng.randrange(1000000):07d}',
+            'reputation_score': round(rng.uniform(1, 5), 2),
+            'created_at': datetime.utcnow().isoformat(),
+            'rides': [{
+                'ride_id': rng.randrange(1000000),
+                'origin': 'Downtown Transit Center', 'destination': 'Airport Terminal B',
+                'origin_lat': rng.uniform(-90, 90), 'origin_lng': rng.uniform(-180, 180),
+                'departure_time': (datetime.utcnow() - timedelta(days=i)).isoformat(),
+                'seats': rng.randint(1, 4), 'price_per_seat': round(rng.uniform(5, 40), 2),
+                'status': rng.choice(['completed', 'cancelled']),
+            } for i in range(rides)],
+            'reviews': [{
+                'reviewer_id': rng.randrange(100000), 'rating': rng.randint(1, 5),
+                'comment': rng.choice(['Great ride, on time.', 'Friendly driver and a clean car.',
+                                       'Running a few minutes late but communicated well.', '']),
+            } for _ in range(reviews)],
+        }
+
+    for label, (rides, reviews) in (('new user', (0, 0)), ('regular', (25, 10)), ('frequent', (400, 120))):
+        documents = [profile(rides, reviews) for _ in range(10)]
+        print(f"-- {label} profile: {rides} rides, {reviews} reviews")
+        baseline = None
+        for codec in CODECS:
+            for compression in COMPRESSIONS:
+                missing = [missing_package(name) for name in (codec, compression) if missing_package(name)]
+                if missing:
+                    print(f"{codec + ' ' + (compression or 'raw'):<20} skipped, {', '.join(missing)} not installed")
+                    continue
+                encoder = DocumentCodec(codec, compression)
+                encoded = [encoder.encode(doc) for doc in documents]
+                size = statistics.mean(len(data) for data in encoded)
+                baseline = baseline or size
+                encode = statistics.median(timed(lambda: [encoder.encode(doc) for doc in documents], args.repeat))
+                decode = statistics.median(timed(lambda: [encoder.decode(data) for data in encoded], args.repeat))
+                print(f"{codec + ' ' + (compression or 'raw'):<20} {size:9.0f} bytes ({size / baseline:4.0%})   "
+                      f"encode {encode / len(documents):7.3f} ms   decode {decode / len(documents):7.3f} ms")
+
+@benchmark('user-loader')
+def bench_user_loader(args):
+    """Per-request cost of loading the logged-in user: database lookup vs user cache"""
+    app = setup_environment(args.database_url)
+    from sqlalchemy import text
+    from app import db
+    from models import User
+    from user_cache import UserCache
+
+    with app.app_context():
+        users = [User(username=f'loader{i}', email=f'loader{i}@example.com', password_hash='x') for i in range(100)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+    rng = random.Random(args.seed)
+    repeat = max(200, args.repeat * 10)
+
+    def per_request(func):
+        # A fresh session per call, like a request
+        def run():
+            with app.test_request_context():
+                func()
+        return run
+
+    if args.db_latency:
+        # Each statement waits as long as a round trip to a database server would
+        from sqlalchemy import event
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', lambda *_: time.sleep(args.db_latency / 1000))
+        print(f"-- database round trip {args.db_latency} ms")
+
+    uncached = UserCache()
+    uncached.ttl = 0
+    cached = UserCache()
+    report("request context only", timed(per_request(lambda: None), repeat))
+    report("database round trip (SELECT 1)", timed(per_request(lambda: db.session.execute(text('SELECT 1'))), repeat))
+    report("load_user, database", timed(per_request(lambda: uncached.load(rng.choice(user_ids))), repeat))
+    timed(per_request(lambda: cached.load(rng.choice(user_ids))), repeat)  # warm up
+    cached.hits = cached.misses = 0
+    with app.app_context(), count_queries(db.engine) as statements:
+        timed(per_request(lambda: cached.load(rng.choice(user_ids)).username), 100)
+    report("load_user, cached", timed(per_request(lambda: cached.load(rng.choice(user_ids))), repeat))
+    print(f"-- {len(statements)} queries for 100 cached loads, {cached.stats()['hit_rate']:.0%} hit rate")
+
+@benchmark('ipfs-gateways')
+def bench_ipfs_gateways(args):
+    """Gateway reads with tail latency: new connection per read vs pooled single gateway vs hedged pool"""
+    import requests
+    os.environ.setdefault('DEV_MODE', 'true')
+    logging.disable(logging.WARNING)
+    from ipfs_gateways import GatewayPool
+
+    # The fastest gateway is occasionally very slow, like a busy public gateway
+    random.seed(args.seed)
+    round_trip = args.rpc_latency / 1000
+    nodes = [start_standin_node(round_trip * factor) for factor in (1, 2, 4)]
+    nodes[0][1].slow_rate = 0.02
+    nodes[0][1].slow_delay = round_trip * 50
+    content = os.urandom(4096)
+    for _, server in nodes:
+        server.ipfs['bench'] = content
+    urls = [f'{url}/ipfs/' for url, _ in nodes]
+    reads = max(100, args.repeat * 4)
+    print(f"-- {reads} reads, gateway round trips {[round(args.rpc_latency * f, 1) for f in (1, 2, 4)]} ms, "
+          f"2% of reads on the first delayed {args.rpc_latency * 50:.0f} ms")
+
+    def report_tail(label, samples):
+        report(label, samples)
+        samples = sorted(samples)
+        print(f"{'':<40} p99    {samples[int(len(samples) * 0.99)]:8.3f} ms   max {samples[-1]:8.3f} ms")
+
+    report_tail("bare requests.get, one gateway", timed(lambda: requests.get(f'{urls[0]}bench', timeout=10), reads))
+
+    single = GatewayPool(urls[:1])
+    report_tail("pooled session, one gateway", timed(lambda: single.fetch('bench'), reads))
+
+    hedged = GatewayPool(urls)
+    timed(lambda: hedged.fetch('bench'), reads)  # warm up latency windows
+    hedged.reads = hedged.hedged = hedged.hedge_wins = 0
+    report_tail("pooled, hedged across three", timed(lambda: hedged.fetch('bench'), reads))
+    stats = hedged.stats()
+    print(f"-- hedged {stats['hedged']} of {stats['reads']} reads, {stats['hedge_wins']} won by the hedge")
+    for gateway in stats['gateways']:
+        print(f"   {gateway['url']:<40} requests {gateway['requests']:>5}  "
+              f"p50 {gateway['p50_ms']} ms  p95 {gateway['p95_ms']} ms")
+    for _, server in nodes:
+        server.shutdown()
+
+STARTUP_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+if sys.argv[1] == 'eager':
+    from blockchain_service import blockchain_service
+    from ipfs_service import ipfs_storage
+    blockchain_service.ensure_initialized()
+    ipfs_storage.ensure_initialized()
+ready = time.perf_counter()
+status = app.test_client().get('/api/rides').status_code
+served = time.perf_counter()
+print(json.dumps({'ready': (ready - started) * 1000, 'first_request': (served - started) * 1000, 'status': status}))
+"""
+
+@benchmark('startup')
+def bench_startup(args):
+    """Worker start to first response with lazy vs eager blockchain/IPFS connections to a slow node"""
+    import json
+    import subprocess
+
+    url, server = start_standin_node(args.rpc_latency / 1000)
+    runs = max(1, min(args.repeat, 10))
+    env = dict(os.environ, DEV_MODE='false', ETHEREUM_NODE_URL=url, IPFS_API_URL=f'{url}/api/v0',
+               INFURA_PROJECT_ID='bench', TX_PIPELINE_ENABLED='false')
+    print(f"-- stand-in node round trip {args.rpc_latency} ms, {runs} cold starts per mode")
+
+    for mode in ('eager', 'lazy'):
+        ready, first = [], []
+        for _ in range(runs):
+            path = os.path.join(tempfile.mkdtemp(prefix='carpool-bench-'), 'bench.db')
+            result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, mode],
+                                    env=dict(env, DATABASE_URL=f'sqlite:///{path}'),
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True)
+            timings = json.loads(result.stdout.strip().splitlines()[-1])
+            assert timings['status'] == 200, f"first request failed with {timings['status']}"
+            ready.append(timings['ready'])
+            first.append(timings['first_request'])
+        report(f"{mode}: import + create_app", ready)
+        report(f"{mode}: first /api/rides response", first)
+    server.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', nargs='?', help='Benchmark to run')
+    parser.add_argument('--list', action='store_true', help='List available benchmarks')
+    parser.add_argument('--database-url', help='Run against this database instead of a scratch SQLite file')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated table sizes')
+    parser.add_argument('--repeat', type=int, default=50, help='Iterations per measurement')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent workers for contention benchmarks')
+    parser.add_argument('--seats', type=int, default=50, help='Seats on the contended ride')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for generated data')
+    parser.add_argument('--rpc-latency', type=float, default=2.0, help='Stand-in node round trip in milliseconds')
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help='Added to every SQL statement in user-loader, like a networked database, in milliseconds')
+    args = parser.parse_args(argv)
+
+    if args.list or not args.benchmark:
+        for name, func in BENCHMARKS.items():
+            print(f"{name:<16} {func.__doc__}")
+        return 0
+
+    if args.benchmark not in BENCHMARKS:
+        parser.error(f"unknown benchmark: {args.benchmark}")
+
+    BENCHMARKS[args.benchmark](args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,107 @@
 import os
 import json
+import time
 import logging
+from decimal import Decimal, localcontext
+from eth_utils import get_abi_output_types
 from web3 import Web3
+from requests.exceptions import ConnectTimeout
+from web3.exceptions import TransactionNotFound, Web3RPCError
 from config import get_config
+from chain_cache import ChainReadCache
+from web3_provider import PooledHTTPProvider, CircuitOpenError
+from tx_manager import NonceManager, GasEstimateCache, GasFeeCache
+from dev_chain import CarpoolSimulator, SimulatedRevert
+from lazy_service import LazyService, LazyAttribute
 
 logger = logging.getLogger(__name__)
 
-class BlockchainService:
+WEI_PER_ETHER = Decimal(10 ** 18)
+
+class TransactionNotSentError(Exception):
+    """A transaction was refused before it reached the node, so sending it again is safe"""
+
+class TransactionMaybeSentError(Exception):
+    """Sending a transaction failed without telling whether the node got it"""
+
+    def __init__(self, tx_hash, message):
+        super().__init__(message)
+        self.tx_hash = tx_hash
+
+# Multicall3.aggregate3, enough ABI to batch view calls through it
+MULTICALL3_ABI = [{
+    'name': 'aggregate3',
+    'type': 'function',
+    'stateMutability': 'payable',
+    'inputs': [{'name': 'calls', 'type': 'tuple[]', 'components': [
+        {'name': 'target', 'type': 'address'},
+        {'name': 'allowFailure', 'type': 'bool'},
+        {'name': 'callData', 'type': 'bytes'}
+    ]}],
+    'outputs': [{'name': 'returnData', 'type': 'tuple[]', 'components': [
+        {'name': 'success', 'type': 'bool'},
+        {'name': 'returnData', 'type': 'bytes'}
+    ]}]
+}]
+
+def wei_to_ether(values):
+    """
+    Convert a list of wei amounts to ETH
+
+    Same result as Web3.from_wei(value, 'ether') per value, but the decimal
+    context and unit lookup are set up once for the whole list.
+    """
+    with localcontext() as ctx:
+        ctx.prec = 999
+        return [Decimal(value) / WEI_PER_ETHER for value in values]
+
+def _ride_from_tuple(ride, price):
+    return {
+        'driver': ride[0],
+        'start_location': ride[1],
+        'end_location': ride[2],
+        'price': price,
+        'available_seats': ride[4],
+        'is_available': ride[5]
+    }
+
+class BlockchainService(LazyService):
     """Service for interacting with the Ethereum blockchain"""
     
+    name = 'blockchain'
+    
+    # Set up by _connect() on first use
+    dev_mode = LazyAttribute()
+    w3 = LazyAttribute()
+    contract = LazyAttribute()
+    
     def __init__(self):
+        """Set up local state; the node is contacted lazily (see LazyService)"""
+        self._init_lazy()
+        
+        # Check if we should use real blockchain or dev mode
+        self._dev_mode = self._dev_mode_requested = os.environ.get("DEV_MODE", "false").lower() == "true"
+        self._w3 = None
+        self._contract = None
+        
+        # Stateful stand-in for the contract, used whenever dev mode is on
+        self.simulator = CarpoolSimulator()
+        
+        # Contract reads, reused until the head advances or we touch the ride
+        self.read_cache = ChainReadCache(head_block=self._head_block)
+        
+        # Local nonces and gas estimates for outgoing transactions
+        self.nonces = NonceManager(pending_count=self._pending_count, fill_gap=self._fill_nonce_gap)
+        self.gas_estimates = GasEstimateCache()
+        self.gas_fees = GasFeeCache(fetch=self._fetch_fees)
+    
+    def _connect(self):
         """Initialize the blockchain connection"""
         # Get configuration
         config = get_config()
         
-        # Check if we should use real blockchain or dev mode
-        self.dev_mode = os.environ.get("DEV_MODE", "false").lower() == "true"
-        
+        # A retry after a failed connection starts over from the configured mode
+        self.dev_mode = self._dev_mode_requested
         if self.dev_mode:
             logger.info("Running in development mode, blockchain operations will be simulated")
             self.w3 = None
@@ -39,28 +124,24 @@ class BlockchainService:
                 self.contract = None
                 return
                 
-            self.w3 = Web3(Web3.HTTPProvider(ethereum_url))
+            self.w3 = Web3(PooledHTTPProvider(ethereum_url))
             
             # Check connection
             if self.w3.is_connected():
                 logger.info(f"Connected to Ethereum node at {ethereum_url}")
                 logger.info(f"Current block number: {self.w3.eth.block_number}")
             else:
-                logger.error(f"Failed to connect to Ethereum node at {ethereum_url}")
-                logger.warning("Running in development mode due to connection failure")
-                self.dev_mode = True
-                self.w3 = None
+                raise ConnectionError(f"Failed to connect to Ethereum node at {ethereum_url}")
                 
             # Load smart contract
             self._load_contract()
             
         except Exception as e:
             logger.error(f"Error initializing blockchain service: {str(e)}")
-            logger.warning("Running in development mode due to initialization error")
-            # Initialize with None values instead of raising an exception
-            self.dev_mode = True
+            # Unavailable, not simulated, until the connection is retried (see LazyService)
             self.w3 = None
             self.contract = None
+            raise
     
     def _load_contract(self):
         """Load the compiled smart contract"""
@@ -99,140 +180,371 @@ class BlockchainService:
             logger.error(f"Error loading contract: {str(e)}")
             self.contract = None
     
-    def create_ride(self, driver_address, start_location, end_location, price, available_seats):
-        """Create a new ride on the blockchain"""
-        # In dev mode, simulate a successful transaction
+    def _check_health(self):
+        if self.dev_mode or not self.w3:
+            return None
+        healthy = self.w3.is_connected()
+        if healthy:
+            # Unblock transactions queued behind nonces nothing reused
+            self.nonces.fill_gaps()
+        return healthy
+    
+    @property
+    def available(self):
+        """Whether contract calls can be made (a reachable node with the contract, or the dev mode simulator)"""
+        return self.dev_mode or bool(self.w3 and self.contract and self.healthy is not False)
+    
+    def _pending_count(self, address):
+        return self.w3.eth.get_transaction_count(address, 'pending')
+
+    def _fetch_fees(self):
+        priority = self.w3.eth.max_priority_fee
+        base = self.w3.eth.get_block('latest')['baseFeePerGas']
+        return {'maxFeePerGas': priority + 2 * base, 'maxPriorityFeePerGas': priority}
+
+    def _fill_nonce_gap(self, address, nonce):
+        """Use up an abandoned nonce with a zero-value transfer to self"""
+        tx_hash = self.w3.eth.send_transaction({'from': address, 'to': address, 'value': 0,
+                                                'gas': 21000, 'nonce': nonce})
+        logger.warning(f"Filled nonce gap {nonce} of {address} with transaction {tx_hash.hex()}")
+
+    def transaction_count(self, address, block='pending'):
+        """Transactions sent from an account, i.e. its next unused nonce ('latest' counts mined ones only)"""
         if self.dev_mode:
-            import random
-            # Generate mock transaction hash
-            tx_hash = '0x' + ''.join(random.choice('0123456789abcdef') for _ in range(64))
-            # Generate a mock ride ID
-            ride_id = random.randint(1, 1000)
-            
-            logger.info(f"Dev mode: Simulated ride creation with ID: {ride_id}")
-            return {
-                'tx_hash': tx_hash,
-                'ride_id': ride_id
-            }
+            return self.simulator.transaction_count(address)
+        return self.w3.eth.get_transaction_count(address, block)
+
+    def has_transaction(self, tx_hash):
+        """Whether the node knows a transaction, pending or mined"""
+        if self.dev_mode:
+            return self.simulator.has_transaction(tx_hash)
+        try:
+            self.w3.eth.get_transaction(tx_hash)
+            return True
+        except TransactionNotFound:
+            return False
+
+    def release_nonce(self, address, nonce):
+        """Give back the nonce of a signed transaction that never reached the node"""
+        if not self.dev_mode:
+            self.nonces.release(address, nonce)
+
+    def _send_transaction(self, call, params, on_nonce=None):
+        """
+        Send a contract transaction with a local nonce and a cached gas estimate
+
+        The node signs the transaction first and it is broadcast with
+        eth_sendRawTransaction, so its hash is known before it is sent.
+        on_nonce(sender, nonce, tx_hash) is called before each broadcast; if
+        it raises, the transaction is not sent. A "nonce too low" style
+        rejection, e.g. after another process sent from the same account,
+        resyncs the nonce from the node and retries.
+
+        Returns:
+            Transaction hash bytes
+
+        Raises:
+            TransactionNotSentError: If the transaction did not reach the node
+            TransactionMaybeSentError: If it may have been sent, e.g. the reply timed out
+        """
+        params = dict(params)
+        try:
+            params['gas'] = self.gas_estimates.estimate(call, params)
+            params.update(self.gas_fees.fees())
+        except Exception as e:
+            raise TransactionNotSentError(str(e)) from e
+        sender = params['from']
+        attempts = 5
+        for attempt in range(attempts):
+            params['nonce'] = self.nonces.allocate(sender)
+            try:
+                raw = self.w3.eth.sign_transaction(call.build_transaction(params))['raw']
+            except Exception as e:
+                self.nonces.release(sender, params['nonce'])
+                raise TransactionNotSentError(str(e)) from e
+            tx_hash = Web3.keccak(raw)
+            if on_nonce is not None:
+                try:
+                    on_nonce(sender, params['nonce'], Web3.to_hex(tx_hash))
+                except Exception:
+                    self.nonces.release(sender, params['nonce'])
+                    raise
+            try:
+                return self.w3.eth.send_raw_transaction(raw)
+            except (Web3RPCError, CircuitOpenError, ConnectTimeout) as e:
+                # The node answered with an error, or was never contacted
+                stale = self.nonces.release(sender, params['nonce'], e)
+                if not stale or attempt == attempts - 1:
+                    raise TransactionNotSentError(str(e)) from e
+                logger.warning(f"Stale nonce for {sender}, resyncing: {str(e)}")
+            except Exception as e:
+                # Keep the nonce: the pipeline looks the hash up before it is reused
+                raise TransactionMaybeSentError(Web3.to_hex(tx_hash), str(e)) from e
+
+    def submit_create_ride(self, driver_address, start_location, end_location, price, available_seats,
+                           on_nonce=None):
+        """
+        Send a createRide transaction without waiting for it to be mined
+        
+        Args:
+            on_nonce: Called with (sender, nonce, tx_hash) just before the transaction is sent
+        
+        Returns:
+            Transaction hash as a hex string
+        
+        Raises:
+            TransactionNotSentError: If it was refused before reaching the node, e.g. not connected
+            TransactionMaybeSentError: If it may have been sent
+        """
+        # In dev mode, send it to the simulator
+        if self.dev_mode:
+            tx_hash = self.simulator.create_ride(driver_address, start_location, end_location,
+                                                 Web3.to_wei(price, 'ether'), available_seats, on_nonce)
+            logger.info(f"Dev mode: Simulated ride creation transaction: {tx_hash}")
+            return tx_hash
             
         # Normal blockchain operation
         if not self.w3 or not self.contract:
-            logger.error("Blockchain service not properly initialized")
-            return None
+            raise TransactionNotSentError("Blockchain service not available")
         
         try:
             # Convert price from ETH to Wei
             price_wei = self.w3.to_wei(price, 'ether')
             
-            # Estimate gas
-            gas_estimate = self.contract.functions.createRide(
-                start_location, 
-                end_location, 
-                price_wei,
-                available_seats
-            ).estimate_gas({'from': driver_address})
-            
             # Execute transaction
-            tx_hash = self.contract.functions.createRide(
-                start_location, 
-                end_location, 
-                price_wei,
-                available_seats
-            ).transact({
-                'from': driver_address,
-                'gas': gas_estimate
-            })
-            
-            # Wait for transaction receipt
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-            logger.info(f"Ride created on blockchain. Transaction hash: {tx_hash.hex()}")
-            
-            # Get the ride ID from the event logs
-            ride_created_event = self.contract.events.RideCreated().process_receipt(tx_receipt)
-            ride_id = ride_created_event[0]['args']['rideId']
-            
-            return {
-                'tx_hash': tx_hash.hex(),
-                'ride_id': ride_id
-            }
+            tx_hash = self._send_transaction(
+                self.contract.functions.createRide(start_location, end_location, price_wei, available_seats),
+                {'from': driver_address}, on_nonce
+            )
+            logger.info(f"Ride creation submitted to blockchain. Transaction hash: {Web3.to_hex(tx_hash)}")
+            return Web3.to_hex(tx_hash)
             
         except Exception as e:
             logger.error(f"Error creating ride on blockchain: {str(e)}")
-            return None
+            raise
     
-    def book_ride(self, passenger_address, ride_id, price):
-        """Book a ride on the blockchain"""
-        # In dev mode, simulate a successful transaction
+    def submit_book_ride(self, passenger_address, ride_id, price, seats=1, on_nonce=None):
+        """
+        Send a bookRide transaction without waiting for it to be mined
+        
+        Args:
+            price: Price per seat in ETH
+            seats: Number of seats to book
+            on_nonce: Called with (sender, nonce, tx_hash) just before the transaction is sent
+        
+        Returns:
+            Transaction hash as a hex string
+        
+        Raises:
+            TransactionNotSentError: If it was refused before reaching the node, e.g. not connected
+            TransactionMaybeSentError: If it may have been sent
+        """
+        # Convert the per-seat price to Wei before multiplying, so the value is exact
+        price_wei = Web3.to_wei(price, 'ether') * seats
+        
+        # In dev mode, send it to the simulator
         if self.dev_mode:
-            import random
-            # Generate mock transaction hash
-            tx_hash = '0x' + ''.join(random.choice('0123456789abcdef') for _ in range(64))
-            
+            tx_hash = self.simulator.book_ride(passenger_address, ride_id, seats, price_wei, on_nonce)
             logger.info(f"Dev mode: Simulated ride booking for ride ID: {ride_id}")
-            return {
-                'tx_hash': tx_hash,
-                'status': 'success'
-            }
+            return tx_hash
             
         # Normal blockchain operation
         if not self.w3 or not self.contract:
+            raise TransactionNotSentError("Blockchain service not available")
+        
+        try:
+            # Book the ride (sending ETH)
+            tx_hash = self._send_transaction(
+                self.contract.functions.bookRide(ride_id, seats),
+                {'from': passenger_address, 'value': price_wei}, on_nonce
+            )
+            logger.info(f"Ride booking submitted to blockchain. Transaction hash: {Web3.to_hex(tx_hash)}")
+            return Web3.to_hex(tx_hash)
+            
+        except Exception as e:
+            logger.error(f"Error booking ride on blockchain: {str(e)}")
+            raise
+    
+    def submit_complete_ride(self, driver_address, ride_id, on_nonce=None):
+        """
+        Send a completeRide transaction without waiting for it to be mined
+        
+        Args:
+            on_nonce: Called with (sender, nonce, tx_hash) just before the transaction is sent
+        
+        Returns:
+            Transaction hash as a hex string
+        
+        Raises:
+            TransactionNotSentError: If it was refused before reaching the node, e.g. not connected
+            TransactionMaybeSentError: If it may have been sent
+        """
+        # In dev mode, send it to the simulator
+        if self.dev_mode:
+            tx_hash = self.simulator.complete_ride(driver_address, ride_id, on_nonce)
+            logger.info(f"Dev mode: Simulated ride completion for ride ID: {ride_id}")
+            return tx_hash
+            
+        # Normal blockchain operation
+        if not self.w3 or not self.contract:
+            raise TransactionNotSentError("Blockchain service not available")
+        
+        try:
+            # Complete the ride
+            tx_hash = self._send_transaction(
+                self.contract.functions.completeRide(ride_id),
+                {'from': driver_address}, on_nonce
+            )
+            logger.info(f"Ride completion submitted to blockchain. Transaction hash: {Web3.to_hex(tx_hash)}")
+            return Web3.to_hex(tx_hash)
+            
+        except Exception as e:
+            logger.error(f"Error completing ride on blockchain: {str(e)}")
+            raise
+    
+    @property
+    def supports_batch_complete(self):
+        """Whether the contract has completeRides(uint256[]) (the dev mode simulator does)"""
+        if self.dev_mode:
+            return True
+        if not self.contract:
+            return False
+        return any(item.get('type') == 'function' and item.get('name') == 'completeRides'
+                   for item in self.contract.abi)
+    
+    def submit_complete_rides(self, driver_address, ride_ids):
+        """
+        Send one completeRides transaction for several of a driver's rides
+        
+        Args:
+            driver_address: Ethereum address of the driver of every ride
+            ride_ids: On-chain ride IDs
+            
+        Returns:
+            Transaction hash as a hex string
+        
+        Raises:
+            TransactionNotSentError: If it was refused before reaching the node, e.g. not connected
+            TransactionMaybeSentError: If it may have been sent
+        """
+        ride_ids = list(ride_ids)
+        if self.dev_mode:
+            tx_hash = self.simulator.complete_rides(driver_address, ride_ids)
+            logger.info(f"Dev mode: Simulated completion of {len(ride_ids)} rides")
+            return tx_hash
+        
+        if not self.w3 or not self.contract:
+            raise TransactionNotSentError("Blockchain service not available")
+        if not self.supports_batch_complete:
+            raise TransactionNotSentError("Contract has no completeRides function")
+        
+        try:
+            tx_hash = self._send_transaction(
+                self.contract.functions.completeRides(ride_ids),
+                {'from': driver_address}
+            )
+            logger.info(f"Completion of {len(ride_ids)} rides submitted to blockchain. "
+                        f"Transaction hash: {Web3.to_hex(tx_hash)}")
+            return Web3.to_hex(tx_hash)
+            
+        except Exception as e:
+            logger.error(f"Error completing rides on blockchain: {str(e)}")
+            raise
+    
+    def get_receipt(self, tx_hash):
+        """
+        Look up a transaction receipt without blocking
+        
+        Returns:
+            The receipt, or None if the transaction has not been mined yet
+        """
+        if self.dev_mode:
+            return self.simulator.get_receipt(tx_hash)
+        
+        if not self.w3:
             logger.error("Blockchain service not properly initialized")
             return None
         
         try:
-            # Convert price from ETH to Wei
-            price_wei = self.w3.to_wei(price, 'ether')
-            
-            # Book the ride (sending ETH)
-            tx_hash = self.contract.functions.bookRide(ride_id, 1).transact({
-                'from': passenger_address,
-                'value': price_wei
-            })
+            return self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+    
+    def wait_for_receipt(self, tx_hash, timeout=120):
+        """Block until a transaction is mined and return its receipt"""
+        if self.dev_mode:
+            deadline = time.monotonic() + timeout
+            while (receipt := self.simulator.get_receipt(tx_hash)) is None:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Transaction {tx_hash} not mined after {timeout} seconds")
+                time.sleep(min(0.1, self.simulator.block_time / 4))
+            return receipt
+        return self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=timeout)
+    
+    def get_created_ride_id(self, receipt):
+        """Extract the on-chain ride ID from a createRide receipt's RideCreated event"""
+        if self.dev_mode:
+            return next(log['args']['rideId'] for log in receipt['logs'] if log['event'] == 'RideCreated')
+        ride_created_event = self.contract.events.RideCreated().process_receipt(receipt)
+        return ride_created_event[0]['args']['rideId']
+    
+    def create_ride(self, driver_address, start_location, end_location, price, available_seats):
+        """Create a new ride on the blockchain and wait for it to be mined"""
+        try:
+            tx_hash = self.submit_create_ride(driver_address, start_location, end_location, price, available_seats)
+            if not tx_hash:
+                return None
             
             # Wait for transaction receipt
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-            logger.info(f"Ride booked on blockchain. Transaction hash: {tx_hash.hex()}")
+            tx_receipt = self.wait_for_receipt(tx_hash)
+            logger.info(f"Ride created on blockchain. Transaction hash: {tx_hash}")
             
+            ride_id = self.get_created_ride_id(tx_receipt)
+            self.invalidate_ride(ride_id)
             return {
-                'tx_hash': tx_hash.hex(),
-                'status': 'success'
+                'tx_hash': tx_hash,
+                'ride_id': ride_id
             }
             
         except Exception as e:
-            logger.error(f"Error booking ride on blockchain: {str(e)}")
+            logger.error(f"Error creating ride on blockchain: {str(e)}")
             return None
     
-    def complete_ride(self, driver_address, ride_id):
-        """Mark a ride as completed on the blockchain"""
-        # In dev mode, simulate a successful transaction
-        if self.dev_mode:
-            import random
-            # Generate mock transaction hash
-            tx_hash = '0x' + ''.join(random.choice('0123456789abcdef') for _ in range(64))
+    def book_ride(self, passenger_address, ride_id, price, seats=1):
+        """Book a ride on the blockchain and wait for it to be mined"""
+        try:
+            tx_hash = self.submit_book_ride(passenger_address, ride_id, price, seats)
+            if not tx_hash:
+                return None
+            
+            # Wait for transaction receipt
+            self.wait_for_receipt(tx_hash)
+            logger.info(f"Ride booked on blockchain. Transaction hash: {tx_hash}")
+            self.invalidate_ride(ride_id)
             
-            logger.info(f"Dev mode: Simulated ride completion for ride ID: {ride_id}")
             return {
                 'tx_hash': tx_hash,
                 'status': 'success'
             }
             
-        # Normal blockchain operation
-        if not self.w3 or not self.contract:
-            logger.error("Blockchain service not properly initialized")
+        except Exception as e:
+            logger.error(f"Error booking ride on blockchain: {str(e)}")
             return None
-        
+    
+    def complete_ride(self, driver_address, ride_id):
+        """Mark a ride as completed on the blockchain and wait for it to be mined"""
         try:
-            # Complete the ride
-            tx_hash = self.contract.functions.completeRide(ride_id).transact({
-                'from': driver_address
-            })
+            tx_hash = self.submit_complete_ride(driver_address, ride_id)
+            if not tx_hash:
+                return None
             
             # Wait for transaction receipt
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-            logger.info(f"Ride completed on blockchain. Transaction hash: {tx_hash.hex()}")
+            self.wait_for_receipt(tx_hash)
+            logger.info(f"Ride completed on blockchain. Transaction hash: {tx_hash}")
+            self.invalidate_ride(ride_id)
             
             return {
-                'tx_hash': tx_hash.hex(),
+                'tx_hash': tx_hash,
                 'status': 'success'
             }
             
@@ -240,19 +552,124 @@ class BlockchainService:
             logger.error(f"Error completing ride on blockchain: {str(e)}")
             return None
     
-    def get_ride(self, ride_id):
+    def provider_stats(self):
+        """Connection pool, circuit breaker and RPC latency stats (None in dev mode)"""
+        if not self.w3 or not hasattr(self.w3.provider, 'stats'):
+            return None
+        return self.w3.provider.stats()
+
+    def _head_block(self):
+        """Current block number, from the node or the dev mode simulator"""
+        if self.dev_mode:
+            return self.simulator.block_number
+        if not self.w3:
+            return None
+        return self.w3.eth.block_number
+
+    def invalidate_ride(self, ride_id):
+        """Drop cached reads a transaction on this ride may have changed"""
+        self.invalidate_rides([ride_id])
+
+    def invalidate_rides(self, ride_ids):
+        """Drop cached reads of several rides in one pass over the cache"""
+        ride_ids = set(ride_ids)
+        self.read_cache.invalidate(
+            lambda key: key[0] == 'active_rides' or (key[0] == 'ride' and key[1] in ride_ids))
+
+    def get_ride(self, ride_id, use_cache=True):
+        """Get ride details from the blockchain, through the read cache"""
+        if not use_cache:
+            return self._fetch_ride(ride_id)
+        return self.read_cache.get(('ride', ride_id), lambda: self._fetch_ride(ride_id))
+
+    def get_active_rides(self, offset=0, limit=10, use_cache=True):
+        """Get active rides from the blockchain, through the read cache"""
+        if not use_cache:
+            return self._fetch_active_rides(offset, limit)
+        return self.read_cache.get(('active_rides', offset, limit),
+                                   lambda: self._fetch_active_rides(offset, limit))
+
+    def get_rides(self, ride_ids, use_cache=True):
+        """
+        Get details for many rides with as few RPC round trips as possible
+
+        Rides not in the read cache are fetched together, through Multicall3
+        when MULTICALL_ADDRESS is set and as JSON-RPC batches otherwise.
+
+        Args:
+            ride_ids: On-chain ride IDs
+            use_cache: Serve and store results through the read cache
+
+        Returns:
+            Dict of ride ID -> ride details (None for rides that could not be read)
+        """
+        ride_ids = list(dict.fromkeys(ride_ids))
+        if not use_cache:
+            return self._fetch_rides(ride_ids)
+
+        def load(keys):
+            rides = self._fetch_rides([key[1] for key in keys])
+            return {('ride', ride_id): ride for ride_id, ride in rides.items()}
+
+        found = self.read_cache.get_many([('ride', ride_id) for ride_id in ride_ids], load)
+        return {ride_id: found.get(('ride', ride_id)) for ride_id in ride_ids}
+
+    def _fetch_rides(self, ride_ids):
+        """Read rides in chunks of CHAIN_BATCH_SIZE; falls back to one call per ride"""
+        if self.dev_mode or not ride_ids:
+            return {ride_id: self._fetch_ride(ride_id) for ride_id in ride_ids}
+        if not self.w3 or not self.contract:
+            logger.error("Blockchain service not properly initialized")
+            return {ride_id: None for ride_id in ride_ids}
+
+        config = get_config()
+        fetch_chunk = self._multicall_rides if config.MULTICALL_ADDRESS else self._batch_rides
+        rides = {}
+        for start in range(0, len(ride_ids), config.CHAIN_BATCH_SIZE):
+            chunk = ride_ids[start:start + config.CHAIN_BATCH_SIZE]
+            try:
+                raw = fetch_chunk(chunk)
+            except Exception as e:
+                logger.warning(f"Bulk ride read failed, falling back to single calls: {str(e)}")
+                rides.update((ride_id, self._fetch_ride(ride_id)) for ride_id in chunk)
+                continue
+
+            prices = iter(wei_to_ether([ride[3] for ride in raw if ride is not None]))
+            for ride_id, ride in zip(chunk, raw):
+                rides[ride_id] = _ride_from_tuple(ride, next(prices)) if ride is not None else None
+        return rides
+
+    def _batch_rides(self, ride_ids):
+        """getRide for each ID in a single JSON-RPC batch request"""
+        with self.w3.batch_requests() as batch:
+            for ride_id in ride_ids:
+                batch.add(self.contract.functions.getRide(ride_id))
+            return batch.execute()
+
+    def _multicall_rides(self, ride_ids):
+        """getRide for each ID in a single eth_call to Multicall3.aggregate3"""
+        multicall = self.w3.eth.contract(address=Web3.to_checksum_address(get_config().MULTICALL_ADDRESS),
+                                         abi=MULTICALL3_ABI)
+        output_types = get_abi_output_types(self.contract.get_function_by_name('getRide').abi)
+        calls = [(self.contract.address, True, self.contract.encode_abi('getRide', args=[ride_id]))
+                 for ride_id in ride_ids]
+
+        raw = []
+        for success, data in multicall.functions.aggregate3(calls).call():
+            # Failed lookups (e.g. unknown ride IDs) revert individually
+            raw.append(self.w3.codec.decode(output_types, data) if success else None)
+        return raw
+
+    def _fetch_ride(self, ride_id):
         """Get ride details from the blockchain"""
-        # In dev mode, return mock ride data
+        # In dev mode, read the simulator's state
         if self.dev_mode:
-            logger.info(f"Dev mode: Returning mock ride data for ride ID: {ride_id}")
-            return {
-                'driver': '0x' + ''.join(['0' for _ in range(40)]),
-                'start_location': 'Mock Start Location',
-                'end_location': 'Mock End Location',
-                'price': 0.1,  # Mock price in ETH
-                'available_seats': 3,
-                'is_available': True
-            }
+            try:
+                ride = self.simulator.get_ride(ride_id)
+            except SimulatedRevert as e:
+                logger.error(f"Error getting ride from blockchain: {str(e)}")
+                return None
+            return _ride_from_tuple(ride, wei_to_ether([ride[3]])[0])
             
         # Normal blockchain operation
         if not self.w3 or not self.contract:
@@ -263,51 +680,28 @@ class BlockchainService:
             # Call the contract to get ride details
             ride = self.contract.functions.getRide(ride_id).call()
             
-            return {
-                'driver': ride[0],
-                'start_location': ride[1],
-                'end_location': ride[2],
-                'price': self.w3.from_wei(ride[3], 'ether'),
-                'available_seats': ride[4],
-                'is_available': ride[5]
-            }
+            return _ride_from_tuple(ride, wei_to_ether([ride[3]])[0])
             
         except Exception as e:
             logger.error(f"Error getting ride from blockchain: {str(e)}")
             return None
 
-    def get_active_rides(self, offset=0, limit=10):
+    def _fetch_active_rides(self, offset=0, limit=10):
         """Get active rides from the blockchain"""
-        # In dev mode, return mock ride data
-        if self.dev_mode:
-            import random
-            
-            # Create a list of mock rides
-            ride_list = []
-            for i in range(min(limit, 5)):  # Return up to 5 mock rides
-                ride_id = offset + i + 1
-                ride_list.append({
-                    'id': ride_id,
-                    'driver': '0x' + ''.join(['0' for _ in range(40)]),
-                    'start_location': f'Mock Start Location {ride_id}',
-                    'end_location': f'Mock End Location {ride_id}',
-                    'price': round(random.uniform(0.05, 0.5), 3),  # Random price between 0.05 and 0.5 ETH
-                    'available_seats': random.randint(1, 4)  # Random seats between 1 and 4
-                })
-                
-            logger.info(f"Dev mode: Returning {len(ride_list)} mock active rides")
-            return ride_list
-            
         # Normal blockchain operation
-        if not self.w3 or not self.contract:
+        if not self.dev_mode and (not self.w3 or not self.contract):
             logger.error("Blockchain service not properly initialized")
             return None
         
         try:
-            # Call the contract to get active rides
-            rides = self.contract.functions.getActiveRides(offset, limit).call()
+            # Call the contract (or, in dev mode, the simulator) to get active rides
+            if self.dev_mode:
+                rides = self.simulator.get_active_rides(offset, limit)
+            else:
+                rides = self.contract.functions.getActiveRides(offset, limit).call()
             
             # Format the results
+            prices = wei_to_ether(rides[4])
             ride_list = []
             for i in range(len(rides[0])):
                 ride_list.append({
@@ -315,7 +709,7 @@ class BlockchainService:
                     'driver': rides[1][i],
                     'start_location': rides[2][i],
                     'end_location': rides[3][i],
-                    'price': self.w3.from_wei(rides[4][i], 'ether'),
+                    'price': prices[i],
                     'available_seats': rides[5][i]
                 })
             
@@ -0,0 +1,185 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Sentinel returned by _fresh() for a missing or expired entry
+_MISS = object()
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class ChainReadCache:
+    """
+    Bounded LRU read-through cache for contract calls
+
+    An entry is served only while the chain head is still the block it was
+    read at and it is younger than the staleness budget (max_age). The head
+    is re-checked at most every head_refresh seconds, so a burst of page
+    views costs one eth_blockNumber instead of one eth_call each. Entries
+    for a ride can also be dropped explicitly when our own transactions
+    touch it.
+    """
+
+    def __init__(self, head_block=None, max_entries=None, max_age=None, head_refresh=None):
+        config = get_config()
+        self.head_block = head_block
+        self.max_entries = max_entries or config.CHAIN_CACHE_SIZE
+        self.max_age = max_age if max_age is not None else config.CHAIN_CACHE_MAX_AGE
+        self.head_refresh = head_refresh if head_refresh is not None else config.CHAIN_CACHE_HEAD_REFRESH
+
+        self._entries = OrderedDict()  # key -> (block, stored_at, value)
+        self._lock = threading.Lock()
+        self._head = None
+        self._head_checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._load_ms = deque(maxlen=1000)
+        self._lookup_ms = deque(maxlen=1000)
+
+    def _current_head(self):
+        """Latest known block number, refreshed at most every head_refresh seconds"""
+        if self.head_block is None:
+            return None
+        now = time.monotonic()
+        if now - self._head_checked_at >= self.head_refresh:
+            try:
+                self._head = self.head_block()
+            except Exception as e:
+                logger.warning(f"Could not read chain head: {str(e)}")
+                self._head = None
+            self._head_checked_at = now
+        return self._head
+
+    def _fresh(self, key, head, now):
+        """Cached value for key if still valid (caller holds the lock), else _MISS"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISS
+        block, stored_at, value = entry
+        if (head is None or block == head) and now - stored_at <= self.max_age:
+            self._entries.move_to_end(key)
+            return value
+        del self._entries[key]
+        return _MISS
+
+    def _store(self, key, head, now, value):
+        """Insert a value and evict the least recently used entries (caller holds the lock)"""
+        self._entries[key] = (head, now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, or call loader() and cache its result
+
+        None results (failed reads) are returned but not cached.
+        """
+        started = time.perf_counter()
+        head = self._current_head()
+        now = time.monotonic()
+
+        with self._lock:
+            value = self._fresh(key, head, now)
+            if value is not _MISS:
+                self.hits += 1
+                self._lookup_ms.append((time.perf_counter() - started) * 1000)
+                return value
+            self.misses += 1
+
+        load_started = time.perf_counter()
+        value = loader()
+        self._load_ms.append((time.perf_counter() - load_started) * 1000)
+
+        if value is not None:
+            with self._lock:
+                self._store(key, head, now, value)
+
+        self._lookup_ms.append((time.perf_counter() - started) * 1000)
+        return value
+
+    def get_many(self, keys, loader):
+        """
+        Bulk variant of get()
+
+        Args:
+            keys: Cache keys to look up
+            loader: Called once with the list of missing keys, returns a
+                dict of key -> value for them
+
+        Returns:
+            Dict of key -> value (None for keys the loader could not read)
+        """
+        started = time.perf_counter()
+        head = self._current_head()
+        now = time.monotonic()
+
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                value = self._fresh(key, head, now)
+                if value is _MISS:
+                    self.misses += 1
+                    missing.append(key)
+                else:
+                    self.hits += 1
+                    found[key] = value
+
+        if missing:
+            load_started = time.perf_counter()
+            loaded = loader(missing)
+            self._load_ms.append((time.perf_counter() - load_started) * 1000)
+
+            with self._lock:
+                for key in missing:
+                    found[key] = loaded.get(key)
+                    if found[key] is not None:
+                        self._store(key, head, now, found[key])
+
+        self._lookup_ms.append((time.perf_counter() - started) * 1000)
+        return found
+
+    def invalidate(self, predicate=None):
+        """Drop entries whose key matches predicate (all entries if None)"""
+        with self._lock:
+            if predicate is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if predicate(key)]
+                for key in keys:
+                    del self._entries[key]
+                dropped = len(keys)
+            self.invalidations += dropped
+        return dropped
+
+    def stats(self):
+        """Hit rate, size and latency percentiles (milliseconds)"""
+        lookups = self.hits + self.misses
+        load_ms = list(self._load_ms)
+        lookup_ms = list(self._lookup_ms)
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'lookup_ms_p50': _percentile(lookup_ms, 0.5),
+            'lookup_ms_p95': _percentile(lookup_ms, 0.95),
+            'rpc_ms_p50': _percentile(load_ms, 0.5),
+            'rpc_ms_p95': _percentile(load_ms, 0.95),
+        }
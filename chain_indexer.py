@@ -0,0 +1,302 @@
+import sys
+import logging
+import argparse
+import threading
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from sqlalchemy import delete
+from app import app, db, create_app
+from models import ChainRide, ChainEvent, IndexerCheckpoint
+from blockchain_service import blockchain_service
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Contract events that change a ride's state; missing ones are skipped
+TRACKED_EVENTS = ('RideCreated', 'RideBooked', 'RideCompleted', 'RideCancelled')
+
+# Checkpoint row holding the last fully indexed block
+CHECKPOINT = 'chain_events'
+
+def chain_ride_to_dict(chain_ride):
+    """Same shape as BlockchainService.get_ride()"""
+    return {
+        'driver': chain_ride.driver,
+        'start_location': chain_ride.start_location,
+        'end_location': chain_ride.end_location,
+        'price': chain_ride.price,
+        'available_seats': chain_ride.available_seats,
+        'is_available': chain_ride.is_available
+    }
+
+class ChainIndexer:
+    """
+    Mirrors contract events and ride state into local tables
+
+    Logs are fetched with eth_getLogs in block-range chunks, only up to
+    INDEXER_CONFIRMATIONS blocks behind the head. The hash of the last
+    indexed block is checkpointed; if it no longer matches the chain, a
+    reorg went deeper than expected and the indexer rewinds and re-reads
+    that range. Rides touched by an event are refreshed from the contract
+    once per chunk and stored in ChainRide, so page views read the DB.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.enabled = config.INDEXER_ENABLED
+        self.start_block = config.INDEXER_START_BLOCK
+        self.confirmations = config.INDEXER_CONFIRMATIONS
+        self.chunk_size = config.INDEXER_CHUNK_SIZE
+        self.poll_interval = config.INDEXER_POLL_INTERVAL
+
+        self._thread = None
+        self._stop = threading.Event()
+        self.blocks_indexed = 0
+        self.events_indexed = 0
+        self.reorgs = 0
+
+    @property
+    def available(self):
+        return bool(blockchain_service.w3 and blockchain_service.contract)
+
+    def _event_topics(self):
+        """Map of topic0 -> event name for tracked events present in the ABI"""
+        topics = {}
+        for abi in blockchain_service.contract.abi:
+            if abi.get('type') == 'event' and abi['name'] in TRACKED_EVENTS:
+                topics[Web3.to_hex(event_abi_to_log_topic(abi))] = abi['name']
+        return topics
+
+    def _checkpoint(self):
+        checkpoint = db.session.get(IndexerCheckpoint, CHECKPOINT)
+        if checkpoint is None:
+            checkpoint = IndexerCheckpoint(name=CHECKPOINT, position=self.start_block - 1)
+            db.session.add(checkpoint)
+        return checkpoint
+
+    def _block_hash(self, block_number):
+        return Web3.to_hex(blockchain_service.w3.eth.get_block(block_number)['hash'])
+
+    def _check_reorg(self, checkpoint):
+        """Rewind the checkpoint if the last indexed block was reorganized away"""
+        if checkpoint.block_hash is None or checkpoint.position < self.start_block:
+            return False
+        if self._block_hash(checkpoint.position) == checkpoint.block_hash:
+            return False
+
+        rewind_to = max(self.start_block - 1, checkpoint.position - self.confirmations)
+        logger.warning(f"Reorg detected at block {checkpoint.position}, rewinding to {rewind_to}")
+        db.session.execute(delete(ChainEvent).where(ChainEvent.block_number > rewind_to))
+        checkpoint.position = rewind_to
+        checkpoint.block_hash = self._block_hash(rewind_to) if rewind_to >= self.start_block else None
+        db.session.commit()
+        self.reorgs += 1
+        return True
+
+    def _fetch_logs(self, from_block, to_block, topics):
+        """eth_getLogs over a range, splitting it when the node rejects the size"""
+        try:
+            return blockchain_service.w3.eth.get_logs({
+                'fromBlock': from_block,
+                'toBlock': to_block,
+                'address': blockchain_service.contract.address,
+                'topics': [list(topics)]
+            })
+        except Exception as e:
+            if to_block <= from_block:
+                raise
+            middle = (from_block + to_block) // 2
+            logger.info(f"Splitting log range {from_block}-{to_block}: {str(e)}")
+            return (self._fetch_logs(from_block, middle, topics)
+                    + self._fetch_logs(middle + 1, to_block, topics))
+
+    def index_range(self, from_block, to_block):
+        """
+        Index events in [from_block, to_block] and refresh the rides they touch
+
+        Returns:
+            Number of events stored
+        """
+        topics = self._event_topics()
+        if not topics:
+            logger.warning("Contract ABI has none of the tracked events")
+            return 0
+
+        events = blockchain_service.contract.events
+        # Logs already stored for this range, e.g. when re-running a backfill
+        seen = set(db.session.execute(
+            db.select(ChainEvent.tx_hash, ChainEvent.log_index)
+            .where(ChainEvent.block_number.between(from_block, to_block))
+        ).all())
+        touched = {}
+        stored = 0
+        for log in self._fetch_logs(from_block, to_block, topics):
+            name = topics[Web3.to_hex(log['topics'][0])]
+            decoded = getattr(events, name)().process_log(log)
+            ride_id = decoded['args'].get('rideId')
+            tx_hash = Web3.to_hex(log['transactionHash'])
+
+            if (tx_hash, log['logIndex']) not in seen:
+                seen.add((tx_hash, log['logIndex']))
+                db.session.add(ChainEvent(
+                    block_number=log['blockNumber'],
+                    block_hash=Web3.to_hex(log['blockHash']),
+                    tx_hash=tx_hash,
+                    log_index=log['logIndex'],
+                    event=name,
+                    smart_contract_id=ride_id
+                ))
+                stored += 1
+            if ride_id is not None:
+                touched[ride_id] = max(touched.get(ride_id, 0), log['blockNumber'])
+
+        self.refresh_rides(touched)
+        return stored
+
+    def refresh_rides(self, touched):
+        """Store the current contract state of rides keyed by id -> last event block"""
+        for ride_id in touched:
+            blockchain_service.invalidate_ride(ride_id)
+        # Read through to the node in bulk; the events mean any cached copy is stale
+        states = blockchain_service.get_rides(list(touched), use_cache=False)
+        for ride_id, block_number in touched.items():
+            state = states.get(ride_id)
+            if state is None:
+                continue
+            db.session.merge(ChainRide(
+                smart_contract_id=ride_id,
+                driver=state['driver'],
+                start_location=state['start_location'],
+                end_location=state['end_location'],
+                price=state['price'],
+                available_seats=state['available_seats'],
+                is_available=state['is_available'],
+                last_event_block=block_number
+            ))
+
+    def sync(self, to_block=None):
+        """
+        Index from the checkpoint up to to_block (default: head minus confirmations)
+
+        Returns:
+            Number of events stored
+        """
+        if not self.available:
+            return 0
+
+        checkpoint = self._checkpoint()
+        self._check_reorg(checkpoint)
+
+        if to_block is None:
+            to_block = blockchain_service.w3.eth.block_number - self.confirmations
+
+        stored = 0
+        while checkpoint.position < to_block:
+            chunk_start = checkpoint.position + 1
+            chunk_end = min(chunk_start + self.chunk_size - 1, to_block)
+
+            stored += self.index_range(chunk_start, chunk_end)
+            checkpoint.position = chunk_end
+            checkpoint.block_hash = self._block_hash(chunk_end)
+            db.session.commit()
+
+            self.blocks_indexed += chunk_end - chunk_start + 1
+            logger.info(f"Indexed blocks {chunk_start}-{chunk_end}")
+
+        self.events_indexed += stored
+        return stored
+
+    def backfill(self, from_block, to_block=None):
+        """Re-index a historical range, then continue from wherever is furthest along"""
+        checkpoint = self._checkpoint()
+        resume_from = checkpoint.position
+        checkpoint.position = from_block - 1
+        checkpoint.block_hash = None
+        db.session.commit()
+
+        stored = self.sync(to_block)
+        if resume_from > checkpoint.position:
+            checkpoint.position = resume_from
+            checkpoint.block_hash = self._block_hash(resume_from)
+            db.session.commit()
+        return stored
+
+    def tail(self):
+        """Follow new blocks until stopped"""
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    self.sync()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Chain indexer error: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Tail the chain in a background thread when INDEXER_ENABLED is set"""
+        # Availability is checked by each sync, so starting never waits on the node
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.tail, name='chain-indexer', daemon=True)
+        self._thread.start()
+        logger.info("Chain indexer started")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def get_ride(self, smart_contract_id):
+        """
+        Get on-chain ride details, from the local mirror when indexed
+
+        Falls back to a contract call for rides the indexer has not seen yet.
+        """
+        chain_ride = db.session.get(ChainRide, smart_contract_id)
+        if chain_ride is not None:
+            return chain_ride_to_dict(chain_ride)
+        return blockchain_service.get_ride(smart_contract_id)
+
+    def stats(self):
+        checkpoint = db.session.get(IndexerCheckpoint, CHECKPOINT)
+        return {
+            'last_block': checkpoint.position if checkpoint else None,
+            'blocks_indexed': self.blocks_indexed,
+            'events_indexed': self.events_indexed,
+            'reorgs': self.reorgs,
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
+
+# Create a singleton instance
+chain_indexer = ChainIndexer()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index carpool contract events into the database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill = subparsers.add_parser('backfill', help='Index a historical block range')
+    backfill.add_argument('--from-block', type=int, default=None, help='First block (default: INDEXER_START_BLOCK)')
+    backfill.add_argument('--to-block', type=int, default=None, help='Last block (default: head minus confirmations)')
+    subparsers.add_parser('tail', help='Catch up, then follow new blocks')
+    args = parser.parse_args(argv)
+
+    create_app(start_background=False)
+    if not chain_indexer.available:
+        print("Blockchain service not available")
+        return 1
+
+    if args.command == 'backfill':
+        with app.app_context():
+            from_block = args.from_block if args.from_block is not None else chain_indexer.start_block
+            stored = chain_indexer.backfill(from_block, args.to_block)
+        print(f"Indexed {stored} events")
+    else:
+        try:
+            chain_indexer.tail()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -16,11 +16,123 @@ class Config:
     IPFS_API_KEY = os.environ.get("IPFS_API_KEY", "")
     IPFS_API_SECRET = os.environ.get("IPFS_API_SECRET", "")
     
+    # Cache of IPFS content by hash: memory LRU, then files in IPFS_CACHE_DIR ("" disables the disk tier)
+    IPFS_CACHE_MEMORY_BYTES = int(os.environ.get("IPFS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+    IPFS_CACHE_DIR = os.environ.get("IPFS_CACHE_DIR", os.path.join("instance", "ipfs_cache"))
+    IPFS_CACHE_DISK_BYTES = int(os.environ.get("IPFS_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+    IPFS_CACHE_VERIFY = os.environ.get("IPFS_CACHE_VERIFY", "false").lower() == "true"  # check content against CIDv0
+    IPFS_VERIFY_MAX_BYTES = int(os.environ.get("IPFS_VERIFY_MAX_BYTES", str(64 * 1024 * 1024)))  # larger CIDv0 content is not proxied
+    
+    # Dev mode IPFS blockstore, shared by the workers on a host
+    IPFS_DEV_STORE_DIR = os.environ.get("IPFS_DEV_STORE_DIR", os.path.join("instance", "ipfs_blocks"))
+    
+    # IPFS HTTP: comma-separated gateways for hedged reads, keep-alive pool and timeouts (seconds)
+    IPFS_GATEWAYS = os.environ.get("IPFS_GATEWAYS", IPFS_GATEWAY)
+    IPFS_POOL_SIZE = int(os.environ.get("IPFS_POOL_SIZE", "10"))
+    IPFS_CONNECT_TIMEOUT = float(os.environ.get("IPFS_CONNECT_TIMEOUT", "3"))
+    IPFS_TIMEOUT = float(os.environ.get("IPFS_TIMEOUT", "10"))
+    IPFS_UPLOAD_TIMEOUT = float(os.environ.get("IPFS_UPLOAD_TIMEOUT", "60"))
+    IPFS_ADD_BATCH_SIZE = int(os.environ.get("IPFS_ADD_BATCH_SIZE", "100"))  # objects per add_many request
+    IPFS_ADD_CONCURRENCY = int(os.environ.get("IPFS_ADD_CONCURRENCY", "4"))  # add_many requests in flight
+    # Encoding of add_json documents: json, dag-cbor or msgpack (needs the msgpack package),
+    # compressed with "", zlib or zstd (needs zstandard); get_json reads any of them
+    IPFS_CODEC = os.environ.get("IPFS_CODEC", "json")
+    IPFS_COMPRESSION = os.environ.get("IPFS_COMPRESSION", "")
+    IPFS_COMPRESSION_LEVEL = int(os.environ.get("IPFS_COMPRESSION_LEVEL", "3"))
+    IPFS_HEDGE_DELAY = float(os.environ.get("IPFS_HEDGE_DELAY", "0.5"))  # until a gateway has its own p95
+    
     # Smart contract configuration
     CONTRACT_ADDRESS = os.environ.get("CONTRACT_ADDRESS", "")
     
     # Infura project ID (needed for both Ethereum and IPFS)
     INFURA_PROJECT_ID = os.environ.get("INFURA_PROJECT_ID", "")
+    
+    # Blockchain/IPFS connections are made lazily and then health-checked in the background
+    SERVICE_PROBE_INTERVAL = float(os.environ.get("SERVICE_PROBE_INTERVAL", "30"))  # seconds
+    SERVICE_PROBE_TIMEOUT = float(os.environ.get("SERVICE_PROBE_TIMEOUT", "5"))  # seconds per IPFS check
+    
+    # Location search: minimum pg_trgm word similarity on PostgreSQL
+    SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get("SEARCH_SIMILARITY_THRESHOLD", "0.6"))
+    
+    # Home page feed cache (set HOME_FEED_CACHE_URL to a redis:// URL to share it across workers)
+    HOME_FEED_CACHE_TTL = int(os.environ.get("HOME_FEED_CACHE_TTL", "30"))
+    HOME_FEED_CACHE_URL = os.environ.get("HOME_FEED_CACHE_URL", "")
+    
+    # Logged-in user cache (USER_CACHE_URL shares it across workers through redis; a TTL of 0 disables it)
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_URL = os.environ.get("USER_CACHE_URL", "")
+    
+    # Background blockchain transaction pipeline
+    TX_PIPELINE_ENABLED = os.environ.get("TX_PIPELINE_ENABLED", "true").lower() == "true"
+    TX_PIPELINE_POLL_INTERVAL = float(os.environ.get("TX_PIPELINE_POLL_INTERVAL", "2"))
+    TX_PIPELINE_MAX_ATTEMPTS = int(os.environ.get("TX_PIPELINE_MAX_ATTEMPTS", "3"))
+    TX_PIPELINE_RECEIPT_TIMEOUT = int(os.environ.get("TX_PIPELINE_RECEIPT_TIMEOUT", "600"))
+    TX_PIPELINE_SUBMIT_TIMEOUT = int(os.environ.get("TX_PIPELINE_SUBMIT_TIMEOUT", "120"))  # seconds in 'submitting' before recovery
+    
+    # Background IPFS profile publishing (profile_outbox.py)
+    PROFILE_PUBLISH_ENABLED = os.environ.get("PROFILE_PUBLISH_ENABLED", "true").lower() == "true"
+    PROFILE_PUBLISH_WORKERS = int(os.environ.get("PROFILE_PUBLISH_WORKERS", "4"))  # concurrent IPFS adds
+    PROFILE_PUBLISH_POLL_INTERVAL = float(os.environ.get("PROFILE_PUBLISH_POLL_INTERVAL", "2"))
+    PROFILE_PUBLISH_MAX_ATTEMPTS = int(os.environ.get("PROFILE_PUBLISH_MAX_ATTEMPTS", "5"))
+    PROFILE_PUBLISH_BACKOFF = float(os.environ.get("PROFILE_PUBLISH_BACKOFF", "5"))  # seconds before the first retry, doubled after each failure
+    PROFILE_PUBLISH_MAX_BACKOFF = float(os.environ.get("PROFILE_PUBLISH_MAX_BACKOFF", "600"))
+    PROFILE_PUBLISH_RETRY_FAILED = float(os.environ.get("PROFILE_PUBLISH_RETRY_FAILED", "3600"))  # seconds before a failed document is queued again, 0 never
+    PROFILE_PUBLISH_TIMEOUT = int(os.environ.get("PROFILE_PUBLISH_TIMEOUT", "300"))  # seconds before a claimed row is retried
+    
+    # On-chain event indexer (run with `python chain_indexer.py tail`, or in-process when enabled)
+    INDEXER_ENABLED = os.environ.get("INDEXER_ENABLED", "false").lower() == "true"
+    INDEXER_START_BLOCK = int(os.environ.get("INDEXER_START_BLOCK", "0"))  # contract deployment block
+    INDEXER_CONFIRMATIONS = int(os.environ.get("INDEXER_CONFIRMATIONS", "12"))  # reorg depth
+    INDEXER_CHUNK_SIZE = int(os.environ.get("INDEXER_CHUNK_SIZE", "5000"))  # blocks per eth_getLogs
+    INDEXER_POLL_INTERVAL = float(os.environ.get("INDEXER_POLL_INTERVAL", "12"))
+    
+    # Read-through cache for getRide/getActiveRides contract calls
+    CHAIN_CACHE_SIZE = int(os.environ.get("CHAIN_CACHE_SIZE", "2048"))  # entries
+    CHAIN_CACHE_MAX_AGE = float(os.environ.get("CHAIN_CACHE_MAX_AGE", "15"))  # staleness budget, seconds
+    CHAIN_CACHE_HEAD_REFRESH = float(os.environ.get("CHAIN_CACHE_HEAD_REFRESH", "2"))  # seconds between head checks
+    
+    # Ethereum node HTTP client (web3_provider.py)
+    WEB3_POOL_SIZE = int(os.environ.get("WEB3_POOL_SIZE", "10"))  # >= request threads + background workers
+    WEB3_TIMEOUT = float(os.environ.get("WEB3_TIMEOUT", "10"))  # default read timeout, seconds
+    WEB3_CONNECT_TIMEOUT = float(os.environ.get("WEB3_CONNECT_TIMEOUT", "3"))
+    WEB3_METHOD_TIMEOUTS = os.environ.get(
+        "WEB3_METHOD_TIMEOUTS", "eth_call=5,eth_blockNumber=3,eth_getLogs=30,eth_sendTransaction=20")
+    WEB3_RETRIES = int(os.environ.get("WEB3_RETRIES", "2"))  # extra attempts for idempotent reads
+    WEB3_RETRY_BACKOFF = float(os.environ.get("WEB3_RETRY_BACKOFF", "0.2"))  # seconds, doubled per attempt
+    WEB3_BREAKER_THRESHOLD = int(os.environ.get("WEB3_BREAKER_THRESHOLD", "5"))  # consecutive failures
+    WEB3_BREAKER_COOLDOWN = float(os.environ.get("WEB3_BREAKER_COOLDOWN", "30"))  # seconds before a trial call
+    
+    # Transaction submission: cached eth_estimateGas results per call shape
+    GAS_ESTIMATE_TTL = float(os.environ.get("GAS_ESTIMATE_TTL", "300"))  # seconds
+    GAS_ESTIMATE_MARGIN = float(os.environ.get("GAS_ESTIMATE_MARGIN", "1.2"))  # headroom over the estimate
+    GAS_FEE_TTL = float(os.environ.get("GAS_FEE_TTL", "12"))  # seconds fee fields are reused for
+    NONCE_GAP_TIMEOUT = float(os.environ.get("NONCE_GAP_TIMEOUT", "30"))  # seconds before an unused released nonce is filled
+    
+    # Dev mode contract simulator
+    DEV_CHAIN_BLOCK_TIME = float(os.environ.get("DEV_CHAIN_BLOCK_TIME", "0"))  # seconds; 0 mines each tx at once
+    DEV_CHAIN_LATENCY = float(os.environ.get("DEV_CHAIN_LATENCY", "0"))  # milliseconds per call
+    DEV_CHAIN_STATE_PATH = os.environ.get("DEV_CHAIN_STATE_PATH", os.path.join("instance", "dev_chain.json"))  # '' keeps it in memory
+    
+    # Bulk contract reads (get_rides): calls per JSON-RPC batch or Multicall3 aggregate
+    CHAIN_BATCH_SIZE = int(os.environ.get("CHAIN_BATCH_SIZE", "100"))
+    # Multicall3 is deployed at 0xcA11bde05977b3631167028862bE2a173976CA11 on most networks;
+    # leave empty to use JSON-RPC batches instead (e.g. on a local dev node)
+    MULTICALL_ADDRESS = os.environ.get("MULTICALL_ADDRESS", "")
+    
+    # Batch ride settlement (settlement.py)
+    SETTLEMENT_BATCH_SIZE = int(os.environ.get("SETTLEMENT_BATCH_SIZE", "50"))  # rides per completeRides transaction
+    SETTLEMENT_CONCURRENCY = int(os.environ.get("SETTLEMENT_CONCURRENCY", "8"))  # parallel submissions/receipt checks
+    SETTLEMENT_RECEIPT_TIMEOUT = float(os.environ.get("SETTLEMENT_RECEIPT_TIMEOUT", "300"))  # seconds
+    
+    # DB/chain reconciliation (run with `python reconciliation.py run`, or in-process when enabled)
+    RECONCILE_ENABLED = os.environ.get("RECONCILE_ENABLED", "false").lower() == "true"
+    RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", "300"))  # seconds between full passes
+    RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", "500"))  # rows per step
+    RECONCILE_GRACE = int(os.environ.get("RECONCILE_GRACE", "300"))  # seconds before a new row counts as stuck
+    RECONCILE_MAX_REQUEUES = int(os.environ.get("RECONCILE_MAX_REQUEUES", "3"))  # failed jobs before giving up
+    RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", "8"))  # parallel receipt lookups
+    RECONCILE_LEASE = float(os.environ.get("RECONCILE_LEASE", "120"))  # seconds a worker holds the pass without renewing
 
 class DevelopmentConfig(Config):
     """Development configuration"""
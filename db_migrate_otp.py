@@ -1,27 +1,24 @@
-from app import app, db
+from app import app, db, create_app
 import logging
-from sqlalchemy import text
+from migrations import upgrade
 
 logger = logging.getLogger(__name__)
 
 def migrate_database():
     """
     Add OTP fields to the User model in the database
+
+    Kept for existing deployment scripts; the columns are now added by
+    migration 1 in migrations.py, which this runs along with any other
+    pending migrations.
     """
     logger.info("Running OTP migration script...")
     
     try:
+        create_app(start_background=False)
         with app.app_context():
-            # Add OTP columns to User table
-            with db.engine.connect() as conn:
-                conn.execute(text("""
-                    ALTER TABLE "user" 
-                    ADD COLUMN IF NOT EXISTS otp_secret VARCHAR(32),
-                    ADD COLUMN IF NOT EXISTS otp_enabled BOOLEAN DEFAULT FALSE,
-                    ADD COLUMN IF NOT EXISTS otp_verified BOOLEAN DEFAULT FALSE;
-                """))
-                conn.commit()
-            logger.info("OTP columns added successfully")
+            upgrade()
+        logger.info("OTP columns added successfully")
     except Exception as e:
         logger.error(f"Migration failed: {str(e)}")
         return False
@@ -34,4 +31,4 @@ if __name__ == "__main__":
     if success:
         print("Migration completed successfully")
     else:
-        print("Migration failed")
\ No newline at end of file
+        print("Migration failed")
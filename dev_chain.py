@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    logger.warning("fcntl not available, dev chain state is kept in memory per process")
+
+class SimulatedRevert(Exception):
+    """A contract call the real carpool contract would reject"""
+
+class CarpoolSimulator:
+    """
+    In-memory, deterministic stand-in for the carpool contract in dev mode
+
+    Keeps the state the contract would: rides with sequential IDs, seat
+    counts, escrowed booking payments released to the driver on completion,
+    and the RideCreated/RideBooked/RideCompleted events. Transactions take
+    effect when they are submitted and their receipts (status 0 for calls
+    the contract would revert) appear once their block is mined.
+
+    With DEV_CHAIN_BLOCK_TIME = 0 every transaction is mined immediately in
+    its own block; otherwise blocks are produced every DEV_CHAIN_BLOCK_TIME
+    seconds. Every call sleeps DEV_CHAIN_LATENCY milliseconds, standing in
+    for the round trip to a node.
+
+    The chain is journaled to DEV_CHAIN_STATE_PATH, one JSON line per
+    transaction, under a file lock, so every worker process sees the same
+    chain and it survives restarts. Each call first replays the lines other
+    processes appended since. Set DEV_CHAIN_STATE_PATH to an empty string to
+    keep the chain in this process's memory only.
+    """
+
+    def __init__(self, block_time=None, latency=None, state_path=None):
+        config = get_config()
+        self.block_time = block_time if block_time is not None else config.DEV_CHAIN_BLOCK_TIME
+        self.latency = (latency if latency is not None else config.DEV_CHAIN_LATENCY) / 1000
+        self.state_path = state_path if state_path is not None else config.DEV_CHAIN_STATE_PATH
+        if fcntl is None:
+            self.state_path = ''
+        self._lock = threading.Lock()
+        self._header = None  # first journal line, naming the chain the replayed state belongs to
+        self._offset = 0  # journal bytes replayed so far
+        self._clear()
+        if self.state_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+
+    def _clear(self, started=None):
+        self._started = started if started is not None else time.time()
+        self._mined_blocks = 0
+        self.rides = {}
+        self.escrow = {}
+        self.balances = {}
+        self.events = []
+        self.receipts = {}
+        self.nonces = {}  # sender -> next nonce
+        self.tx_count = 0
+        self.reverted = 0
+
+    def _catch_up(self, journal):
+        """Replay journal lines appended since the last call, or all of them after a reset"""
+        journal.seek(0)
+        header = journal.readline()
+        if header != self._header:
+            self._clear(json.loads(header)['started'] if header else None)
+            self._header = header
+            self._offset = len(header)
+        journal.seek(self._offset)
+        for line in journal.read().splitlines():
+            self._record(json.loads(line))
+        self._offset = journal.tell()
+
+    @contextmanager
+    def _state(self, write=False):
+        """
+        Hold the chain for a call, with other processes' transactions replayed
+
+        Yields the journal, opened for appending, or None when the chain is
+        kept in memory.
+        """
+        with self._lock:
+            if not self.state_path:
+                yield None
+                return
+            with open(self.state_path, 'a+b') as journal:
+                fcntl.flock(journal, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+                self._catch_up(journal)
+                try:
+                    yield journal
+                except BaseException:
+                    # Changes made before the failure were not journaled; replay from scratch next time
+                    self._header = None
+                    raise
+
+    def _append(self, journal, entry):
+        if not self._header:
+            # A new chain: record when it started so every process counts the same blocks
+            self._header = (json.dumps({'started': self._started}) + '\n').encode()
+            journal.write(self._header)
+            self._offset = len(self._header)
+        line = (json.dumps(entry) + '\n').encode()
+        journal.write(line)
+        self._offset += len(line)
+
+    def reset(self):
+        """Drop all rides, balances, events and transactions"""
+        with self._state(write=True) as journal:
+            self._clear()
+            if journal is not None:
+                journal.truncate(0)
+                self._header = b''
+                self._offset = 0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def block_number(self):
+        self._wait()
+        with self._state():
+            return self._head()
+
+    def _head(self):
+        if self.block_time:
+            return int((time.time() - self._started) / self.block_time)
+        return self._mined_blocks
+
+    def _record(self, entry):
+        """Apply a journaled transaction: the rides it changed, its events and receipt"""
+        for ride_id, ride in entry['rides']:
+            self.rides[ride_id] = ride
+        for ride_id, amount in entry['escrow']:
+            self.escrow[ride_id] = amount
+        if entry['balance'] is not None:
+            self.balances[entry['from']] = entry['balance']
+        self.events.extend(entry['logs'])
+        self.receipts[entry['hash']] = {'status': entry['status'], 'blockNumber': entry['block'],
+                                        'transactionHash': entry['hash'], 'from': entry['from'],
+                                        'logs': entry['logs']}
+        self.nonces[entry['from']] = entry['nonce'] + 1
+        self.tx_count += 1
+        if not entry['status']:
+            self.reverted += 1
+        if not self.block_time:
+            self._mined_blocks = max(self._mined_blocks, entry['block'])
+
+    def _transact(self, sender, apply, on_nonce=None):
+        """
+        Run a state change as a transaction and record its receipt
+
+        on_nonce(sender, nonce, tx_hash) is called with the transaction's
+        nonce and hash before it takes effect; if it raises, nothing happens.
+        """
+        self._wait()
+        with self._state(write=True) as journal:
+            nonce = self.nonces.get(sender, 0)
+            tx_hash = '0x' + hashlib.sha256(f'carpool-dev-tx-{self.tx_count + 1}'.encode()).hexdigest()
+            if on_nonce is not None:
+                on_nonce(sender, nonce, tx_hash)
+            block = self._head() + 1
+
+            logs = []
+            try:
+                apply(logs)
+                status = 1
+            except SimulatedRevert as e:
+                logger.info(f"Dev chain: transaction from {sender} reverted: {str(e)}")
+                status = 0
+                logs = []
+
+            logs = [{'event': event, 'args': args, 'blockNumber': block,
+                     'transactionHash': tx_hash, 'logIndex': index}
+                    for index, (event, args) in enumerate(logs)]
+            # Every state change emits an event naming its ride
+            ride_ids = sorted({log['args']['rideId'] for log in logs})
+            entry = {'hash': tx_hash, 'from': sender, 'nonce': nonce, 'block': block, 'status': status,
+                     'logs': logs,
+                     'rides': [[ride_id, self.rides[ride_id]] for ride_id in ride_ids],
+                     'escrow': [[ride_id, self.escrow[ride_id]] for ride_id in ride_ids],
+                     'balance': self.balances.get(sender)}
+            if journal is not None:
+                self._append(journal, entry)
+            self._record(entry)
+        return tx_hash
+
+    def create_ride(self, sender, start_location, end_location, price_wei, available_seats, on_nonce=None):
+        """createRide; returns the transaction hash"""
+        def apply(logs):
+            if available_seats <= 0:
+                raise SimulatedRevert('no seats')
+            ride_id = len(self.rides) + 1
+            self.rides[ride_id] = {
+                'driver': sender,
+                'start_location': start_location,
+                'end_location': end_location,
+                'price': price_wei,
+                'available_seats': available_seats,
+                'is_available': True,
+                'passengers': {},
+            }
+            self.escrow[ride_id] = 0
+            logs.append(('RideCreated', {'rideId': ride_id, 'driver': sender, 'price': price_wei}))
+        return self._transact(sender, apply, on_nonce)
+
+    def book_ride(self, sender, ride_id, seats, value, on_nonce=None):
+        """bookRide; the payment is held in escrow until the ride completes"""
+        def apply(logs):
+            ride = self.rides.get(ride_id)
+            if ride is None or not ride['is_available']:
+                raise SimulatedRevert('ride not available')
+            if seats <= 0 or ride['available_seats'] < seats:
+                raise SimulatedRevert('not enough seats')
+            if value != ride['price'] * seats:
+                raise SimulatedRevert('incorrect payment')
+            ride['available_seats'] -= seats
+            ride['passengers'][sender] = ride['passengers'].get(sender, 0) + seats
+            self.escrow[ride_id] += value
+            logs.append(('RideBooked', {'rideId': ride_id, 'passenger': sender, 'seats': seats}))
+        return self._transact(sender, apply, on_nonce)
+
+    def _check_completable(self, sender, ride_id):
+        ride = self.rides.get(ride_id)
+        if ride is None or not ride['is_available']:
+            raise SimulatedRevert('ride not available')
+        if ride['driver'] != sender:
+            raise SimulatedRevert('only the driver can complete the ride')
+
+    def _complete(self, sender, ride_id, logs):
+        self.rides[ride_id]['is_available'] = False
+        self.balances[sender] = self.balances.get(sender, 0) + self.escrow[ride_id]
+        self.escrow[ride_id] = 0
+        logs.append(('RideCompleted', {'rideId': ride_id}))
+
+    def complete_ride(self, sender, ride_id, on_nonce=None):
+        """completeRide; only the driver may call it, and escrow is paid out to them"""
+        def apply(logs):
+            self._check_completable(sender, ride_id)
+            self._complete(sender, ride_id, logs)
+        return self._transact(sender, apply, on_nonce)
+
+    def complete_rides(self, sender, ride_ids, on_nonce=None):
+        """completeRides; reverts as a whole if any of the rides could not be completed"""
+        def apply(logs):
+            if len(set(ride_ids)) != len(ride_ids):
+                raise SimulatedRevert('duplicate ride')
+            for ride_id in ride_ids:
+                self._check_completable(sender, ride_id)
+            for ride_id in ride_ids:
+                self._complete(sender, ride_id, logs)
+        return self._transact(sender, apply, on_nonce)
+
+    def transaction_count(self, sender):
+        """Transactions sent from an account, i.e. its next nonce"""
+        self._wait()
+        with self._state():
+            return self.nonces.get(sender, 0)
+
+    def has_transaction(self, tx_hash):
+        """Whether a transaction was sent, mined or still pending"""
+        with self._state():
+            return tx_hash in self.receipts
+
+    def get_receipt(self, tx_hash):
+        """Receipt of a mined transaction, None while it is pending or unknown"""
+        self._wait()
+        with self._state():
+            receipt = self.receipts.get(tx_hash)
+            if receipt is None or receipt['blockNumber'] > self._head():
+                return None
+            return receipt
+
+    def get_ride(self, ride_id):
+        """getRide as the contract returns it: (driver, start, end, price, seats, available)"""
+        self._wait()
+        with self._state():
+            ride = self.rides.get(ride_id)
+            if ride is None:
+                raise SimulatedRevert('ride does not exist')
+            return (ride['driver'], ride['start_location'], ride['end_location'],
+                    ride['price'], ride['available_seats'], ride['is_available'])
+
+    def get_active_rides(self, offset, limit):
+        """getActiveRides as the contract returns it: parallel arrays of ride fields"""
+        self._wait()
+        with self._state():
+            active = [(ride_id, ride) for ride_id, ride in self.rides.items() if ride['is_available']]
+            page = active[offset:offset + limit]
+            return ([ride_id for ride_id, _ in page],
+                    [ride['driver'] for _, ride in page],
+                    [ride['start_location'] for _, ride in page],
+                    [ride['end_location'] for _, ride in page],
+                    [ride['price'] for _, ride in page],
+                    [ride['available_seats'] for _, ride in page])
+
+    def get_events(self, from_block=0, to_block=None):
+        """Mined events in a block range"""
+        with self._state():
+            head = self._head() if to_block is None else min(to_block, self._head())
+            return [log for log in self.events if from_block <= log['blockNumber'] <= head]
+
+    def stats(self):
+        with self._state():
+            return {
+                'block_number': self._head(),
+                'rides': len(self.rides),
+                'active_rides': sum(1 for ride in self.rides.values() if ride['is_available']),
+                'transactions': self.tx_count,
+                'reverted': self.reverted,
+                'escrow_wei': sum(self.escrow.values()),
+                'paid_out_wei': sum(self.balances.values()),
+            }
@@ -0,0 +1,170 @@
+import json
+import time
+import logging
+import threading
+from types import SimpleNamespace
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+def _snapshot(ride):
+    """Copy the fields the home page shows into plain, JSON-safe values"""
+    return {
+        'id': ride.id,
+        'start_location': ride.start_location,
+        'end_location': ride.end_location,
+        'departure_time': ride.departure_time.isoformat(),
+        'price': ride.price,
+        'available_seats': ride.available_seats,
+        'driver_id': ride.driver_id,
+        'smart_contract_id': ride.smart_contract_id,
+        'is_active': ride.is_active,
+        'created_at': ride.created_at.isoformat() if ride.created_at else None,
+        'driver': {
+            'id': ride.driver.id,
+            'username': ride.driver.username,
+            'reputation': ride.driver.reputation,
+        },
+    }
+
+def _to_view(snapshot):
+    """Turn a snapshot back into an object templates can use like a Ride"""
+    values = dict(snapshot)
+    values['departure_time'] = datetime.fromisoformat(values['departure_time'])
+    if values['created_at']:
+        values['created_at'] = datetime.fromisoformat(values['created_at'])
+    values['driver'] = SimpleNamespace(**values['driver'])
+    return SimpleNamespace(**values)
+
+class FeedCache:
+    """
+    Cache for the home page's latest-rides feed
+
+    Entries live in process memory, or in Redis when HOME_FEED_CACHE_URL is
+    set so every worker shares (and invalidates) the same copy. Routes that
+    change rides call invalidate() after committing.
+
+    invalidate() bumps a generation counter. A feed loaded under an older
+    generation is not stored, so a load that raced an invalidation cannot
+    put the stale feed back for the whole TTL. In Redis the generation is
+    part of the key, and entries are written with SET NX.
+    """
+
+    KEY = 'carpool:home:latest_rides'
+
+    def __init__(self):
+        config = get_config()
+        self.ttl = config.HOME_FEED_CACHE_TTL
+        self.redis = None
+        self._lock = threading.Lock()
+        self._local = {}  # limit -> (expires_at, snapshots)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if config.HOME_FEED_CACHE_URL:
+            try:
+                import redis
+                self.redis = redis.Redis.from_url(config.HOME_FEED_CACHE_URL)
+                logger.info("Home feed cache using shared Redis backend")
+            except ImportError:
+                logger.warning("redis package not installed, home feed cache is per-process")
+
+    def _load(self, limit):
+        from models import Ride
+        rides = (Ride.query.options(joinedload(Ride.driver))
+                 .filter_by(is_active=True)
+                 .order_by(Ride.created_at.desc())
+                 .limit(limit)
+                 .all())
+        return [_snapshot(ride) for ride in rides]
+
+    def _current_generation(self):
+        if self.redis is not None:
+            try:
+                return int(self.redis.get(f'{self.KEY}:generation') or 0)
+            except Exception as e:
+                logger.warning(f"Home feed cache read failed: {str(e)}")
+                return None
+        with self._lock:
+            return self._generation
+
+    def _get_cached(self, limit, generation):
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(f'{self.KEY}:{generation}:{limit}')
+                return json.loads(raw) if raw is not None else None
+            except Exception as e:
+                logger.warning(f"Home feed cache read failed: {str(e)}")
+                return None
+
+        with self._lock:
+            entry = self._local.get(limit)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _set_cached(self, limit, snapshots, generation):
+        if self.redis is not None:
+            # After an invalidation readers use the next generation's key, so a late write here is never read
+            try:
+                self.redis.set(f'{self.KEY}:{generation}:{limit}', json.dumps(snapshots), ex=self.ttl, nx=True)
+            except Exception as e:
+                logger.warning(f"Home feed cache write failed: {str(e)}")
+            return
+
+        with self._lock:
+            if generation == self._generation:
+                self._local[limit] = (time.monotonic() + self.ttl, snapshots)
+
+    def get_latest_rides(self, limit=5):
+        """
+        Get the newest active rides, newest first
+
+        Args:
+            limit: Number of rides to return
+
+        Returns:
+            List of ride snapshots with attribute access (ride.driver.username)
+        """
+        generation = self._current_generation()
+        snapshots = self._get_cached(limit, generation) if generation is not None else None
+        if snapshots is None:
+            self.misses += 1
+            snapshots = self._load(limit)
+            if generation is not None:
+                self._set_cached(limit, snapshots, generation)
+        else:
+            self.hits += 1
+        return [_to_view(snapshot) for snapshot in snapshots]
+
+    def invalidate(self):
+        """Drop cached feeds; call after committing a ride change"""
+        self.invalidations += 1
+        with self._lock:
+            self._generation += 1
+            self._local.clear()
+
+        if self.redis is not None:
+            # Older generations' keys are no longer read and expire with their TTL
+            try:
+                self.redis.incr(f'{self.KEY}:generation')
+            except Exception as e:
+                logger.warning(f"Home feed cache invalidation failed: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'redis' if self.redis is not None else 'local',
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+# Create a singleton instance
+feed_cache = FeedCache()
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+from datetime import datetime, timezone
+from flask import request, make_response
+from sqlalchemy import event, select, update, insert
+from app import db
+from models import Ride, CollectionVersion, ChainRide
+
+logger = logging.getLogger(__name__)
+
+# CollectionVersion row covering the set of active rides
+ACTIVE_RIDES = 'active_rides'
+
+def bump_collection_version(connection, name=ACTIVE_RIDES):
+    """
+    Increment a collection version inside the caller's transaction
+
+    ORM writes to Ride are tracked automatically; call this after Core
+    UPDATE/INSERT statements against the ride table.
+    """
+    table = CollectionVersion.__table__
+    now = datetime.utcnow()
+    result = connection.execute(
+        update(table)
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        # Normally seeded at startup by ensure_collection_versions()
+        connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+
+def ensure_collection_versions():
+    """Create the version rows up front so writers only ever UPDATE them"""
+    CollectionVersion.__table__.create(db.engine, checkfirst=True)
+    if db.session.get(CollectionVersion, ACTIVE_RIDES) is None:
+        db.session.add(CollectionVersion(name=ACTIVE_RIDES, version=0))
+        db.session.commit()
+
+@event.listens_for(Ride, 'after_insert')
+def _ride_inserted(mapper, connection, ride):
+    bump_collection_version(connection)
+
+@event.listens_for(Ride, 'after_update')
+def _ride_updated(mapper, connection, ride):
+    # Changes to rides that were already inactive don't affect the active set
+    history = db.inspect(ride).attrs.is_active.history
+    if ride.is_active or history.has_changes():
+        bump_collection_version(connection)
+
+@event.listens_for(Ride, 'after_delete')
+def _ride_deleted(mapper, connection, ride):
+    bump_collection_version(connection)
+
+def get_collection_version(name=ACTIVE_RIDES):
+    """Return (version, updated_at) for a collection without touching its rows"""
+    row = db.session.execute(
+        select(CollectionVersion.version, CollectionVersion.updated_at)
+        .where(CollectionVersion.name == name)
+    ).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
+
+def get_ride_version(ride_id):
+    """
+    Return versions for a single ride, or None if it doesn't exist
+
+    The row has the ride's version and updated_at, its smart_contract_id,
+    and chain_block/chain_updated_at from the indexer's ChainRide mirror
+    (None until the ride's contract events have been indexed).
+    """
+    return db.session.execute(
+        select(Ride.version, Ride.updated_at, Ride.smart_contract_id,
+               ChainRide.last_event_block.label('chain_block'),
+               ChainRide.updated_at.label('chain_updated_at'))
+        .outerjoin(ChainRide, ChainRide.smart_contract_id == Ride.smart_contract_id)
+        .where(Ride.id == ride_id)
+    ).first()
+
+def make_etag(*parts):
+    """Build an opaque entity tag from version components"""
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+def _as_http_date(value):
+    """Naive UTC datetime to the second-resolution aware value used by HTTP"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+def not_modified(etag, last_modified=None):
+    """
+    Answer a conditional GET from validators alone
+
+    Args:
+        etag: Current entity tag of the resource
+        last_modified: Naive UTC datetime of the last change, optional
+
+    Returns:
+        A 304 response if the client's copy is current, otherwise None
+    """
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(etag):
+            return None
+    elif request.if_modified_since and last_modified:
+        if _as_http_date(last_modified) > request.if_modified_since:
+            return None
+    else:
+        return None
+
+    response = make_response('', 304)
+    return add_validators(response, etag, last_modified)
+
+def add_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified and require revalidation on every use"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _as_http_date(last_modified)
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,144 @@
+import os
+import mmap
+import logging
+import tempfile
+import threading
+from config import get_config
+from ipfs_cid import CHUNK_SIZE, b58encode, cid_v0_of_chunks, decode_node, is_cid_v0
+
+logger = logging.getLogger(__name__)
+
+def rechunk(chunks, size=CHUNK_SIZE):
+    """Regroup an iterable of byte strings into size-byte chunks (the last may be shorter)"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+class Blockstore:
+    """
+    Content-addressed dag-pb blocks on disk, laid out like an IPFS node's
+
+    Files are split into CHUNK_SIZE leaves linked in the balanced DAG that
+    `ipfs add` builds, so hashes match a real node. Each block is stored
+    once under its multihash in IPFS_DEV_STORE_DIR, written atomically and
+    read back through mmap, so identical content shares blocks and every
+    worker process on the host sees the same files.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else get_config().IPFS_DEV_STORE_DIR
+        self._lock = threading.Lock()
+        self.files_added = 0
+        self.blocks_written = 0
+        self.blocks_deduplicated = 0
+        self.bytes_written = 0
+
+    def _file(self, key):
+        # Shard on the end of the hash; the start is the same for every CIDv0
+        return os.path.join(self.path, key[-3:-1], key)
+
+    def _put_block(self, multihash, block):
+        path = self._file(b58encode(multihash))
+        if os.path.exists(path):
+            with self._lock:
+                self.blocks_deduplicated += 1
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(block)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self.blocks_written += 1
+            self.bytes_written += len(block)
+
+    def add(self, content):
+        """
+        Store a file
+
+        Args:
+            content: bytes, or an iterable of byte strings of any size
+
+        Returns:
+            The file's CIDv0
+        """
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            data = bytes(content)
+            chunks = (data[offset:offset + CHUNK_SIZE] for offset in range(0, len(data), CHUNK_SIZE))
+        else:
+            chunks = rechunk(content)
+        ipfs_hash = cid_v0_of_chunks(chunks, on_block=self._put_block)
+        with self._lock:
+            self.files_added += 1
+        return ipfs_hash
+
+    def has(self, ipfs_hash):
+        return is_cid_v0(ipfs_hash) and os.path.exists(self._file(ipfs_hash))
+
+    def _read(self, key):
+        """Read-only mmap of a block; KeyError if it is not stored"""
+        try:
+            f = open(self._file(key), 'rb')
+        except FileNotFoundError:
+            raise KeyError(key)
+        with f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _walk(self, block):
+        links, (start, end), _ = decode_node(block)
+        if not links:
+            data = block[start:end]
+            block.close()
+            if data:
+                yield data
+            return
+        block.close()
+        for link in links:
+            yield from self._walk(self._read(b58encode(link)))
+
+    def open(self, ipfs_hash):
+        """
+        Iterator over a file's leaf chunks, in order
+
+        Raises:
+            KeyError: if the file is not stored
+        """
+        if not is_cid_v0(ipfs_hash):
+            raise KeyError(ipfs_hash)
+        return self._walk(self._read(ipfs_hash))
+
+    def size(self, ipfs_hash):
+        """File size in bytes, from the root block"""
+        if not is_cid_v0(ipfs_hash):
+            raise KeyError(ipfs_hash)
+        block = self._read(ipfs_hash)
+        try:
+            return decode_node(block)[2]
+        finally:
+            block.close()
+
+    def cat(self, ipfs_hash):
+        """Whole file as bytes"""
+        return b''.join(self.open(ipfs_hash))
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'files_added': self.files_added,
+            'blocks_written': self.blocks_written,
+            'blocks_deduplicated': self.blocks_deduplicated,
+            'bytes_written': self.bytes_written,
+        }
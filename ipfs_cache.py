@@ -0,0 +1,382 @@
+import io
+import os
+import re
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from config import get_config
+from ipfs_cid import cid_v0, cid_v0_of_file, is_cid_v0
+
+logger = logging.getLogger(__name__)
+
+# Hashes used as file names as-is; anything else is rejected
+SAFE_KEY = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+class MemoryLRU:
+    """Least-recently-used byte strings, bounded by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def fits(self, size):
+        # Objects over an eighth of the budget would flush everything else
+        return size <= self.max_bytes // 8
+
+    def put(self, key, data):
+        if not self.fits(len(data)):
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskStore:
+    """
+    Content-addressed files under a directory, evicted oldest-read first
+
+    Files are written to a temporary name and renamed into place, so a
+    reader (in this or another worker process) never sees a partial file.
+    Each process tracks sizes and read order for its own view of the
+    directory, scanned on first use; a file another process evicted is
+    just a miss.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizes = OrderedDict()
+        self._lock = threading.Lock()
+        self._scanned = False
+
+    def _scan(self):
+        with self._lock:
+            if self._scanned:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            for _, name, size in sorted(self._list_files()):
+                self._sizes[name] = size
+                self.size += size
+            self._scanned = True
+
+    def _list_files(self):
+        files = []
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, name, stat.st_size))
+        return files
+
+    def _file(self, key):
+        # Shard on the end of the hash; the start is the same for every CIDv0
+        return os.path.join(self.path, key[-3:-1], key)
+
+    def open(self, key):
+        """Binary file object for key, or None"""
+        if not SAFE_KEY.match(key):
+            return None
+        self._scan()
+        path = self._file(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self.size -= self._sizes.pop(key, 0)
+            return None
+        # mtime doubles as last-read time, so eviction order survives restarts
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return f
+
+    def get(self, key):
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def temp(self):
+        """(file object, path) of a new temporary file to fill and then commit()"""
+        self._scan()
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        return os.fdopen(fd, 'wb'), temp_path
+
+    def put(self, key, data):
+        if not SAFE_KEY.match(key) or len(data) > self.max_bytes:
+            return
+        f, temp_path = self.temp()
+        try:
+            with f:
+                f.write(data)
+        except OSError:
+            _remove(temp_path)
+            raise
+        self.commit(key, temp_path, len(data))
+
+    def commit(self, key, temp_path, size):
+        """Move a filled temporary file into place as key"""
+        if not SAFE_KEY.match(key) or size > self.max_bytes:
+            _remove(temp_path)
+            return
+        path = self._file(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        except OSError:
+            _remove(temp_path)
+            raise
+
+        evicted = []
+        with self._lock:
+            self.size += size - self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            while self.size > self.max_bytes and len(self._sizes) > 1:
+                name, size = self._sizes.popitem(last=False)
+                self.size -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(self._file(name))
+            except FileNotFoundError:
+                pass
+
+    def discard(self, key):
+        with self._lock:
+            self.size -= self._sizes.pop(key, 0)
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._sizes)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class CacheWriter:
+    """
+    Content streamed into the cache a chunk at a time
+
+    Chunks go to a temporary file in the disk tier, and are also kept in
+    memory while the total still fits the memory tier. commit() stores the
+    content under its hash once known (e.g. after an upload), abort()
+    drops it.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.size = 0
+        self._buffer = []
+        self._file = None
+        self._temp_path = None
+        if cache.disk is not None:
+            try:
+                self._file, self._temp_path = cache.disk.temp()
+            except OSError as e:
+                logger.warning(f"Could not write to the IPFS disk cache: {str(e)}")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self._buffer is not None:
+            if self.cache.memory.fits(self.size):
+                self._buffer.append(chunk)
+            else:
+                self._buffer = None
+        if self._file is not None:
+            try:
+                if self.size > self.cache.disk.max_bytes:
+                    raise OSError('larger than IPFS_CACHE_DISK_BYTES')
+                self._file.write(chunk)
+            except OSError as e:
+                logger.warning(f"Could not write to the IPFS disk cache: {str(e)}")
+                self._drop_file()
+
+    def _drop_file(self):
+        if self._file is not None:
+            self._file.close()
+            _remove(self._temp_path)
+            self._file = None
+
+    def commit(self, ipfs_hash, verified=False):
+        """Store what was written under ipfs_hash; verified=True skips checking it again"""
+        data = b''.join(self._buffer) if self._buffer is not None else None
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+        if self.cache.verify and not verified and is_cid_v0(ipfs_hash):
+            if data is not None:
+                valid = self.cache.matches(ipfs_hash, data)
+            elif self._file is not None:
+                with open(self._temp_path, 'rb') as f:
+                    valid = self.cache.matches(ipfs_hash, f)
+            else:
+                valid = True
+            if not valid:
+                self.abort()
+                return
+        if data is not None:
+            self.cache.memory.put(ipfs_hash, data)
+        if self._file is not None:
+            try:
+                self.cache.disk.commit(ipfs_hash, self._temp_path, self.size)
+            except OSError as e:
+                logger.warning(f"Could not write {ipfs_hash} to the IPFS disk cache: {str(e)}")
+            self._file = None
+
+    def abort(self):
+        self._buffer = None
+        self._drop_file()
+
+class IPFSCache:
+    """
+    Two-tier read-through cache of IPFS content keyed by hash
+
+    IPFS content never changes for a given hash, so entries are never
+    invalidated, only evicted: from memory when IPFS_CACHE_MEMORY_BYTES is
+    exceeded and from IPFS_CACHE_DIR when IPFS_CACHE_DISK_BYTES is. With
+    IPFS_CACHE_VERIFY set, content fetched from a gateway and files read
+    from disk are checked against their CIDv0 before use.
+    """
+
+    def __init__(self, memory_bytes=None, disk_path=None, disk_bytes=None, verify=None):
+        config = get_config()
+        self.memory = MemoryLRU(memory_bytes if memory_bytes is not None else config.IPFS_CACHE_MEMORY_BYTES)
+        disk_path = disk_path if disk_path is not None else config.IPFS_CACHE_DIR
+        disk_bytes = disk_bytes if disk_bytes is not None else config.IPFS_CACHE_DISK_BYTES
+        self.disk = None
+        if disk_path and disk_bytes:
+            self.disk = DiskStore(disk_path, disk_bytes)
+        self.verify = verify if verify is not None else config.IPFS_CACHE_VERIFY
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def matches(self, ipfs_hash, data):
+        """False if verification is on and data (bytes or a binary file) does not hash to ipfs_hash (non-CIDv0 hashes pass)"""
+        if not self.verify or not is_cid_v0(ipfs_hash):
+            return True
+        if (cid_v0(data) if isinstance(data, bytes) else cid_v0_of_file(data)) == ipfs_hash:
+            return True
+        self.rejected += 1
+        logger.error(f"Content does not match IPFS hash {ipfs_hash}")
+        return False
+
+    def get(self, ipfs_hash):
+        """Cached content, or None"""
+        data = self.memory.get(ipfs_hash)
+        if data is not None:
+            self.memory_hits += 1
+            return data
+
+        if self.disk is not None:
+            try:
+                data = self.disk.get(ipfs_hash)
+            except OSError as e:
+                logger.warning(f"Could not read {ipfs_hash} from the IPFS disk cache: {str(e)}")
+            if data is not None and not self.matches(ipfs_hash, data):
+                self.disk.discard(ipfs_hash)
+                data = None
+            if data is not None:
+                self.disk_hits += 1
+                self.memory.put(ipfs_hash, data)
+                return data
+
+        self.misses += 1
+        return None
+
+    def open(self, ipfs_hash):
+        """
+        Cached content as a binary file object, or None
+
+        Unlike get(), disk hits are not copied into memory, so large
+        content can be streamed from the cache without loading it.
+        """
+        data = self.memory.get(ipfs_hash)
+        if data is not None:
+            self.memory_hits += 1
+            return io.BytesIO(data)
+
+        if self.disk is not None:
+            f = None
+            try:
+                f = self.disk.open(ipfs_hash)
+                if f is not None and self.verify:
+                    if self.matches(ipfs_hash, f):
+                        f.seek(0)
+                    else:
+                        f.close()
+                        self.disk.discard(ipfs_hash)
+                        f = None
+            except OSError as e:
+                logger.warning(f"Could not read {ipfs_hash} from the IPFS disk cache: {str(e)}")
+                if f is not None:
+                    f.close()
+                f = None
+            if f is not None:
+                self.disk_hits += 1
+                return f
+
+        self.misses += 1
+        return None
+
+    def writer(self):
+        """CacheWriter for content arriving in chunks"""
+        return CacheWriter(self)
+
+    def put(self, ipfs_hash, data):
+        """Store content in both tiers"""
+        self.memory.put(ipfs_hash, data)
+        if self.disk is not None:
+            try:
+                self.disk.put(ipfs_hash, data)
+            except OSError as e:
+                logger.warning(f"Could not write {ipfs_hash} to the IPFS disk cache: {str(e)}")
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory.size,
+            'disk_entries': len(self.disk) if self.disk is not None else None,
+            'disk_bytes': self.disk.size if self.disk is not None else None,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,186 @@
+import hashlib
+
+# Defaults of `ipfs add`: 256 KiB chunks, at most 174 links per DAG node
+CHUNK_SIZE = 262144
+MAX_LINKS = 174
+
+B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+def b58encode(data):
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = B58_ALPHABET[remainder] + encoded
+    # Leading zero bytes are kept as leading '1's
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + encoded
+
+def b58decode(text):
+    number = 0
+    for char in text:
+        number = number * 58 + B58_ALPHABET.index(char)
+    body = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return b'\0' * (len(text) - len(text.lstrip('1'))) + body
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _field(number, value):
+    """Protobuf length-delimited field"""
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+def _uint(number, value):
+    """Protobuf varint field"""
+    return _varint(number << 3) + _varint(value)
+
+def _unixfs_file(data, filesize, blocksizes=()):
+    message = _uint(1, 2)  # Type: File
+    if data:
+        message += _field(2, data)
+    message += _uint(3, filesize)
+    for size in blocksizes:
+        message += _uint(4, size)
+    return message
+
+def _multihash(block):
+    return b'\x12\x20' + hashlib.sha256(block).digest()
+
+def leaf_block(chunk):
+    """dag-pb block of one file chunk"""
+    return _field(1, _unixfs_file(chunk, len(chunk)))
+
+def _parent(children):
+    """
+    dag-pb block linking (multihash, block size, tree size, file size) children
+
+    Returns:
+        (block, tree size, file size)
+    """
+    links = b''.join(_field(2, _field(1, multihash) + _field(2, b'') + _uint(3, tree_size))
+                     for multihash, _, tree_size, _ in children)
+    filesize = sum(child[3] for child in children)
+    block = links + _field(1, _unixfs_file(b'', filesize, [child[3] for child in children]))
+    return block, len(block) + sum(child[2] for child in children), filesize
+
+def cid_v0(data, chunk_size=CHUNK_SIZE):
+    """
+    CIDv0 ("Qm...") that `ipfs add` with default settings gives this content
+
+    Chunks are wrapped as UnixFS file leaves and linked in a balanced DAG
+    of at most MAX_LINKS children per node, like go-ipfs's default importer.
+    """
+    return cid_v0_of_chunks(data[offset:offset + chunk_size]
+                            for offset in range(0, max(len(data), 1), chunk_size))
+
+def cid_v0_of_file(f, chunk_size=CHUNK_SIZE):
+    """CIDv0 of a binary file object, read one chunk at a time"""
+    return cid_v0_of_chunks(iter(lambda: f.read(chunk_size), b''))
+
+def cid_v0_of_chunks(chunks, on_block=None):
+    """
+    CIDv0 of content given as an iterable of chunks (all but the last full size)
+
+    Args:
+        chunks: Iterable of bytes
+        on_block: Optional callback(multihash, block) for every block built,
+            e.g. to store them in a blockstore
+
+    Returns:
+        The root CID as a string
+    """
+    def emit(block):
+        multihash = _multihash(block)
+        if on_block is not None:
+            on_block(multihash, block)
+        return multihash
+
+    # (multihash, block size, tree size, file size) of every leaf
+    leaves = []
+    for chunk in chunks:
+        block = leaf_block(chunk)
+        leaves.append((emit(block), len(block), len(block), len(chunk)))
+
+    if not leaves:
+        return b58encode(emit(leaf_block(b'')))
+    if len(leaves) == 1:
+        return b58encode(leaves[0][0])
+
+    # Balanced layout: leaves fill subtrees of MAX_LINKS ** (depth - 1) in order
+    depth = 1
+    while MAX_LINKS ** depth < len(leaves):
+        depth += 1
+    return b58encode(_build(leaves, depth, emit)[0])
+
+def _build(leaves, depth, emit):
+    if depth == 1:
+        children = leaves
+    else:
+        span = MAX_LINKS ** (depth - 1)
+        children = [_build(leaves[start:start + span], depth - 1, emit)
+                    for start in range(0, len(leaves), span)]
+    block, tree_size, filesize = _parent(children)
+    return (emit(block), len(block), tree_size, filesize)
+
+def _read_varint(buf, pos):
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _fields(buf, start, end):
+    """(field number, varint value or (start, end) span) of each field of a protobuf message"""
+    pos = start
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, value
+
+def decode_node(block):
+    """
+    Parse a UnixFS file block built like the ones above
+
+    Args:
+        block: bytes, or any buffer such as an mmap
+
+    Returns:
+        (child multihashes, (start, end) of the file data within block, file size)
+    """
+    links = []
+    data_span = (0, 0)
+    filesize = 0
+    for number, value in _fields(block, 0, len(block)):
+        if number == 2:
+            for link_number, link_value in _fields(block, *value):
+                if link_number == 1:
+                    links.append(bytes(block[link_value[0]:link_value[1]]))
+        elif number == 1:
+            for data_number, data_value in _fields(block, *value):
+                if data_number == 2:
+                    data_span = data_value
+                elif data_number == 3:
+                    filesize = data_value
+    return links, data_span, filesize
+
+def is_cid_v0(ipfs_hash):
+    return (isinstance(ipfs_hash, str) and len(ipfs_hash) == 46 and ipfs_hash.startswith('Qm')
+            and all(char in B58_ALPHABET for char in ipfs_hash))
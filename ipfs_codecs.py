@@ -0,0 +1,178 @@
+import io
+import json
+import math
+import zlib
+import logging
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Needed only when IPFS_CODEC or IPFS_COMPRESSION selects them (see requirements.txt)
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('json', 'dag-cbor', 'msgpack')
+COMPRESSIONS = ('', 'zlib', 'zstd')
+
+# Package each codec or compression needs
+PACKAGES = {'dag-cbor': 'cbor2', 'msgpack': 'msgpack', 'zstd': 'zstandard'}
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Multicodec codes; binary documents start with theirs as an unsigned varint
+MULTICODECS = {'dag-cbor': 0x71, 'msgpack': 0x0201}
+
+def _varint(value):
+    """Unsigned LEB128 varint, as multiformats use"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+# b'q' for DAG-CBOR and b'\x81\x04' for MessagePack; no JSON text starts with either
+PREFIXES = {codec: _varint(code) for codec, code in MULTICODECS.items()}
+
+# Key tuples of document shapes seen, mapped to their DAG-CBOR order
+KEY_ORDER_CACHE_SIZE = 1024
+_key_orders = {}
+
+def _dag_ordered(value):
+    """Copy of a document with map keys in DAG-CBOR order and non-finite floats refused"""
+    if isinstance(value, dict):
+        keys = tuple(value)
+        ordered = _key_orders.get(keys)
+        if ordered is None:
+            for key in keys:
+                if not isinstance(key, str):
+                    raise TypeError(f"DAG-CBOR map keys must be strings, not {type(key).__name__}")
+            # DAG-CBOR key order: shorter keys first, then bytewise
+            ordered = sorted(keys, key=lambda key: (len(key.encode('utf-8')), key.encode('utf-8')))
+            if len(_key_orders) < KEY_ORDER_CACHE_SIZE:
+                _key_orders[keys] = ordered
+        return {key: _dag_ordered(value[key]) for key in ordered}
+    if isinstance(value, (list, tuple)):
+        return [_dag_ordered(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("DAG-CBOR does not allow NaN or infinite floats")
+    return value
+
+def encode_dag_cbor(document):
+    """Deterministic DAG-CBOR encoding of JSON-like data"""
+    # cbor2 keeps dict order and writes every float as 64 bits, as DAG-CBOR requires
+    return cbor2.dumps(_dag_ordered(document))
+
+def _untag(*args):
+    # Tags (e.g. 42 for CIDs): keep the tagged value. cbor2 passes (decoder, tag) before 6.0, (tag, immutable) since
+    return next(arg for arg in args if isinstance(arg, cbor2.CBORTag)).value
+
+def decode_dag_cbor(data):
+    stream = io.BytesIO(data)
+    document = cbor2.CBORDecoder(stream, tag_hook=_untag).decode()
+    if stream.tell() != len(data):
+        raise ValueError("Trailing bytes after CBOR document")
+    return document
+
+def detect(data):
+    """
+    Name of the codec or compression data starts with
+
+    zstd and zlib streams have their own headers. DAG-CBOR and MessagePack
+    documents start with their multicodec prefix; anything else is JSON.
+    """
+    if data[:4] == ZSTD_MAGIC:
+        return 'zstd'
+    if len(data) > 1 and data[0] == 0x78 and (data[0] << 8 | data[1]) % 31 == 0:
+        return 'zlib'
+    for codec, prefix in PREFIXES.items():
+        if data[:len(prefix)] == prefix:
+            return codec
+    return 'json'
+
+def missing_package(name):
+    """Package a codec or compression needs that is not installed, or None"""
+    package = PACKAGES.get(name)
+    if package and globals()[package] is None:
+        return package
+    return None
+
+def _require(name):
+    if missing_package(name):
+        raise RuntimeError(f"IPFS {name} needs the {missing_package(name)} package, see requirements.txt")
+
+class DocumentCodec:
+    """
+    Encodes IPFS documents with IPFS_CODEC, compressed with IPFS_COMPRESSION
+
+    Decoding detects the format of the stored bytes, so documents written
+    with any codec or compression (including plain JSON from before this
+    setting existed) read back the same way. Selecting a codec or
+    compression whose package is not installed is an error.
+    """
+
+    def __init__(self, codec=None, compression=None, level=None):
+        config = get_config()
+        codec = codec if codec is not None else config.IPFS_CODEC
+        compression = compression if compression is not None else config.IPFS_COMPRESSION
+        self.level = level if level is not None else config.IPFS_COMPRESSION_LEVEL
+        if codec not in CODECS:
+            raise ValueError(f"Unknown IPFS codec: {codec}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown IPFS compression: {compression}")
+
+        _require(codec)
+        _require(compression)
+        self.codec = codec
+        self.compression = compression
+
+    @property
+    def extension(self):
+        return {'json': 'json', 'dag-cbor': 'cbor', 'msgpack': 'msgpack'}[self.codec] + \
+            {'': '', 'zlib': '.zz', 'zstd': '.zst'}[self.compression]
+
+    def encode(self, document):
+        if self.codec == 'dag-cbor':
+            data = PREFIXES['dag-cbor'] + encode_dag_cbor(document)
+        elif self.codec == 'msgpack':
+            data = PREFIXES['msgpack'] + msgpack.packb(document, use_bin_type=True)
+        else:
+            # Same bytes as before codecs existed, so unchanged documents keep their hash
+            data = json.dumps(document).encode('utf-8')
+
+        if self.compression == 'zstd':
+            # Compressor objects are not thread-safe and add_many encodes from several threads
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        if self.compression == 'zlib':
+            return zlib.compress(data, min(self.level, 9))
+        return data
+
+    def decode(self, data):
+        kind = detect(data)
+        _require(kind)
+        if kind == 'zstd':
+            data = zstandard.ZstdDecompressor().decompress(data)
+            kind = detect(data)
+        elif kind == 'zlib':
+            data = zlib.decompress(data)
+            kind = detect(data)
+
+        _require(kind)
+        if kind == 'dag-cbor':
+            return decode_dag_cbor(data[len(PREFIXES[kind]):])
+        if kind == 'msgpack':
+            return msgpack.unpackb(data[len(PREFIXES[kind]):], raw=False)
+        return json.loads(data)
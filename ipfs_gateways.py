@@ -0,0 +1,213 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Recent latencies kept per gateway for its p95
+WINDOW = 200
+# Samples needed before a gateway's own p95 replaces IPFS_HEDGE_DELAY
+MIN_SAMPLES = 20
+# Consecutive failures that bench a gateway, and for how long (seconds)
+FAILURE_LIMIT = 3
+COOLDOWN = 30
+# Share of reads sent to a random gateway first, so rankings stay current
+EXPLORE_RATE = 0.05
+
+def make_session(pool_size, hosts=1):
+    """requests Session with a keep-alive pool and no automatic retries"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _close_result(future):
+    response = future.result()
+    if response is not None:
+        response.close()
+
+class Gateway:
+    """Latency and failure tracking for one gateway URL prefix"""
+
+    def __init__(self, url):
+        self.url = url
+        self.latencies = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.requests += 1
+            if ok:
+                self.latencies.append(seconds)
+                self.consecutive_failures = 0
+            else:
+                self.errors += 1
+                self.consecutive_failures += 1
+                self.last_failure = time.monotonic()
+
+    @property
+    def benched(self):
+        return (self.consecutive_failures >= FAILURE_LIMIT
+                and time.monotonic() - self.last_failure < COOLDOWN)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def to_dict(self):
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            'url': self.url,
+            'requests': self.requests,
+            'errors': self.errors,
+            'p50_ms': round(p50 * 1000, 3) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 3) if p95 is not None else None,
+            'benched': self.benched,
+        }
+
+class GatewayPool:
+    """
+    Hedged reads across several IPFS gateways over pooled connections
+
+    Gateways are ranked by their median recent latency, with ones
+    that failed FAILURE_LIMIT times in a row moved last for COOLDOWN
+    seconds. A read goes to the best gateway; if it has not answered
+    within that gateway's p95 latency (IPFS_HEDGE_DELAY until enough
+    samples exist) the same read is sent to the next one, and the first
+    good response wins. Errors fail over to the next gateway at once.
+    """
+
+    def __init__(self, urls=None, pool_size=None, timeout=None, connect_timeout=None, hedge_delay=None):
+        config = get_config()
+        urls = urls if urls is not None else [url.strip() for url in config.IPFS_GATEWAYS.split(',') if url.strip()]
+        self.gateways = [Gateway(url) for url in urls]
+        self.pool_size = pool_size or config.IPFS_POOL_SIZE
+        self.timeout = timeout if timeout is not None else config.IPFS_TIMEOUT
+        self.connect_timeout = connect_timeout if connect_timeout is not None else config.IPFS_CONNECT_TIMEOUT
+        self.hedge_delay = hedge_delay if hedge_delay is not None else config.IPFS_HEDGE_DELAY
+        self.session = make_session(self.pool_size, hosts=len(self.gateways) + 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='ipfs-gateway')
+
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failed = 0
+
+    def _ordered(self):
+        # Median, not mean: an occasional slow read is what hedging is for
+        return sorted(self.gateways, key=lambda gateway: (gateway.benched, gateway.quantile(0.5) or 0.0))
+
+    def ranked(self):
+        """Gateways best first, occasionally with another one tried first"""
+        ranked = self._ordered()
+        if len(ranked) > 1 and random.random() < EXPLORE_RATE:
+            index = random.randrange(1, len(ranked))
+            ranked.insert(0, ranked.pop(index))
+        return ranked
+
+    def _budget(self, gateway):
+        """How long to wait for a gateway before hedging"""
+        if len(gateway.latencies) < MIN_SAMPLES:
+            return self.hedge_delay
+        return gateway.quantile(0.95)
+
+    def _get(self, gateway, path, accept, stream):
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.session.get(f"{gateway.url}{path}", timeout=(self.connect_timeout, self.timeout),
+                                        stream=stream)
+            ok = response.status_code == 200 and (stream or accept is None or accept(response.content))
+            if not ok:
+                logger.warning(f"Gateway {gateway.url} returned {response.status_code} for {path}")
+        except Exception as e:
+            logger.warning(f"Gateway {gateway.url} failed for {path}: {str(e)}")
+            ok = False
+        gateway.record(time.perf_counter() - started, ok)
+        if not ok:
+            if response is not None:
+                response.close()
+            return None
+        return response if stream else response.content
+
+    def fetch(self, path, accept=None):
+        """
+        Read path from the fastest gateway that returns it
+
+        Args:
+            path: Appended to each gateway URL, e.g. an IPFS hash
+            accept: Optional check on the content; a gateway whose content
+                fails it counts as failed
+
+        Returns:
+            Content bytes, or None if every gateway failed
+        """
+        return self._race(path, accept, stream=False)
+
+    def open(self, path):
+        """
+        Like fetch(), but returns the winning streamed requests.Response once
+        its headers arrive; the caller reads and closes it. Latency samples
+        are then time to headers.
+        """
+        return self._race(path, None, stream=True)
+
+    def _race(self, path, accept, stream):
+        self.reads += 1
+        waiting = self.ranked()
+        pending = {}
+        hedged = False
+
+        def launch():
+            gateway = waiting.pop(0)
+            pending[self._executor.submit(self._get, gateway, path, accept, stream)] = gateway
+            return gateway
+
+        first = launch()
+        while pending:
+            budget = self._budget(first) if waiting and not hedged else None
+            done, _ = wait(pending, timeout=budget, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than usual: ask the next gateway too
+                hedged = True
+                self.hedged += 1
+                launch()
+                continue
+            for future in done:
+                gateway = pending.pop(future)
+                content = future.result()
+                if content is not None:
+                    if hedged and gateway is not first:
+                        self.hedge_wins += 1
+                    if stream:
+                        # Close the losing responses as they arrive
+                        for loser in pending:
+                            loser.add_done_callback(_close_result)
+                    return content
+            if not pending and waiting:
+                first = launch()
+        self.failed += 1
+        return None
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'failed': self.failed,
+            'gateways': [gateway.to_dict() for gateway in self._ordered()],
+        }
@@ -2,37 +2,116 @@ import os
 import io
 import json
 import logging
-import requests
 import base64
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from werkzeug.utils import secure_filename
 from config import get_config
+from lazy_service import LazyService, LazyAttribute
+from ipfs_cache import IPFSCache
+from ipfs_gateways import GatewayPool
+from ipfs_cid import CHUNK_SIZE, is_cid_v0
+from ipfs_blockstore import Blockstore, rechunk
+from ipfs_codecs import DocumentCodec
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class IPFSStorage:
+class IPFSStream:
+    """
+    Iterator over the chunks of a file on IPFS
+
+    Close it (or use it in a with statement) if not read to the end;
+    Response objects close it for you.
+    """
+    
+    def __init__(self, chunks, close=None, length=None):
+        self._chunks = iter(chunks)
+        self._close = close
+        self.length = length
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+    
+    def close(self):
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _read_chunks(f, chunk_size=CHUNK_SIZE):
+    return iter(lambda: f.read(chunk_size), b'')
+
+class IPFSStorage(LazyService):
     """Service for storing files on IPFS"""
     
+    name = 'ipfs'
+    
+    # Decided by _connect() on first use
+    dev_mode = LazyAttribute()
+    
     def __init__(self):
-        """Initialize IPFS connection"""
+        """Set up configuration; the IPFS API is contacted lazily (see LazyService)"""
+        self._init_lazy()
+        
         # Get configuration
         config = get_config()
         
         # Check if we should use real IPFS or dev mode
-        self.dev_mode = os.environ.get("DEV_MODE", "false").lower() == "true"
+        self._dev_mode = self._dev_mode_requested = os.environ.get("DEV_MODE", "false").lower() == "true"
         
         # Use Infura's IPFS API by default
         self.ipfs_api = config.IPFS_API_URL
-        self.ipfs_gateway = config.IPFS_GATEWAY
         self.ipfs_api_key = config.IPFS_API_KEY
         self.ipfs_api_secret = config.IPFS_API_SECRET
         self.project_id = config.INFURA_PROJECT_ID
         
-        # Local storage for dev mode
-        self.storage = {}
+        # Local content-addressed store for dev mode (see ipfs_blockstore.py)
+        self.blockstore = Blockstore()
+        
+        # Content fetched or uploaded by hash (see ipfs_cache.py)
+        self.cache = IPFSCache()
+        
+        # Encoding of add_json/get_json documents (IPFS_CODEC, IPFS_COMPRESSION)
+        self.codec = DocumentCodec()
         
+        # Keep-alive session for the API and hedged reads across IPFS_GATEWAYS
+        self.gateways = GatewayPool()
+    
+    def _auth(self):
+        """(headers, auth) for the IPFS API"""
+        if self.project_id:
+            return {"Authorization": f"Basic {self._get_basic_auth_header(self.project_id, '')}"}, None
+        if self.ipfs_api_key and self.ipfs_api_secret:
+            return {}, (self.ipfs_api_key, self.ipfs_api_secret)
+        return {}, None
+    
+    def _check_health(self):
+        if self.dev_mode:
+            return None
+        headers, auth = self._auth()
+        response = self.gateways.session.get(f"{self.ipfs_api}/version", headers=headers, auth=auth,
+                                             timeout=get_config().SERVICE_PROBE_TIMEOUT)
+        return response.status_code == 200
+    
+    def _connect(self):
+        """Initialize IPFS connection"""
+        # A retry after a failed connection starts over from the configured mode
+        self.dev_mode = self._dev_mode_requested
         if self.dev_mode:
             logger.info("Running in development mode, IPFS operations will be simulated")
             return
@@ -45,29 +124,14 @@ class IPFSStorage:
                 self.dev_mode = True
                 return
                 
-            headers = {}
-            # Setup authentication - either using project ID or API key
-            if self.project_id:
-                auth = (self.project_id, "")
-                headers = {
-                    "Authorization": f"Basic {self._get_basic_auth_header(self.project_id, '')}"
-                }
-            elif self.ipfs_api_key and self.ipfs_api_secret:
-                auth = (self.ipfs_api_key, self.ipfs_api_secret)
-            else:
-                auth = None
-                
-            response = requests.get(f"{self.ipfs_api}/version", headers=headers, auth=auth)
-            if response.status_code == 200:
+            if self._check_health():
                 logger.info("Connected to IPFS node successfully")
             else:
-                logger.warning(f"IPFS connection test failed: {response.status_code}")
-                logger.warning("Running in development mode due to connection failure")
-                self.dev_mode = True
+                raise ConnectionError("IPFS connection test failed")
         except Exception as e:
             logger.error(f"Error connecting to IPFS: {str(e)}")
-            logger.warning("Running in development mode due to connection error")
-            self.dev_mode = True
+            # Calls go to the unreachable API, not the local store, until the retry (see LazyService)
+            raise
     
     def _get_basic_auth_header(self, username, password):
         """Create basic auth header string"""
@@ -75,6 +139,35 @@ class IPFSStorage:
         auth_string = f"{username}:{password}"
         return base64.b64encode(auth_string.encode()).decode()
     
+    def _open_verified(self, ipfs_hash, response, chunk_size):
+        """Spool a gateway response and check it against its CIDv0 before streaming it"""
+        limit = get_config().IPFS_VERIFY_MAX_BYTES
+        # Small files stay in memory; larger ones spill to a temporary file
+        spool = tempfile.SpooledTemporaryFile(max_size=4 * CHUNK_SIZE)
+        writer = self.cache.writer()
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if spool.tell() + len(chunk) > limit:
+                    raise ValueError(f"larger than IPFS_VERIFY_MAX_BYTES ({limit})")
+                spool.write(chunk)
+                writer.write(chunk)
+            length = spool.tell()
+            spool.seek(0)
+            valid = self.cache.matches(ipfs_hash, spool)
+        except Exception as e:
+            logger.error(f"Error reading {ipfs_hash} for verification: {str(e)}")
+            valid = False
+        finally:
+            response.close()
+        
+        if not valid:
+            writer.abort()
+            spool.close()
+            return None
+        writer.commit(ipfs_hash, verified=True)
+        spool.seek(0)
+        return IPFSStream(_read_chunks(spool, chunk_size), close=spool.close, length=length)
+    
     def add_file(self, file_data, filename=None):
         """
         Upload a file to IPFS
@@ -89,19 +182,14 @@ class IPFSStorage:
         # Use dev mode implementation if in dev mode
         if self.dev_mode:
             try:
-                # Generate a unique hash
-                hash_key = f"dev-ipfs-{uuid.uuid4().hex[:16]}"
-                
-                # Store the file data
+                # Store the file data under its real CID
                 if hasattr(file_data, 'read'):
-                    content = file_data.read()
+                    hash_key = self.blockstore.add(_read_chunks(file_data))
                     file_data.seek(0)  # Reset file pointer
                 else:
-                    content = file_data
+                    hash_key = self.blockstore.add(file_data)
                     
-                # Store in our local dictionary
-                self.storage[hash_key] = content
-                logger.info(f"Dev mode: File stored with mock hash: {hash_key}")
+                logger.info(f"Dev mode: File stored with hash: {hash_key}")
                 return hash_key
             except Exception as e:
                 logger.error(f"Dev mode error: {str(e)}")
@@ -112,6 +200,13 @@ class IPFSStorage:
             if filename:
                 filename = secure_filename(filename)
             
+            # Keep a copy for the cache; reading by hash right after uploading is common
+            if hasattr(file_data, 'read'):
+                content = file_data.read()
+                file_data.seek(0)
+            else:
+                content = file_data
+            
             # Create a multipart form
             files = {
                 'file': (filename, file_data) if filename else file_data
@@ -130,17 +225,20 @@ class IPFSStorage:
                 auth = None
             
             # Upload to IPFS
-            response = requests.post(
+            config = get_config()
+            response = self.gateways.session.post(
                 f"{self.ipfs_api}/add", 
                 files=files,
                 auth=auth,
-                headers=headers
+                headers=headers,
+                timeout=(config.IPFS_CONNECT_TIMEOUT, config.IPFS_UPLOAD_TIMEOUT)
             )
             
             if response.status_code == 200:
                 result = response.json()
                 ipfs_hash = result['Hash']
                 logger.info(f"File uploaded to IPFS with hash: {ipfs_hash}")
+                self.cache.put(ipfs_hash, content)
                 return ipfs_hash
             else:
                 logger.error(f"IPFS upload failed: {response.status_code}, {response.text}")
@@ -150,22 +248,166 @@ class IPFSStorage:
             logger.error(f"Error uploading to IPFS: {str(e)}")
             return None
     
+    def add_stream(self, stream, filename=None):
+        """
+        Upload a file to IPFS without holding it in memory
+        
+        The body is sent as a chunked multipart request, and copied into
+        the cache as it goes.
+        
+        Args:
+            stream: Binary file-like object or iterable of bytes chunks
+            filename: Optional filename
+            
+        Returns:
+            IPFS hash of the uploaded file
+        """
+        chunks = _read_chunks(stream) if hasattr(stream, 'read') else stream
+        
+        if self.dev_mode:
+            try:
+                hash_key = self.blockstore.add(chunks)
+                logger.info(f"Dev mode: File stored with hash: {hash_key}")
+                return hash_key
+            except Exception as e:
+                logger.error(f"Dev mode error: {str(e)}")
+                return None
+        
+        writer = self.cache.writer()
+        try:
+            filename = secure_filename(filename) if filename else 'file'
+            boundary = uuid.uuid4().hex
+            
+            def body():
+                yield (f'--{boundary}\r\n'
+                       f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                       f'Content-Type: application/octet-stream\r\n\r\n').encode()
+                for chunk in chunks:
+                    writer.write(chunk)
+                    yield chunk
+                yield f'\r\n--{boundary}--\r\n'.encode()
+            
+            headers, auth = self._auth()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+            config = get_config()
+            # A generator body is sent with Transfer-Encoding: chunked
+            response = self.gateways.session.post(
+                f"{self.ipfs_api}/add",
+                data=body(),
+                auth=auth,
+                headers=headers,
+                timeout=(config.IPFS_CONNECT_TIMEOUT, config.IPFS_UPLOAD_TIMEOUT)
+            )
+            
+            if response.status_code == 200:
+                ipfs_hash = response.json()['Hash']
+                logger.info(f"File streamed to IPFS with hash: {ipfs_hash} ({writer.size} bytes)")
+                writer.commit(ipfs_hash)
+                return ipfs_hash
+            else:
+                writer.abort()
+                logger.error(f"IPFS upload failed: {response.status_code}, {response.text}")
+                return None
+                
+        except Exception as e:
+            writer.abort()
+            logger.error(f"Error streaming to IPFS: {str(e)}")
+            return None
+    
+    def _add_batch(self, items):
+        """
+        Upload (key, content) pairs in one wrapped /add request
+        
+        Returns:
+            Dict of key -> IPFS hash for the contents that were added
+        """
+        if self.dev_mode:
+            return {key: self.blockstore.add(content) for key, content in items}
+        
+        # Numbered file names inside the wrapping directory map results back to keys
+        files = [('file', (str(index), content, 'application/octet-stream'))
+                 for index, (_, content) in enumerate(items)]
+        headers, auth = self._auth()
+        config = get_config()
+        response = self.gateways.session.post(
+            f"{self.ipfs_api}/add",
+            params={'wrap-with-directory': 'true'},
+            files=files,
+            auth=auth,
+            headers=headers,
+            timeout=(config.IPFS_CONNECT_TIMEOUT, config.IPFS_UPLOAD_TIMEOUT)
+        )
+        if response.status_code != 200:
+            logger.error(f"IPFS batch upload failed: {response.status_code}, {response.text}")
+            return {}
+        
+        # One JSON line per file, then one for the directory (Name "")
+        hashes = {}
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            name = entry.get('Name', '')
+            if name.isdigit() and int(name) < len(items):
+                key, content = items[int(name)]
+                hashes[key] = entry['Hash']
+                self.cache.put(entry['Hash'], content)
+        return hashes
+    
+    def add_many(self, objects, batch_size=None, concurrency=None):
+        """
+        Upload many small files or JSON documents with few requests
+        
+        Objects are sent IPFS_ADD_BATCH_SIZE per multipart /add request
+        (wrapped in a directory), with up to IPFS_ADD_CONCURRENCY requests
+        in flight.
+        
+        Args:
+            objects: Dict of key -> bytes or document (encoded like add_json)
+            batch_size: Objects per request, optional
+            concurrency: Parallel requests, optional
+            
+        Returns:
+            Dict of key -> IPFS hash; keys whose batch failed are missing
+        """
+        config = get_config()
+        batch_size = batch_size or config.IPFS_ADD_BATCH_SIZE
+        concurrency = concurrency or config.IPFS_ADD_CONCURRENCY
+        
+        items = [(key, value if isinstance(value, bytes) else self.codec.encode(value))
+                 for key, value in objects.items()]
+        batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+        
+        def upload(batch):
+            try:
+                return self._add_batch(batch)
+            except Exception as e:
+                logger.error(f"Error uploading batch to IPFS: {str(e)}")
+                return {}
+        
+        hashes = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as executor:
+            for result in executor.map(upload, batches):
+                hashes.update(result)
+        logger.info(f"Uploaded {len(hashes)} of {len(items)} objects to IPFS in {len(batches)} requests")
+        return hashes
+    
     def add_json(self, json_data):
         """
         Upload JSON data to IPFS
         
         Args:
-            json_data: Dictionary to be uploaded as JSON
+            json_data: Dictionary to be uploaded, encoded with IPFS_CODEC
             
         Returns:
-            IPFS hash of the uploaded JSON
+            IPFS hash of the uploaded document
         """
         try:
-            # Convert to JSON string
-            json_str = json.dumps(json_data)
+            # JSON text by default, or DAG-CBOR/MessagePack, optionally compressed
+            content = self.codec.encode(json_data)
             
             # Upload as file
-            return self.add_file(io.BytesIO(json_str.encode('utf-8')), 'data.json')
+            return self.add_file(io.BytesIO(content), f'data.{self.codec.extension}')
             
         except Exception as e:
             logger.error(f"Error uploading JSON to IPFS: {str(e)}")
@@ -185,9 +427,9 @@ class IPFSStorage:
         if self.dev_mode:
             try:
                 # Check if hash exists in our local storage
-                if ipfs_hash in self.storage:
+                if self.blockstore.has(ipfs_hash):
                     logger.info(f"Dev mode: Retrieved file with hash: {ipfs_hash}")
-                    return self.storage[ipfs_hash]
+                    return self.blockstore.cat(ipfs_hash)
                 else:
                     # If not in our storage, generate dummy content for dev purposes
                     logger.warning(f"Dev mode: Hash {ipfs_hash} not found, returning dummy content")
@@ -200,27 +442,108 @@ class IPFSStorage:
                 logger.error(f"Dev mode error: {str(e)}")
                 return None
                 
+        # Content is immutable by hash, so a cached copy is always current
+        cached = self.cache.get(ipfs_hash)
+        if cached is not None:
+            return cached
+        
         # Use real IPFS implementation
         try:
-            # Get file from IPFS gateway
-            response = requests.get(f"{self.ipfs_gateway}{ipfs_hash}")
+            # Fastest gateway wins; content failing verification counts as a failed gateway
+            content = self.gateways.fetch(ipfs_hash, accept=lambda data: self.cache.matches(ipfs_hash, data))
             
-            if response.status_code == 200:
-                return response.content
+            if content is not None:
+                self.cache.put(ipfs_hash, content)
+                return content
             else:
-                logger.error(f"Error getting file from IPFS: {response.status_code}, {response.text}")
+                logger.error(f"Error getting file from IPFS: no gateway returned {ipfs_hash}")
                 return None
                 
         except Exception as e:
             logger.error(f"Error downloading from IPFS: {str(e)}")
             return None
     
+    def open_stream(self, ipfs_hash, chunk_size=CHUNK_SIZE):
+        """
+        Open a file on IPFS for reading in chunks
+        
+        Content comes from the cache when present, otherwise from the
+        fastest gateway, and is copied into the cache as it is read. With
+        IPFS_CACHE_VERIFY set, CIDv0 content from a gateway is read in full
+        (up to IPFS_VERIFY_MAX_BYTES) and checked before any of it is
+        returned; content that is too large or fails the check is not
+        opened at all.
+        
+        Args:
+            ipfs_hash: IPFS hash of the file
+            chunk_size: Largest chunk to yield
+            
+        Returns:
+            IPFSStream, or None if the file could not be opened
+        """
+        if self.dev_mode:
+            try:
+                if self.blockstore.has(ipfs_hash):
+                    chunks = self.blockstore.open(ipfs_hash)
+                    if chunk_size != CHUNK_SIZE:
+                        chunks = rechunk(chunks, chunk_size)
+                    return IPFSStream(chunks, length=self.blockstore.size(ipfs_hash))
+            except Exception as e:
+                logger.error(f"Dev mode error: {str(e)}")
+                return None
+            # Unknown hashes get get_file()'s placeholder content
+            content = self.get_file(ipfs_hash)
+            if content is None:
+                return None
+            return IPFSStream(_read_chunks(io.BytesIO(content), chunk_size), length=len(content))
+        
+        cached = self.cache.open(ipfs_hash)
+        if cached is not None:
+            length = cached.seek(0, io.SEEK_END)
+            cached.seek(0)
+            return IPFSStream(_read_chunks(cached, chunk_size), close=cached.close, length=length)
+        
+        try:
+            response = self.gateways.open(ipfs_hash)
+        except Exception as e:
+            logger.error(f"Error opening IPFS stream: {str(e)}")
+            return None
+        if response is None:
+            logger.error(f"Error getting file from IPFS: no gateway returned {ipfs_hash}")
+            return None
+        if self.cache.verify and is_cid_v0(ipfs_hash):
+            return self._open_verified(ipfs_hash, response, chunk_size)
+        
+        writer = self.cache.writer()
+        finished = []
+        
+        def chunks():
+            for chunk in response.iter_content(chunk_size):
+                writer.write(chunk)
+                yield chunk
+            finished.append(True)
+        
+        def close():
+            response.close()
+            if finished:
+                writer.commit(ipfs_hash)
+            else:
+                writer.abort()
+        
+        # iter_content() decodes any Content-Encoding, so the length is only known without one
+        length = response.headers.get('Content-Length')
+        if length is not None and 'Content-Encoding' not in response.headers:
+            length = int(length)
+        else:
+            length = None
+        return IPFSStream(chunks(), close=close, length=length)
+    
     def get_json(self, ipfs_hash):
         """
         Get JSON data from IPFS
         
         Args:
-            ipfs_hash: IPFS hash of the JSON file
+            ipfs_hash: IPFS hash of the document, in any supported encoding
             
         Returns:
             Parsed JSON data as dictionary
@@ -230,8 +553,8 @@ class IPFSStorage:
             content = self.get_file(ipfs_hash)
             
             if content:
-                # Parse JSON
-                return json.loads(content.decode('utf-8'))
+                # The codec is detected from the content
+                return self.codec.decode(content)
             else:
                 return None
                 
@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+class LazyAttribute:
+    """Attribute of a LazyService that connects the service before it is read or replaced"""
+
+    def __set_name__(self, owner, name):
+        self.attr = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        obj.ensure_initialized()
+        return getattr(obj, self.attr)
+
+    def __set__(self, obj, value):
+        obj.ensure_initialized()
+        setattr(obj, self.attr, value)
+
+class LazyService:
+    """
+    Mixin for services that talk to the network when they connect
+
+    Constructing a subclass does no I/O. The connection is made by
+    ensure_initialized(): on first use, or earlier by the health probe
+    thread started from create_app(), so worker boot never waits on a
+    slow or unreachable dependency. Concurrent first callers wait for a
+    single connection attempt. The probe then re-checks the dependency
+    every SERVICE_PROBE_INTERVAL seconds and records it in `healthy`.
+
+    Subclasses implement _connect() and _check_health(), and declare the
+    attributes _connect() sets up as LazyAttribute()s. _connect() raises if
+    the dependency could not be reached, leaving the service unavailable
+    rather than falling back to dev mode; the connection is then retried by
+    the probe, or by the first caller after SERVICE_PROBE_INTERVAL seconds.
+    """
+
+    name = 'service'
+
+    def _init_lazy(self):
+        self._init_lock = threading.RLock()
+        self._initialized = False
+        self._connecting = False
+        self._retry_at = None
+        self._probe_thread = None
+        self._probe_stop = threading.Event()
+        self.healthy = None
+        self.init_seconds = None
+        self.last_probe = None
+        self.last_error = None
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _check_health(self):
+        """True if the dependency responds; None if there is nothing to check"""
+        return None
+
+    def ensure_initialized(self):
+        """Connect now unless that already happened (safe to call from any thread)"""
+        if self._initialized:
+            return
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            # The last attempt failed recently; the service stays unavailable until the retry
+            return
+        self._initialize()
+
+    def _initialize(self):
+        with self._init_lock:
+            # _connect() itself reads attributes that lead back here
+            if self._initialized or self._connecting:
+                return
+            self._connecting = True
+            started = time.perf_counter()
+            try:
+                self._connect()
+            except Exception as e:
+                self.last_error = str(e)
+                self._retry_at = time.monotonic() + get_config().SERVICE_PROBE_INTERVAL
+                logger.warning(f"{self.name} connection failed, will retry: {str(e)}")
+                return
+            finally:
+                self._connecting = False
+                self.init_seconds = round(time.perf_counter() - started, 3)
+            self._initialized = True
+            self._retry_at = None
+            self.last_error = None
+            logger.info(f"{self.name} initialized in {self.init_seconds}s")
+
+    def probe(self):
+        """Run one health check and record the result"""
+        try:
+            self.healthy = self._check_health()
+        except Exception as e:
+            logger.warning(f"{self.name} health check failed: {str(e)}")
+            self.healthy = False
+        self.last_probe = time.time()
+        return self.healthy
+
+    def _probe_loop(self):
+        interval = get_config().SERVICE_PROBE_INTERVAL
+        while not self._probe_stop.is_set():
+            if not self._initialized:
+                self._initialize()
+            self.probe()
+            self._probe_stop.wait(interval)
+
+    def start_health_probe(self):
+        """Connect and keep probing in a background thread (idempotent)"""
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._probe_stop.clear()
+        self._probe_thread = threading.Thread(target=self._probe_loop, name=f'{self.name}-probe', daemon=True)
+        self._probe_thread.start()
+
+    def stop_health_probe(self, timeout=5):
+        self._probe_stop.set()
+        if self._probe_thread:
+            self._probe_thread.join(timeout)
+
+    def health(self):
+        return {
+            'initialized': self._initialized,
+            'init_seconds': self.init_seconds,
+            'last_error': self.last_error,
+            'healthy': self.healthy,
+            'last_probe': self.last_probe,
+        }
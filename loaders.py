@@ -0,0 +1,55 @@
+import logging
+from types import SimpleNamespace
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Ride, Booking
+
+logger = logging.getLogger(__name__)
+
+# Loader options for list views; each relationship is fetched in the same
+# query (joined) instead of once per row
+RIDE_WITH_DRIVER = (joinedload(Ride.driver),)
+BOOKING_WITH_RIDE = (joinedload(Booking.ride).joinedload(Ride.driver),)
+
+def load_offered_rides(user_id):
+    """
+    Rides offered by a user, newest departure first, with driver and passengers
+
+    The bookings of all the rides are read in one query and set as each
+    ride's booking_list, whatever the number of rides (selectinload would
+    split the ids into batches of 500).
+    """
+    rides = (Ride.query.options(*RIDE_WITH_DRIVER)
+             .filter_by(driver_id=user_id)
+             .order_by(Ride.departure_time.desc())
+             .all())
+    bookings = {ride.id: [] for ride in rides}
+    if rides:
+        query = (Booking.query.options(joinedload(Booking.passenger))
+                 .join(Booking.ride)
+                 .filter(Ride.driver_id == user_id)
+                 .order_by(Booking.created_at, Booking.id))
+        for booking in query:
+            bookings[booking.ride_id].append(booking)
+    for ride in rides:
+        set_committed_value(ride, 'booking_list', bookings[ride.id])
+    return rides
+
+def load_bookings(user_id):
+    """Bookings made by a user, newest first, with ride and driver"""
+    return (Booking.query.options(*BOOKING_WITH_RIDE)
+            .filter_by(passenger_id=user_id)
+            .order_by(Booking.created_at.desc())
+            .all())
+
+def ride_booking_stats(rides):
+    """
+    Booking aggregates of rides from load_offered_rides, without a query
+
+    Returns:
+        Dict of ride id -> namespace with booking_count and seats_booked
+        (rides without bookings get zeros)
+    """
+    return {ride.id: SimpleNamespace(booking_count=len(ride.booking_list),
+                                     seats_booked=sum(booking.seats_booked for booking in ride.booking_list))
+            for ride in rides}
@@ -0,0 +1,234 @@
+import re
+import logging
+import unicodedata
+from sqlalchemy import event, select, func, literal, text, case
+from app import app, db, create_app
+from models import Ride, RideLocationToken
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Ride columns covered by the search index
+LOCATION_FIELDS = {
+    'start': 'start_location',
+    'end': 'end_location',
+}
+
+# Longest word stored in the token table (matches RideLocationToken.token)
+MAX_TOKEN_LENGTH = 64
+
+def normalize_location(value):
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    # Letters, digits and marks of any script are word characters (vowel signs in Devanagari are marks)
+    value = ''.join(ch if unicodedata.category(ch)[0] in 'LNM' else ' ' for ch in value.lower())
+    return re.sub(r'\s+', ' ', value).strip()
+
+def tokenize(value):
+    """Split a location into its distinct normalized words"""
+    return sorted({word[:MAX_TOKEN_LENGTH] for word in normalize_location(value).split()})
+
+def is_postgresql(bind=None):
+    """Check whether the database supports native trigram search"""
+    bind = bind or db.engine
+    return bind.dialect.name == 'postgresql'
+
+def _token_rows(ride_id, start_location, end_location):
+    rows = []
+    for field, value in (('start', start_location), ('end', end_location)):
+        rows.extend({'ride_id': ride_id, 'field': field, 'token': token}
+                    for token in tokenize(value))
+    return rows
+
+# Keep the token table in sync inside the same transaction as the ride write
+@event.listens_for(Ride, 'after_insert')
+def _index_inserted_ride(mapper, connection, ride):
+    if is_postgresql(connection):
+        return
+    rows = _token_rows(ride.id, ride.start_location, ride.end_location)
+    if rows:
+        connection.execute(RideLocationToken.__table__.insert(), rows)
+
+@event.listens_for(Ride, 'after_update')
+def _reindex_updated_ride(mapper, connection, ride):
+    if is_postgresql(connection):
+        return
+    state = db.inspect(ride)
+    if not (state.attrs.start_location.history.has_changes()
+            or state.attrs.end_location.history.has_changes()):
+        return
+    table = RideLocationToken.__table__
+    connection.execute(table.delete().where(table.c.ride_id == ride.id))
+    rows = _token_rows(ride.id, ride.start_location, ride.end_location)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+@event.listens_for(Ride, 'before_delete')
+def _unindex_deleted_ride(mapper, connection, ride):
+    if is_postgresql(connection):
+        return
+    table = RideLocationToken.__table__
+    connection.execute(table.delete().where(table.c.ride_id == ride.id))
+
+def _prefix_range(word):
+    """Bounds of the tokens starting with `word`, for an index range scan instead of LIKE"""
+    return word, word[:-1] + chr(ord(word[-1]) + 1)
+
+def _in_prefix_range(field, word):
+    """Conditions selecting the tokens in `field` that start with `word`"""
+    lower, upper = _prefix_range(word)
+    return (RideLocationToken.field == field,
+            RideLocationToken.token >= lower,
+            RideLocationToken.token < upper)
+
+def _prefixed_words(words):
+    """
+    Which (field, word) pairs start some location word
+
+    All words are probed in one statement, one EXISTS index probe each, so a
+    search costs two statements however many words it has.
+    """
+    if not words:
+        return set()
+    probes = [select(RideLocationToken.ride_id).where(*_in_prefix_range(field, word)).exists()
+              for field, word in words]
+    row = db.session.execute(select(*probes)).one()
+    return {pair for pair, found in zip(words, row) if found}
+
+def _substring_match(field, value):
+    """Subquery of (ride_id, score) for rides whose location contains `value` anywhere"""
+    column = getattr(Ride, LOCATION_FIELDS[field])
+    pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return (select(Ride.id.label('ride_id'), literal(1).label('score'))
+            .where(column.ilike(f'%{pattern}%', escape='\\'))
+            .subquery())
+
+def _prefix_match(field, word):
+    """Subquery of (ride_id, score) for rides with a word starting with `word`"""
+    exact = func.max(case((RideLocationToken.token == word, 1), else_=0))
+    return (select(RideLocationToken.ride_id.label('ride_id'),
+                   (1 + exact).label('score'))
+            .where(*_in_prefix_range(field, word))
+            .group_by(RideLocationToken.ride_id)
+            .subquery())
+
+def _similarity_match(field, value, threshold):
+    """Subquery of (ride_id, score) using pg_trgm word similarity"""
+    column = getattr(Ride, LOCATION_FIELDS[field])
+    needle = normalize_location(value)
+    haystack = func.lower(column)
+    query = (select(Ride.id.label('ride_id'),
+                    func.word_similarity(needle, haystack).label('score'))
+             .where(literal(needle).op('<%')(haystack)))
+    if threshold is not None:
+        query = query.where(func.word_similarity(needle, haystack) >= threshold)
+    return query.subquery()
+
+def search_rides(query, start_location=None, end_location=None, threshold=None):
+    """
+    Filter a Ride query by location and order it by match quality
+
+    On PostgreSQL locations are matched by pg_trgm word similarity through
+    GIN indexes. Elsewhere every query word must be a prefix of a word in
+    the location, looked up in the RideLocationToken table; exact word
+    matches rank above prefix matches. A word that starts no location word
+    (e.g. "avala" for "Lonavala"), or a location with no words at all
+    (only punctuation or symbols), falls back to an ILIKE substring match,
+    so a non-empty location never goes unfiltered.
+
+    Args:
+        query: Base Ride query (other filters already applied)
+        start_location: Free-text start location, optional
+        end_location: Free-text end location, optional
+        threshold: Minimum word similarity on PostgreSQL,
+            defaults to SEARCH_SIMILARITY_THRESHOLD
+
+    Returns:
+        Ride query ordered by rank, then departure time
+    """
+    if threshold is None:
+        threshold = get_config().SEARCH_SIMILARITY_THRESHOLD
+
+    postgresql = is_postgresql()
+    values = [(field, (value or '').strip()) for field, value in (('start', start_location), ('end', end_location))]
+    words = [(field, word) for field, value in values
+             if value and not postgresql for word in tokenize(value)]
+    prefixed = _prefixed_words(words)
+
+    rank = None
+    for field, value in values:
+        if not value:
+            continue
+        if not normalize_location(value):
+            matches = [_substring_match(field, value)]
+        elif postgresql:
+            matches = [_similarity_match(field, value, threshold)]
+        else:
+            matches = [_prefix_match(field, word) if (field, word) in prefixed else _substring_match(field, word)
+                       for word in tokenize(value)]
+
+        for match in matches:
+            query = query.join(match, match.c.ride_id == Ride.id)
+            rank = match.c.score if rank is None else rank + match.c.score
+
+    if rank is not None:
+        query = query.order_by(rank.desc())
+    return query.order_by(Ride.departure_time)
+
+def ensure_search_index():
+    """Create the PostgreSQL trigram indexes, or the token table elsewhere"""
+    if is_postgresql():
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for column in LOCATION_FIELDS.values():
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_ride_{column}_trgm "
+                    f"ON ride USING gin (lower({column}) gin_trgm_ops)"
+                ))
+    else:
+        RideLocationToken.__table__.create(db.engine, checkfirst=True)
+
+def rebuild_index(batch_size=1000, connection=None):
+    """Rebuild the token table for all existing rides"""
+    if is_postgresql():
+        ensure_search_index()
+        return 0
+
+    if connection is None:
+        with db.engine.begin() as conn:
+            return rebuild_index(batch_size, conn)
+
+    table = RideLocationToken.__table__
+    indexed = 0
+    last_id = 0
+    connection.execute(table.delete())
+    while True:
+        batch = connection.execute(
+            select(Ride.id, Ride.start_location, Ride.end_location)
+            .where(Ride.id > last_id)
+            .order_by(Ride.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+
+        rows = []
+        for ride_id, start_location, end_location in batch:
+            rows.extend(_token_rows(ride_id, start_location, end_location))
+        if rows:
+            connection.execute(table.insert(), rows)
+
+        last_id = batch[-1][0]
+        indexed += len(batch)
+    return indexed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    create_app(start_background=False)
+    with app.app_context():
+        ensure_search_index()
+        count = rebuild_index()
+    print(f"Location search index rebuilt for {count} rides")
@@ -0,0 +1,277 @@
+import sys
+import logging
+import argparse
+from datetime import datetime
+from sqlalchemy import inspect, text, select
+from sqlalchemy.schema import CreateIndex
+from app import app, db, create_app
+
+logger = logging.getLogger(__name__)
+
+# Registered migrations, in version order
+MIGRATIONS = []
+
+# Bookkeeping table recording applied versions
+VERSION_TABLE = 'schema_migrations'
+
+def migration(version, description):
+    """Register a schema migration; functions receive an open connection"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+def _has_column(conn, table, column):
+    return column in {col['name'] for col in inspect(conn).get_columns(table)}
+
+def _add_column(conn, table, column, ddl):
+    """Add a column unless it already exists (works on SQLite and PostgreSQL)"""
+    if _has_column(conn, table, column):
+        return
+    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+    logger.info(f"Added column {table}.{column}")
+
+def _create_index(conn, name, table, columns, unique=False):
+    """Create an index unless one with the same name exists"""
+    existing = {index['name'] for index in inspect(conn).get_indexes(table)}
+    existing |= {constraint['name'] for constraint in inspect(conn).get_unique_constraints(table)}
+    if name in existing:
+        return
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    conn.execute(text(f'CREATE {kind} {name} ON "{table}" ({", ".join(columns)})'))
+    logger.info(f"Created index {name} on {table}")
+
+@migration(1, 'Add OTP columns to user')
+def add_otp_columns(conn):
+    _add_column(conn, 'user', 'otp_secret', 'VARCHAR(32)')
+    _add_column(conn, 'user', 'otp_enabled', 'BOOLEAN DEFAULT FALSE')
+    _add_column(conn, 'user', 'otp_verified', 'BOOLEAN DEFAULT FALSE')
+
+@migration(2, 'Add location search index')
+def add_location_search(conn):
+    from models import RideLocationToken
+    RideLocationToken.__table__.create(conn, checkfirst=True)
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in ('start_location', 'end_location'):
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_ride_{column}_trgm "
+                f"ON ride USING gin (lower({column}) gin_trgm_ops)"
+            ))
+    else:
+        from location_search import rebuild_index
+        rebuild_index(connection=conn)
+
+@migration(3, 'Add ride versions for conditional GET')
+def add_ride_versions(conn):
+    from models import CollectionVersion
+    _add_column(conn, 'ride', 'updated_at', 'TIMESTAMP')
+    _add_column(conn, 'ride', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    conn.execute(text("UPDATE ride SET updated_at = created_at WHERE updated_at IS NULL"))
+    CollectionVersion.__table__.create(conn, checkfirst=True)
+
+@migration(4, 'One booking per passenger per ride')
+def add_booking_unique(conn):
+    duplicates = conn.execute(text(
+        "SELECT ride_id, passenger_id FROM booking "
+        "GROUP BY ride_id, passenger_id HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        raise RuntimeError(f"Resolve duplicate bookings before migrating: {duplicates[:10]}")
+    _create_index(conn, 'uq_booking_ride_passenger', 'booking', ['ride_id', 'passenger_id'], unique=True)
+
+@migration(5, 'Composite indexes for ride and booking listings')
+def add_listing_indexes(conn):
+    _create_index(conn, 'ix_ride_active_departure', 'ride', ['is_active', 'departure_time', 'id'])
+    _create_index(conn, 'ix_ride_active_created', 'ride', ['is_active', 'created_at'])
+    _create_index(conn, 'ix_ride_driver_departure', 'ride', ['driver_id', 'departure_time'])
+    _create_index(conn, 'ix_booking_passenger_created', 'booking', ['passenger_id', 'created_at'])
+
+@migration(6, 'Background blockchain transaction jobs')
+def add_chain_jobs(conn):
+    from models import ChainJob
+    ChainJob.__table__.create(conn, checkfirst=True)
+
+@migration(7, 'On-chain event index')
+def add_chain_index(conn):
+    from models import ChainRide, ChainEvent, IndexerCheckpoint
+    ChainRide.__table__.create(conn, checkfirst=True)
+    ChainEvent.__table__.create(conn, checkfirst=True)
+    IndexerCheckpoint.__table__.create(conn, checkfirst=True)
+
+@migration(8, 'Profile publish outbox')
+def add_profile_outbox(conn):
+    from models import ProfilePublish
+    ProfilePublish.__table__.create(conn, checkfirst=True)
+
+@migration(9, 'Reindex location words in non-Latin scripts')
+def reindex_locations(conn):
+    if conn.dialect.name != 'postgresql':
+        from location_search import rebuild_index
+        rebuild_index(connection=conn)
+
+@migration(10, 'Record sender and nonce of chain jobs')
+def add_chain_job_nonce(conn):
+    _add_column(conn, 'chain_job', 'sender', 'VARCHAR(42)')
+    _add_column(conn, 'chain_job', 'nonce', 'INTEGER')
+
+@migration(11, 'Reconciler lease on indexer checkpoints')
+def add_checkpoint_lease(conn):
+    _add_column(conn, 'indexer_checkpoint', 'lease_owner', 'VARCHAR(64)')
+    _add_column(conn, 'indexer_checkpoint', 'lease_expires', 'TIMESTAMP')
+
+@migration(12, 'One in-flight chain job per ride or booking')
+def add_chain_job_in_flight_unique(conn):
+    from models import ChainJob, CHAIN_JOB_IN_FLIGHT
+    statuses = ', '.join(f"'{status}'" for status in CHAIN_JOB_IN_FLIGHT)
+    duplicates = conn.execute(text(
+        f"SELECT kind, ride_id, booking_id FROM chain_job WHERE status IN ({statuses}) "
+        "GROUP BY kind, ride_id, booking_id HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        raise RuntimeError(f"Resolve duplicate in-flight chain jobs before migrating: {duplicates[:10]}")
+    index = next(index for index in ChainJob.__table__.indexes if index.name == 'uq_chain_job_in_flight')
+    # Expression indexes are not reflected, so checkfirst cannot see an existing one
+    conn.execute(CreateIndex(index, if_not_exists=True))
+
+@migration(13, 'Index IPFS hashes served by the proxy')
+def add_ipfs_hash_indexes(conn):
+    _create_index(conn, 'ix_user_ipfs_profile_hash', 'user', ['ipfs_profile_hash'])
+    _create_index(conn, 'ix_profile_publish_ipfs_hash', 'profile_publish', ['ipfs_hash'])
+
+@migration(14, 'Retry backoff for profile publishes')
+def add_profile_publish_backoff(conn):
+    _add_column(conn, 'profile_publish', 'next_attempt_at', 'TIMESTAMP')
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+def applied_versions():
+    """Versions already recorded in the database"""
+    with db.engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text(f"SELECT version FROM {VERSION_TABLE}"))}
+
+def upgrade(target=None):
+    """
+    Apply pending migrations in order, each in its own transaction
+
+    Args:
+        target: Stop after this version, optional
+
+    Returns:
+        List of versions applied
+    """
+    done = applied_versions()
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        with db.engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                text(f"INSERT INTO {VERSION_TABLE} (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        applied.append(version)
+    return applied
+
+def status():
+    """List (version, description, applied) for every known migration"""
+    done = applied_versions()
+    return [(version, description, version in done) for version, description, _ in MIGRATIONS]
+
+def hot_path_queries():
+    """The main query of each hot route, paired with the index expected to serve it"""
+    from models import Ride, Booking, RideLocationToken
+    queries = [
+        ('/api/rides', 'ix_ride_active_departure',
+         select(Ride.id).where(Ride.is_active == True).order_by(Ride.departure_time, Ride.id).limit(50)),
+        ('/ (home feed)', 'ix_ride_active_created',
+         select(Ride.id).where(Ride.is_active == True).order_by(Ride.created_at.desc()).limit(5)),
+        ('/profile (offered rides)', 'ix_ride_driver_departure',
+         select(Ride.id).where(Ride.driver_id == 1).order_by(Ride.departure_time.desc())),
+        ('/profile (bookings)', 'ix_booking_passenger_created',
+         select(Booking.id).where(Booking.passenger_id == 1).order_by(Booking.created_at.desc())),
+        ('/ride/<id> (user booking)', 'uq_booking_ride_passenger',
+         select(Booking.id).where(Booking.ride_id == 1, Booking.passenger_id == 1)),
+    ]
+    if db.engine.dialect.name != 'postgresql':
+        queries.append(('/search-ride', 'ix_ride_location_token_lookup',
+                        select(RideLocationToken.ride_id).where(
+                            RideLocationToken.field == 'start',
+                            RideLocationToken.token >= 'pun',
+                            RideLocationToken.token < 'puo')))
+    return queries
+
+def explain(query):
+    """Return the database's query plan for a statement as text"""
+    with db.engine.connect() as conn:
+        compiled = query.compile(conn, compile_kwargs={'literal_binds': True})
+        if conn.dialect.name == 'postgresql':
+            # Small tables favour sequential scans; ask whether an index can serve the query
+            conn.execute(text("SET enable_seqscan = off"))
+            rows = conn.execute(text(f"EXPLAIN {compiled}")).all()
+            return '\n'.join(row[0] for row in rows)
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        return '\n'.join(str(row[-1]) for row in rows)
+
+def is_index_served(plan, dialect_name):
+    """Check that a plan neither scans a whole table nor sorts in a temp structure"""
+    if dialect_name == 'postgresql':
+        return 'Index' in plan and 'Seq Scan' not in plan and 'Sort' not in plan
+    for step in plan.splitlines():
+        if 'TEMP B-TREE' in step:
+            return False
+        if step.startswith('SCAN') and 'INDEX' not in step:
+            return False
+    return 'INDEX' in plan
+
+def check_indexes():
+    """
+    Verify each hot route's main query is served by an index
+
+    Returns:
+        List of (route, expected index, served, plan) tuples
+    """
+    dialect_name = db.engine.dialect.name
+    results = []
+    for route, index, query in hot_path_queries():
+        plan = explain(query)
+        results.append((route, index, is_index_served(plan, dialect_name), plan))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'status', 'explain'])
+    parser.add_argument('--target', type=int, help='Upgrade only up to this version')
+    args = parser.parse_args(argv)
+
+    create_app(start_background=False)
+    with app.app_context():
+        if args.command == 'upgrade':
+            applied = upgrade(args.target)
+            print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+        elif args.command == 'status':
+            for version, description, is_applied in status():
+                print(f"{version:>4}  {'applied' if is_applied else 'pending':<8} {description}")
+        else:
+            all_served = True
+            for route, index, served, plan in check_indexes():
+                all_served = all_served and served
+                print(f"{'OK  ' if served else 'FAIL'} {route:<28} expected {index}")
+                print('     ' + plan.replace('\n', '\n     '))
+            return 0 if all_served else 1
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
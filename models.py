@@ -25,6 +25,11 @@ class User(UserMixin, db.Model):
     otp_enabled = db.Column(db.Boolean, default=False)
     otp_verified = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        # /ipfs/<hash> only serves hashes some row refers to
+        db.Index('ix_user_ipfs_profile_hash', 'ipfs_profile_hash'),
+    )
+    
     # Relationships
     rides_offered = db.relationship('Ride', backref='driver', lazy='dynamic', 
                                    foreign_keys='Ride.driver_id')
@@ -88,12 +93,50 @@ class Ride(db.Model):
     smart_contract_id = db.Column(db.Integer, nullable=True)
     is_active = db.Column(db.Boolean, default=True)
     
+    # Bumped on every UPDATE (bookings, seat changes, completion); used for ETags
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        onupdate=db.literal_column('version') + 1)
+    
     # Relationships
     bookings = db.relationship('Booking', backref='ride', lazy='dynamic')
+    # Plain list of the same bookings, filled by loaders.load_offered_rides; never lazy-loaded
+    booking_list = db.relationship('Booking', viewonly=True, order_by='Booking.created_at', lazy='raise')
+    
+    # Composite indexes for the ride listings (see migrations.py)
+    __table_args__ = (
+        db.Index('ix_ride_active_departure', 'is_active', 'departure_time', 'id'),
+        db.Index('ix_ride_active_created', 'is_active', 'created_at'),
+        db.Index('ix_ride_driver_departure', 'driver_id', 'departure_time'),
+    )
     
     def __repr__(self):
         return f'<Ride {self.id}: {self.start_location} to {self.end_location}>'
 
+class RideLocationToken(db.Model):
+    """Normalized word index entry for ride location search (non-PostgreSQL backends)"""
+    id = db.Column(db.Integer, primary_key=True)
+    ride_id = db.Column(db.Integer, db.ForeignKey('ride.id'), nullable=False)
+    field = db.Column(db.String(5), nullable=False)  # start, end
+    token = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_ride_location_token_lookup', 'field', 'token', 'ride_id'),
+        db.Index('ix_ride_location_token_ride', 'ride_id'),
+    )
+
+    def __repr__(self):
+        return f'<RideLocationToken {self.ride_id}: {self.field} {self.token!r}>'
+
+class CollectionVersion(db.Model):
+    """Change counter for a set of rows, e.g. the active rides served by the API"""
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CollectionVersion {self.name}: {self.version}>'
+
 class Booking(db.Model):
     """Booking model for storing booking-related data"""
     id = db.Column(db.Integer, primary_key=True)
@@ -104,9 +147,119 @@ class Booking(db.Model):
     transaction_hash = db.Column(db.String(66), nullable=True)
     seats_booked = db.Column(db.Integer, default=1)
     
+    # A passenger holds at most one booking per ride; the unique index also
+    # serves ride_id + passenger_id lookups
+    __table_args__ = (
+        db.UniqueConstraint('ride_id', 'passenger_id', name='uq_booking_ride_passenger'),
+        db.Index('ix_booking_passenger_created', 'passenger_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<Booking {self.id}: Ride {self.ride_id}, Passenger {self.passenger_id}>'
 
+# Job statuses that hold a ride's or booking's slot: at most one such job per kind (uq_chain_job_in_flight)
+CHAIN_JOB_IN_FLIGHT = ('queued', 'submitting', 'submitted')
+
+class ChainJob(db.Model):
+    """Blockchain transaction submitted and confirmed in the background (see tx_pipeline.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # create_ride, book_ride, complete_ride
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, submitting, submitted, confirmed, failed
+    ride_id = db.Column(db.Integer, db.ForeignKey('ride.id'), nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON-encoded contract call arguments
+    tx_hash = db.Column(db.String(66), nullable=True)
+    # Recorded with tx_hash just before the transaction is broadcast, so an interrupted submission can be checked
+    sender = db.Column(db.String(42), nullable=True)
+    nonce = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON-encoded outcome, e.g. the on-chain ride ID
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submitted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_chain_job_status_id', 'status', 'id'),
+        db.Index('ix_chain_job_ride', 'ride_id'),
+        db.Index('uq_chain_job_in_flight', kind, ride_id, db.func.coalesce(booking_id, 0), unique=True,
+                 sqlite_where=status.in_(CHAIN_JOB_IN_FLIGHT), postgresql_where=status.in_(CHAIN_JOB_IN_FLIGHT)),
+    )
+    
+    def __repr__(self):
+        return f'<ChainJob {self.id}: {self.kind} {self.status}>'
+
+class ChainRide(db.Model):
+    """Local mirror of a ride's on-chain state, maintained by chain_indexer.py"""
+    smart_contract_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    driver = db.Column(db.String(42), nullable=False)
+    start_location = db.Column(db.String(128), nullable=False)
+    end_location = db.Column(db.String(128), nullable=False)
+    price = db.Column(db.Numeric(36, 18), nullable=False)  # Price in ETH
+    available_seats = db.Column(db.Integer, nullable=False)
+    is_available = db.Column(db.Boolean, nullable=False)
+    last_event_block = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChainRide {self.smart_contract_id}: {self.start_location} to {self.end_location}>'
+
+class ChainEvent(db.Model):
+    """Contract event seen by the indexer"""
+    id = db.Column(db.Integer, primary_key=True)
+    block_number = db.Column(db.Integer, nullable=False)
+    block_hash = db.Column(db.String(66), nullable=False)
+    tx_hash = db.Column(db.String(66), nullable=False)
+    log_index = db.Column(db.Integer, nullable=False)
+    event = db.Column(db.String(64), nullable=False)
+    smart_contract_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('tx_hash', 'log_index', name='uq_chain_event_log'),
+        db.Index('ix_chain_event_block', 'block_number'),
+        db.Index('ix_chain_event_ride', 'smart_contract_id', 'block_number'),
+    )
+    
+    def __repr__(self):
+        return f'<ChainEvent {self.event} ride {self.smart_contract_id} @ {self.block_number}>'
+
+class IndexerCheckpoint(db.Model):
+    """Progress marker for a background scanner (last processed block or row)"""
+    name = db.Column(db.String(64), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    block_hash = db.Column(db.String(66), nullable=True)
+    # Worker allowed to run the scanner until lease_expires, where only one may run at a time
+    lease_owner = db.Column(db.String(64), nullable=True)
+    lease_expires = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<IndexerCheckpoint {self.name}: {self.position}>'
+
+class ProfilePublish(db.Model):
+    """Pending upload of a user's profile to IPFS (outbox drained by profile_outbox.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, publishing, published, superseded, failed
+    payload = db.Column(db.Text, nullable=False)  # JSON profile document
+    ipfs_hash = db.Column(db.String(64), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # retry backoff; failed rows are queued again after it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    published_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_profile_publish_status_id', 'status', 'id'),
+        db.Index('ix_profile_publish_user', 'user_id', 'id'),
+        db.Index('ix_profile_publish_ipfs_hash', 'ipfs_hash'),
+    )
+    
+    def __repr__(self):
+        return f'<ProfilePublish {self.id}: user {self.user_id} {self.status}>'
+
 class Review(db.Model):
     """Review model for storing user reviews"""
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,118 @@
+import json
+import base64
+import binascii
+import logging
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from app import db
+from models import Ride
+
+logger = logging.getLogger(__name__)
+
+# Page size limits for keyset-paginated endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# Columns exposed by /api/rides, selected directly so no ORM objects are built
+RIDE_API_COLUMNS = (
+    Ride.id,
+    Ride.start_location,
+    Ride.end_location,
+    Ride.departure_time,
+    Ride.price,
+    Ride.available_seats,
+    Ride.driver_id,
+    Ride.smart_contract_id,
+)
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+def encode_cursor(departure_time, ride_id):
+    """Encode a (departure_time, id) keyset position as an opaque token"""
+    payload = json.dumps([departure_time.isoformat(), ride_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        departure_time, ride_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(departure_time), int(ride_id)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def ride_row_to_dict(row):
+    """Convert a row of RIDE_API_COLUMNS to its JSON representation"""
+    return {
+        'id': row.id,
+        'start_location': row.start_location,
+        'end_location': row.end_location,
+        'departure_time': row.departure_time.isoformat(),
+        'price': row.price,
+        'available_seats': row.available_seats,
+        'driver_id': row.driver_id,
+        'smart_contract_id': row.smart_contract_id
+    }
+
+def active_rides_query(cursor=None):
+    """Active rides in (departure_time, id) order, starting after cursor"""
+    query = (select(*RIDE_API_COLUMNS)
+             .where(Ride.is_active == True)
+             .order_by(Ride.departure_time, Ride.id))
+    if cursor:
+        departure_time, ride_id = decode_cursor(cursor)
+        query = query.where(tuple_(Ride.departure_time, Ride.id) > tuple_(departure_time, ride_id))
+    return query
+
+def get_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of active rides
+
+    Args:
+        cursor: Token from a previous page's next_cursor, optional
+        limit: Page size, clamped to MAX_PAGE_SIZE
+
+    Returns:
+        Tuple of (list of ride dicts, next cursor or None)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Fetch one extra row to learn whether another page exists
+    rows = db.session.execute(active_rides_query(cursor).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].departure_time, rows[-1].id)
+
+    return [ride_row_to_dict(row) for row in rows], next_cursor
+
+def iter_rides(cursor=None):
+    """Yield active ride dicts from a server-side cursor"""
+    result = db.session.execute(
+        active_rides_query(cursor).execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    try:
+        for row in result:
+            yield ride_row_to_dict(row)
+    finally:
+        result.close()
+
+def stream_ndjson(rides):
+    """Serialize an iterable of dicts as newline-delimited JSON"""
+    for ride in rides:
+        yield json.dumps(ride) + '\n'
+
+def stream_json_array(rides):
+    """Serialize an iterable of dicts as a JSON array, one element at a time"""
+    yield '['
+    first = True
+    for ride in rides:
+        if not first:
+            yield ','
+        yield json.dumps(ride)
+        first = False
+    yield ']\n'
@@ -0,0 +1,408 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func, exists, bindparam, or_
+from sqlalchemy.orm import aliased
+from app import app, db, create_app
+from models import User, ProfilePublish
+from ipfs_service import ipfs_storage
+from user_cache import user_cache
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Recent publish lags kept for the metrics percentiles
+LAG_WINDOW = 200
+
+class ProfileOutbox:
+    """
+    Publishes user profile documents to IPFS in the background
+
+    Requests insert a ProfilePublish row in the same commit as the user
+    change and return. A dispatcher thread hands users with pending rows to
+    a pool of PROFILE_PUBLISH_WORKERS threads. Each publishes only the
+    newest pending document of a user, marking older pending ones
+    superseded, then sets User.ipfs_profile_hash, unless a newer document
+    of that user was published first. Rows are claimed with conditional
+    UPDATEs, so several gunicorn workers can drain the same table.
+
+    A failed upload is retried after PROFILE_PUBLISH_BACKOFF seconds,
+    doubling with each attempt up to PROFILE_PUBLISH_MAX_BACKOFF, so a short
+    IPFS outage does not use up its attempts. After
+    PROFILE_PUBLISH_MAX_ATTEMPTS the row is marked failed, and queued again
+    PROFILE_PUBLISH_RETRY_FAILED seconds later unless the user has a newer
+    document by then.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.enabled = config.PROFILE_PUBLISH_ENABLED
+        self.workers = config.PROFILE_PUBLISH_WORKERS
+        self.poll_interval = config.PROFILE_PUBLISH_POLL_INTERVAL
+        self.max_attempts = config.PROFILE_PUBLISH_MAX_ATTEMPTS
+        self.backoff = config.PROFILE_PUBLISH_BACKOFF
+        self.max_backoff = config.PROFILE_PUBLISH_MAX_BACKOFF
+        self.retry_failed = config.PROFILE_PUBLISH_RETRY_FAILED
+        self.claim_timeout = timedelta(seconds=config.PROFILE_PUBLISH_TIMEOUT)
+
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._lags = deque(maxlen=LAG_WINDOW)
+        self.published = 0
+        self.superseded = 0
+        self.retried = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def enqueue(self, user, profile):
+        """
+        Queue a profile document for upload and commit it with pending changes
+
+        Args:
+            user: User the document belongs to (may be new in this session)
+            profile: JSON-serializable profile document
+
+        Returns:
+            The committed ProfilePublish
+        """
+        if user.id is None:
+            db.session.flush()
+        publish = ProfilePublish(user_id=user.id, payload=json.dumps(profile), status='pending')
+        db.session.add(publish)
+        db.session.commit()
+        self._wake.set()
+        return publish
+
+    def _claim(self, publish_id, from_status, to_status, **values):
+        """Move a row between states; False if another worker got there first"""
+        result = db.session.execute(
+            update(ProfilePublish)
+            .where(ProfilePublish.id == publish_id, ProfilePublish.status == from_status)
+            .values(status=to_status, updated_at=datetime.utcnow(), **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def requeue_stale(self):
+        """Return rows claimed by a worker that died mid-publish to the queue"""
+        result = db.session.execute(
+            update(ProfilePublish)
+            .where(ProfilePublish.status == 'publishing',
+                   ProfilePublish.updated_at < datetime.utcnow() - self.claim_timeout)
+            .values(status='pending', updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
+
+    def requeue_failed(self):
+        """Queue failed rows again once their cooldown is over; older documents of the user are superseded instead"""
+        now = datetime.utcnow()
+        newer = aliased(ProfilePublish)
+        has_newer = exists(select(newer.id).where(
+            newer.user_id == ProfilePublish.user_id, newer.id > ProfilePublish.id,
+            newer.status.in_(('pending', 'publishing', 'published'))
+        ))
+        due = (ProfilePublish.status == 'failed', ProfilePublish.next_attempt_at <= now)
+        superseded = db.session.execute(
+            update(ProfilePublish)
+            .where(*due, has_newer)
+            .values(status='superseded', next_attempt_at=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        requeued = db.session.execute(
+            update(ProfilePublish)
+            .where(*due, ~has_newer)
+            .values(status='pending', attempts=0, next_attempt_at=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        self.superseded += superseded
+        self.requeued += requeued
+        return requeued
+
+    def pending_users(self, limit):
+        """(user_id, newest pending row id) for users waiting longest, skipping rows backing off"""
+        return db.session.execute(
+            select(ProfilePublish.user_id, func.max(ProfilePublish.id))
+            .where(ProfilePublish.status == 'pending',
+                   or_(ProfilePublish.next_attempt_at.is_(None), ProfilePublish.next_attempt_at <= datetime.utcnow()))
+            .group_by(ProfilePublish.user_id)
+            .order_by(func.min(ProfilePublish.id))
+            .limit(limit)
+        ).all()
+
+    def publish(self, user_id, publish_id):
+        """
+        Upload one user's newest pending document
+
+        Returns:
+            True if it was published
+        """
+        if not self._claim(publish_id, 'pending', 'publishing', attempts=ProfilePublish.attempts + 1):
+            return False
+
+        # Coalesce: older pending documents of this user would be overwritten anyway
+        queued_at = db.session.execute(
+            select(func.min(ProfilePublish.created_at))
+            .where(ProfilePublish.user_id == user_id, ProfilePublish.id <= publish_id,
+                   ProfilePublish.status.in_(('pending', 'publishing')))
+        ).scalar()
+        superseded = db.session.execute(
+            update(ProfilePublish)
+            .where(ProfilePublish.user_id == user_id, ProfilePublish.id < publish_id,
+                   ProfilePublish.status == 'pending')
+            .values(status='superseded', updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        self.superseded += superseded
+
+        publish = db.session.get(ProfilePublish, publish_id)
+        ipfs_hash = ipfs_storage.add_json(json.loads(publish.payload))
+
+        if not ipfs_hash:
+            now = datetime.utcnow()
+            if publish.attempts >= self.max_attempts:
+                retry_at = now + timedelta(seconds=self.retry_failed) if self.retry_failed else None
+                self._claim(publish_id, 'publishing', 'failed', error='IPFS upload failed', next_attempt_at=retry_at)
+                self.failed += 1
+            else:
+                # Back in the queue once the backoff is over
+                delay = min(self.backoff * 2 ** (publish.attempts - 1), self.max_backoff)
+                self._claim(publish_id, 'publishing', 'pending', error='IPFS upload failed, retrying',
+                            next_attempt_at=now + timedelta(seconds=delay))
+                self.retried += 1
+            return False
+
+        now = datetime.utcnow()
+        if not self._claim(publish_id, 'publishing', 'published', ipfs_hash=ipfs_hash, published_at=now,
+                           error=None, next_attempt_at=None):
+            return False
+        newer = select(ProfilePublish.id).where(
+            ProfilePublish.user_id == user_id,
+            ProfilePublish.id > publish_id,
+            ProfilePublish.status == 'published'
+        )
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id, ~exists(newer))
+            .values(ipfs_profile_hash=ipfs_hash)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        user_cache.invalidate(user_id)
+
+        self.published += 1
+        if queued_at is not None:
+            self._lags.append((now - queued_at).total_seconds())
+        logger.info(f"Profile of user {user_id} published to IPFS with hash: {ipfs_hash}")
+        return True
+
+    def _publish_in_context(self, user_id, publish_id):
+        with app.app_context():
+            try:
+                return self.publish(user_id, publish_id)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Profile publish error for user {user_id}: {str(e)}")
+                return False
+
+    def _work(self, user_id, publish_id):
+        try:
+            self._publish_in_context(user_id, publish_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+            self._wake.set()
+
+    def dispatch(self):
+        """Hand users with pending documents to idle workers; returns how many"""
+        with self._lock:
+            idle = self.workers - len(self._in_flight)
+        if idle <= 0:
+            return 0
+        self.requeue_stale()
+        self.requeue_failed()
+        dispatched = 0
+        for user_id, publish_id in self.pending_users(idle + len(self._in_flight)):
+            with self._lock:
+                if user_id in self._in_flight or len(self._in_flight) >= self.workers:
+                    continue
+                self._in_flight.add(user_id)
+            self._executor.submit(self._work, user_id, publish_id)
+            dispatched += 1
+        return dispatched
+
+    def drain(self):
+        """Publish everything pending and not backing off, PROFILE_PUBLISH_WORKERS at a time; returns how many were published"""
+        published = 0
+        self.requeue_stale()
+        self.requeue_failed()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = self.pending_users(self.workers)
+                if not batch:
+                    return published
+                published += sum(executor.map(lambda item: self._publish_in_context(*item), batch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    self.dispatch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Profile outbox error: {str(e)}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start the dispatcher and worker pool (idempotent)"""
+        with self._lock:
+            if not self.enabled or (self._thread and self._thread.is_alive()):
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='profile-publish')
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='profile-outbox', daemon=True)
+            self._thread.start()
+            logger.info("Profile outbox worker started")
+
+    def stop(self, timeout=5):
+        """Stop dispatching; publishes already running are finished"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        """Queue depth and age plus this worker's publish counters and lag"""
+        counts = dict(db.session.execute(
+            select(ProfilePublish.status, func.count(ProfilePublish.id)).group_by(ProfilePublish.status)
+        ).all())
+        oldest = db.session.execute(
+            select(func.min(ProfilePublish.created_at)).where(ProfilePublish.status.in_(('pending', 'publishing')))
+        ).scalar()
+        lags = sorted(self._lags)
+        return {
+            'queue_depth': counts.get('pending', 0) + counts.get('publishing', 0),
+            'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else None,
+            'rows': counts,
+            'published': self.published,
+            'superseded': self.superseded,
+            'retried': self.retried,
+            'failed': self.failed,
+            'requeued': self.requeued,
+            'lag_p50_seconds': round(lags[len(lags) // 2], 3) if lags else None,
+            'lag_p95_seconds': round(lags[min(len(lags) - 1, int(len(lags) * 0.95))], 3) if lags else None,
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
+
+# Create a singleton instance
+profile_outbox = ProfileOutbox()
+
+def profile_document(user):
+    """Profile document of an existing user, as published at registration"""
+    return {
+        'username': user.username,
+        'email': user.email,
+        'ethereum_address': user.ethereum_address,
+        'created_at': user.created_at.isoformat() if user.created_at else None
+    }
+
+def backfill_profiles(include_published=False, page_size=1000, batch_size=None, concurrency=None):
+    """
+    Publish profiles of existing users with IPFSStorage.add_many()
+
+    Users are read in id order, page_size at a time. Hashes are written
+    with one executemany UPDATE per page; without include_published, a
+    user whose hash was set in the meantime (e.g. by the outbox) keeps it.
+
+    Returns:
+        Dict with users, published, failed and seconds
+    """
+    started = time.perf_counter()
+    users = published = 0
+    last_id = 0
+    while True:
+        query = select(User).where(User.id > last_id).order_by(User.id).limit(page_size)
+        if not include_published:
+            query = query.where(User.ipfs_profile_hash.is_(None))
+        page = db.session.execute(query).scalars().all()
+        if not page:
+            break
+        last_id = page[-1].id
+        users += len(page)
+
+        hashes = ipfs_storage.add_many({user.id: profile_document(user) for user in page},
+                                       batch_size=batch_size, concurrency=concurrency)
+        if hashes:
+            statement = (update(User.__table__)
+                         .where(User.__table__.c.id == bindparam('user_id'))
+                         .values(ipfs_profile_hash=bindparam('ipfs_hash')))
+            if not include_published:
+                statement = statement.where(User.__table__.c.ipfs_profile_hash.is_(None))
+            db.session.execute(statement, [{'user_id': user_id, 'ipfs_hash': ipfs_hash}
+                                           for user_id, ipfs_hash in hashes.items()])
+        db.session.commit()
+        user_cache.invalidate(*hashes)
+        db.session.expunge_all()
+        published += len(hashes)
+        logger.info(f"Backfilled profiles up to user {last_id}: {published} published")
+
+    return {
+        'users': users,
+        'published': published,
+        'failed': users - published,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish user profiles to IPFS")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='Drain the profile outbox until stopped (default)')
+    backfill = subparsers.add_parser('backfill', help='Publish profiles of existing users in batches')
+    backfill.add_argument('--all', action='store_true', help='Republish users that already have a profile hash')
+    backfill.add_argument('--batch-size', type=int, default=None, help='Profiles per IPFS request (default: IPFS_ADD_BATCH_SIZE)')
+    backfill.add_argument('--concurrency', type=int, default=None, help='IPFS requests in flight (default: IPFS_ADD_CONCURRENCY)')
+    args = parser.parse_args(argv)
+
+    create_app(start_background=False)
+    if args.command == 'backfill':
+        with app.app_context():
+            result = backfill_profiles(include_published=args.all, batch_size=args.batch_size,
+                                       concurrency=args.concurrency)
+        rate = result['published'] / result['seconds'] if result['seconds'] else 0
+        print(f"Published {result['published']} of {result['users']} profiles in {result['seconds']} s "
+              f"({rate:.0f} objects/sec), {result['failed']} failed")
+        return 1 if result['failed'] else 0
+
+    # Run the publisher in the foreground, e.g. as a dedicated worker process
+    logger.info("Running profile outbox in the foreground")
+    try:
+        while True:
+            with app.app_context():
+                if not profile_outbox.drain():
+                    time.sleep(profile_outbox.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
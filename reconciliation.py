@@ -0,0 +1,553 @@
+import sys
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from app import app, db, create_app
+from models import User, Ride, Booking, ChainJob, ChainEvent, IndexerCheckpoint
+from blockchain_service import blockchain_service
+from tx_pipeline import tx_pipeline, RECEIPT_TIMEOUT_ERROR, IN_FLIGHT, DuplicateJobError
+from settlement import close_rides
+from chain_indexer import CHECKPOINT as INDEXER_CHECKPOINT
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Checkpoint rows holding each pass's watermark
+RIDES = 'reconcile_rides'
+BOOKINGS = 'reconcile_bookings'
+BLOCKS = 'reconcile_blocks'
+
+# Checkpoint rows holding where the last completed ride and booking passes ended
+COMPLETED = {RIDES: 'reconcile_rides_done', BOOKINGS: 'reconcile_bookings_done'}
+
+# Checkpoint row whose lease lets one worker at a time run passes
+LEASE = 'reconcile_lease'
+
+class Reconciler:
+    """
+    Incremental repair of rides and bookings the chain never recorded
+
+    offer_ride and book_ride commit to the database first, so a ride can be
+    left without a smart_contract_id and a booking in 'pending' when the
+    blockchain was unavailable or the job failed. Three passes walk their
+    tables in keyset order from a watermark kept in IndexerCheckpoint,
+    RECONCILE_BATCH_SIZE rows at a time, so memory use does not depend on
+    table size:
+
+    - rides: re-queues createRide for rides without a contract ID, and
+      compares linked rides with their contract state (one get_rides call
+      per batch). Rides completed on chain are closed locally; rides closed
+      only locally are completed on chain.
+    - bookings: re-queues bookRide for pending bookings on linked rides, and
+      confirms bookings on rides that are never going on chain.
+    - blocks: walks the chain indexer's RideCreated events by block range
+      and reports rides created on chain that no local ride is linked to.
+
+    Jobs that failed waiting for a receipt are reopened instead of re-queued
+    when the transaction was mined after all; until it is, the row is only
+    reported as stuck, since a new transaction could repeat it. Rows younger
+    than RECONCILE_GRACE seconds or with a job in flight are left alone, and
+    a row with RECONCILE_MAX_REQUEUES failed jobs is only reported as stuck.
+    The ride and booking passes start over when they reach the end, keeping
+    where the completed pass ended for backlog().
+
+    Only one worker runs passes at a time: it holds a lease on the LEASE
+    checkpoint row, renewed before every batch and given up when the pass
+    ends. Other workers skip their pass while the lease is held; if the
+    holder dies, the lease lapses after RECONCILE_LEASE seconds.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.enabled = config.RECONCILE_ENABLED
+        self.interval = config.RECONCILE_INTERVAL
+        self.batch_size = config.RECONCILE_BATCH_SIZE
+        self.grace = timedelta(seconds=config.RECONCILE_GRACE)
+        self.max_requeues = config.RECONCILE_MAX_REQUEUES
+        self.concurrency = config.RECONCILE_CONCURRENCY
+        self.start_block = config.INDEXER_START_BLOCK
+        self.block_span = config.INDEXER_CHUNK_SIZE
+        self.lease_seconds = config.RECONCILE_LEASE
+        self.owner = uuid.uuid4().hex
+
+        self._thread = None
+        self._stop = threading.Event()
+        self.scanned = {RIDES: 0, BOOKINGS: 0, BLOCKS: 0}
+        self.busy_seconds = 0.0
+        self.passes = 0
+        self.skipped_passes = 0
+        self.repairs = {
+            'create_requeued': 0,
+            'book_requeued': 0,
+            'complete_requeued': 0,
+            'jobs_reopened': 0,
+            'rides_closed': 0,
+            'bookings_confirmed': 0,
+        }
+        self.problems = {
+            'stuck': 0,
+            'missing_on_chain': 0,
+            'seat_mismatches': 0,
+            'orphan_chain_rides': 0,
+        }
+
+    def _checkpoint(self, name, start=0):
+        checkpoint = db.session.get(IndexerCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = IndexerCheckpoint(name=name, position=start)
+            db.session.add(checkpoint)
+        return checkpoint
+
+    def _acquire_lease(self):
+        """Take or renew the lease on running passes; False while another worker holds it"""
+        if db.session.get(IndexerCheckpoint, LEASE) is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(IndexerCheckpoint(name=LEASE, position=0))
+            except IntegrityError:
+                pass  # Created by another worker meanwhile
+        now = datetime.utcnow()
+        acquired = db.session.execute(
+            update(IndexerCheckpoint)
+            .where(IndexerCheckpoint.name == LEASE,
+                   or_(IndexerCheckpoint.lease_owner == self.owner,
+                       IndexerCheckpoint.lease_expires.is_(None),
+                       IndexerCheckpoint.lease_expires < now))
+            .values(lease_owner=self.owner, lease_expires=now + timedelta(seconds=self.lease_seconds))
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+        db.session.commit()
+        return acquired
+
+    def _release_lease(self):
+        db.session.execute(
+            update(IndexerCheckpoint)
+            .where(IndexerCheckpoint.name == LEASE, IndexerCheckpoint.lease_owner == self.owner)
+            .values(lease_owner=None, lease_expires=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _jobs(self, column, keys, kinds):
+        """{(kind, key): [job rows]} for the jobs of some rides or bookings"""
+        jobs = {}
+        rows = db.session.execute(
+            select(ChainJob.id, ChainJob.kind, ChainJob.status, ChainJob.tx_hash, ChainJob.error,
+                   column.label('key'))
+            .where(column.in_(keys), ChainJob.kind.in_(kinds))
+        ).all()
+        for job in rows:
+            jobs.setdefault((job.kind, job.key), []).append(job)
+        return jobs
+
+    def _receipt(self, tx_hash):
+        try:
+            return blockchain_service.get_receipt(tx_hash)
+        except Exception as e:
+            logger.warning(f"Error fetching receipt for {tx_hash}: {str(e)}")
+            return None
+
+    def _receipts(self, jobs):
+        """Receipts of transactions whose jobs gave up waiting for them, fetched concurrently"""
+        tx_hashes = list({job.tx_hash for group in jobs.values() for job in group
+                          if job.status == 'failed' and job.tx_hash and job.error == RECEIPT_TIMEOUT_ERROR})
+        if not tx_hashes:
+            return {}
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            return dict(zip(tx_hashes, pool.map(self._receipt, tx_hashes)))
+
+    def _plan(self, jobs, receipts):
+        """
+        Decide what to do about a row given its jobs of one kind
+
+        Returns:
+            ('wait', None), ('reopen', job), ('stuck', reason) or ('retry', None)
+        """
+        if any(job.status in IN_FLIGHT for job in jobs):
+            return 'wait', None
+        for job in jobs:
+            receipt = receipts.get(job.tx_hash)
+            if receipt is not None and receipt['status'] == 1:
+                return 'reopen', job
+        if any(job.status == 'failed' and job.error == RECEIPT_TIMEOUT_ERROR and receipts.get(job.tx_hash) is None
+               for job in jobs):
+            # Sent but never seen mined; it may still be, so a new transaction could do it twice
+            return 'stuck', 'a transaction timed out and may still be mined'
+        failed = sum(1 for job in jobs if job.status == 'failed')
+        if failed >= self.max_requeues or any(job.status == 'confirmed' for job in jobs):
+            return 'stuck', 'too many failed transactions'
+        return 'retry', None
+
+    def _act(self, plan, what, enqueue):
+        """Carry out a plan from _plan(); enqueue() queues a fresh job"""
+        action, detail = plan
+        if action == 'reopen' and tx_pipeline.reopen(detail.id):
+            self.repairs['jobs_reopened'] += 1
+        elif action == 'stuck':
+            self.problems['stuck'] += 1
+            logger.warning(f"Giving up on {what}: {detail}")
+        elif action == 'retry':
+            try:
+                enqueue()
+            except DuplicateJobError:
+                # Queued by someone else since the batch was read
+                return False
+            return True
+        return False
+
+    def _wrap(self, name, checkpoint):
+        """Record where a pass ended and start the next one from the beginning of its table"""
+        self._checkpoint(COMPLETED[name]).position = checkpoint.position
+        checkpoint.position = 0
+        db.session.commit()
+        if name == RIDES:
+            self.passes += 1
+        return 0
+
+    def reconcile_rides(self):
+        """
+        Check the next batch of rides after the watermark
+
+        Returns:
+            Number of rides scanned (0 once the pass has wrapped around)
+        """
+        checkpoint = self._checkpoint(RIDES)
+        rows = db.session.execute(
+            select(Ride.id, Ride.smart_contract_id, Ride.is_active, Ride.created_at, Ride.start_location,
+                   Ride.end_location, Ride.price, Ride.available_seats, User.ethereum_address)
+            .join(User, User.id == Ride.driver_id)
+            .where(Ride.id > checkpoint.position)
+            .order_by(Ride.id)
+            .limit(self.batch_size)
+        ).all()
+        if not rows:
+            return self._wrap(RIDES, checkpoint)
+
+        if blockchain_service.available:
+            cutoff = datetime.utcnow() - self.grace
+            jobs = self._jobs(ChainJob.ride_id, [row.id for row in rows], ('create_ride', 'complete_ride'))
+            receipts = self._receipts(jobs)
+            self._link_rides([row for row in rows
+                              if row.smart_contract_id is None and row.is_active and row.ethereum_address
+                              and row.created_at and row.created_at < cutoff], jobs, receipts)
+            self._compare_rides([row for row in rows if row.smart_contract_id is not None],
+                                jobs, receipts, cutoff)
+
+        checkpoint.position = rows[-1].id
+        db.session.commit()
+        self.scanned[RIDES] += len(rows)
+        return len(rows)
+
+    def _link_rides(self, rows, jobs, receipts):
+        """Re-queue createRide for rides that never got a contract ID"""
+        if not rows:
+            return
+        # Seats the ride was offered with, before local bookings took some
+        booked = dict(db.session.execute(
+            select(Booking.ride_id, func.sum(Booking.seats_booked))
+            .where(Booking.ride_id.in_([row.id for row in rows]), Booking.status != 'cancelled')
+            .group_by(Booking.ride_id)
+        ).all())
+        for row in rows:
+            def enqueue(row=row):
+                tx_pipeline.enqueue('create_ride', ride_id=row.id, payload={
+                    'driver_address': row.ethereum_address,
+                    'start_location': row.start_location,
+                    'end_location': row.end_location,
+                    'price': row.price,
+                    'available_seats': row.available_seats + (booked.get(row.id) or 0)
+                })
+            plan = self._plan(jobs.get(('create_ride', row.id), []), receipts)
+            if self._act(plan, f"creating ride {row.id} on chain", enqueue):
+                self.repairs['create_requeued'] += 1
+
+    def _compare_rides(self, rows, jobs, receipts, cutoff):
+        """Compare linked rides with their contract state and fix whichever side is behind"""
+        if not rows:
+            return
+        states = blockchain_service.get_rides([row.smart_contract_id for row in rows], use_cache=False)
+        to_close = []
+        for row in rows:
+            state = states.get(row.smart_contract_id)
+            if state is None:
+                self.problems['missing_on_chain'] += 1
+                logger.warning(f"Ride {row.id} is linked to contract ride {row.smart_contract_id}, "
+                               "which the contract does not return")
+                continue
+
+            complete_jobs = jobs.get(('complete_ride', row.id), [])
+            if row.is_active and not state['is_available']:
+                # Completed on chain; the pipeline applies it itself if its job is still running
+                if not any(job.status in IN_FLIGHT for job in complete_jobs):
+                    to_close.append(row.id)
+            elif not row.is_active and state['is_available'] and row.ethereum_address:
+                def enqueue(row=row):
+                    tx_pipeline.enqueue('complete_ride', ride_id=row.id, payload={
+                        'driver_address': row.ethereum_address,
+                        'ride_id': row.smart_contract_id
+                    })
+                plan = self._plan(complete_jobs, receipts)
+                if self._act(plan, f"completing ride {row.id} on chain", enqueue):
+                    self.repairs['complete_requeued'] += 1
+            elif row.is_active and state['available_seats'] != row.available_seats:
+                self.problems['seat_mismatches'] += 1
+
+        if to_close:
+            close_rides(to_close)
+            closed = set(to_close)
+            blockchain_service.invalidate_rides(row.smart_contract_id for row in rows if row.id in closed)
+            self.repairs['rides_closed'] += len(to_close)
+
+    def reconcile_bookings(self):
+        """
+        Check the next batch of pending bookings after the watermark
+
+        Returns:
+            Number of bookings scanned (0 once the pass has wrapped around)
+        """
+        checkpoint = self._checkpoint(BOOKINGS)
+        passenger = aliased(User)
+        driver = aliased(User)
+        rows = db.session.execute(
+            select(Booking.id, Booking.ride_id, Booking.created_at, Booking.seats_booked,
+                   Ride.smart_contract_id, Ride.price,
+                   passenger.ethereum_address.label('passenger_address'),
+                   driver.ethereum_address.label('driver_address'))
+            .join(Ride, Ride.id == Booking.ride_id)
+            .join(passenger, passenger.id == Booking.passenger_id)
+            .join(driver, driver.id == Ride.driver_id)
+            .where(Booking.id > checkpoint.position, Booking.status == 'pending')
+            .order_by(Booking.id)
+            .limit(self.batch_size)
+        ).all()
+        if not rows:
+            return self._wrap(BOOKINGS, checkpoint)
+
+        cutoff = datetime.utcnow() - self.grace
+        rows_due = [row for row in rows if row.created_at and row.created_at < cutoff]
+        # Rides whose driver has no Ethereum address never go on chain
+        local_only = [row.id for row in rows_due if row.smart_contract_id is None and not row.driver_address]
+        on_chain = [row for row in rows_due if row.smart_contract_id is not None]
+
+        if local_only:
+            confirmed = db.session.execute(
+                update(Booking)
+                .where(Booking.id.in_(local_only), Booking.status == 'pending')
+                .values(status='confirmed')
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            self.repairs['bookings_confirmed'] += confirmed
+
+        if on_chain and blockchain_service.available:
+            jobs = self._jobs(ChainJob.booking_id, [row.id for row in on_chain], ('book_ride',))
+            receipts = self._receipts(jobs)
+            for row in on_chain:
+                if not row.passenger_address:
+                    self.problems['stuck'] += 1
+                    continue
+                def enqueue(row=row):
+                    tx_pipeline.enqueue('book_ride', ride_id=row.ride_id, booking_id=row.id, payload={
+                        'passenger_address': row.passenger_address,
+                        'ride_id': row.smart_contract_id,
+                        'price': row.price,
+                        'seats': row.seats_booked
+                    })
+                plan = self._plan(jobs.get(('book_ride', row.id), []), receipts)
+                if self._act(plan, f"booking {row.id} on chain", enqueue):
+                    self.repairs['book_requeued'] += 1
+
+        checkpoint.position = rows[-1].id
+        db.session.commit()
+        self.scanned[BOOKINGS] += len(rows)
+        return len(rows)
+
+    def reconcile_blocks(self):
+        """
+        Check the next range of blocks the chain indexer has stored events for
+
+        Returns:
+            Number of RideCreated events scanned (0 when caught up with the indexer)
+        """
+        indexed = db.session.get(IndexerCheckpoint, INDEXER_CHECKPOINT)
+        checkpoint = self._checkpoint(BLOCKS, start=self.start_block - 1)
+        if indexed is None or checkpoint.position >= indexed.position:
+            db.session.commit()
+            return 0
+
+        to_block = min(indexed.position, checkpoint.position + self.block_span)
+        created = dict(db.session.execute(
+            select(ChainEvent.smart_contract_id, ChainEvent.tx_hash)
+            .where(ChainEvent.block_number > checkpoint.position, ChainEvent.block_number <= to_block,
+                   ChainEvent.event == 'RideCreated')
+        ).all())
+        if created:
+            linked = set(db.session.execute(
+                select(Ride.smart_contract_id).where(Ride.smart_contract_id.in_(list(created)))
+            ).scalars())
+            for contract_id, tx_hash in created.items():
+                if contract_id in linked:
+                    continue
+                # Job hashes may be stored with or without the 0x prefix
+                job_id = db.session.execute(
+                    select(ChainJob.id)
+                    .where(ChainJob.kind == 'create_ride', ChainJob.status == 'failed',
+                           ChainJob.tx_hash.in_([tx_hash, tx_hash.removeprefix('0x')]))
+                ).scalar()
+                if job_id is not None and tx_pipeline.reopen(job_id):
+                    self.repairs['jobs_reopened'] += 1
+                else:
+                    self.problems['orphan_chain_rides'] += 1
+                    logger.warning(f"Contract ride {contract_id} (tx {tx_hash}) is not linked to any ride")
+
+        checkpoint.position = to_block
+        db.session.commit()
+        self.scanned[BLOCKS] += len(created)
+        # Non-zero so run_pass() keeps going until it catches up with the indexer
+        return len(created) or 1
+
+    def run_pass(self):
+        """
+        Walk every pass to the end once, unless another worker is running one
+
+        Returns:
+            Number of rows and events scanned
+        """
+        started = time.perf_counter()
+        scanned = 0
+        leased = True
+        for step in (self.reconcile_rides, self.reconcile_bookings, self.reconcile_blocks):
+            while leased and not self._stop.is_set():
+                with app.app_context():
+                    try:
+                        leased = self._acquire_lease()
+                        if not leased:
+                            break
+                        count = step()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Reconciliation error in {step.__name__}: {str(e)}")
+                        break
+                if not count:
+                    break
+                scanned += count
+
+        if leased:
+            with app.app_context():
+                try:
+                    self._release_lease()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error releasing the reconciler lease: {str(e)}")
+        elif scanned:
+            logger.warning("Reconciler lease taken over by another worker, pass cut short")
+        else:
+            self.skipped_passes += 1
+            logger.info("Reconciliation pass skipped, another worker is running one")
+        self.busy_seconds += time.perf_counter() - started
+        return scanned
+
+    def watch(self):
+        """Run a pass every RECONCILE_INTERVAL seconds until stopped"""
+        while not self._stop.is_set():
+            self.run_pass()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Reconcile in a background thread when RECONCILE_ENABLED is set (idempotent)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.watch, name='reconciler', daemon=True)
+        self._thread.start()
+        logger.info("Reconciler started")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def backlog(self):
+        """
+        Rows each pass has left, and rows still out of sync
+
+        Between passes, i.e. right after a pass wrapped around, only rows
+        added since the completed pass count as left to scan.
+        """
+        positions = dict(db.session.execute(
+            select(IndexerCheckpoint.name, IndexerCheckpoint.position)
+            .where(IndexerCheckpoint.name.in_([RIDES, BOOKINGS, BLOCKS, INDEXER_CHECKPOINT,
+                                               *COMPLETED.values()]))
+        ).all())
+        for name, completed in COMPLETED.items():
+            if not positions.get(name):
+                positions[name] = positions.get(completed, 0)
+        unlinked = db.session.execute(
+            select(func.count(Ride.id)).where(Ride.smart_contract_id.is_(None), Ride.is_active == True)
+        ).scalar()
+        pending = db.session.execute(
+            select(func.count(Booking.id)).where(Booking.status == 'pending')
+        ).scalar()
+        return {
+            'rides_to_scan': db.session.execute(
+                select(func.count(Ride.id)).where(Ride.id > positions.get(RIDES, 0))).scalar(),
+            'bookings_to_scan': db.session.execute(
+                select(func.count(Booking.id))
+                .where(Booking.id > positions.get(BOOKINGS, 0), Booking.status == 'pending')).scalar(),
+            'blocks_to_scan': max(0, positions.get(INDEXER_CHECKPOINT, self.start_block - 1)
+                                  - positions.get(BLOCKS, self.start_block - 1)),
+            'unlinked_rides': unlinked,
+            'pending_bookings': pending,
+        }
+
+    def stats(self):
+        """Rows scanned, throughput and repairs made by this worker"""
+        scanned = sum(self.scanned.values())
+        return {
+            'scanned': {name.replace('reconcile_', ''): count for name, count in self.scanned.items()},
+            'rows_per_second': round(scanned / self.busy_seconds, 1) if self.busy_seconds else None,
+            'passes': self.passes,
+            'skipped_passes': self.skipped_passes,
+            'repairs': dict(self.repairs),
+            'problems': dict(self.problems),
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
+
+# Create a singleton instance
+reconciler = Reconciler()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find and repair rides and bookings out of sync with the chain")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('run', help='Run one full pass and report what was repaired')
+    subparsers.add_parser('watch', help='Run a pass every RECONCILE_INTERVAL seconds')
+    subparsers.add_parser('status', help='Report the backlog without changing anything')
+    args = parser.parse_args(argv)
+
+    create_app(start_background=False)
+    if args.command == 'status':
+        with app.app_context():
+            for key, value in reconciler.backlog().items():
+                print(f"{key:<18} {value}")
+    elif args.command == 'run':
+        scanned = reconciler.run_pass()
+        stats = reconciler.stats()
+        print(f"Scanned {scanned} rows at {stats['rows_per_second']} rows/sec")
+        for key, value in list(stats['repairs'].items()) + list(stats['problems'].items()):
+            print(f"{key:<18} {value}")
+    else:
+        try:
+            reconciler.watch()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import logging
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Ride, Booking
+from http_cache import bump_collection_version
+
+logger = logging.getLogger(__name__)
+
+# One booking per passenger per ride (models.Booking, migration 4)
+DUPLICATE_BOOKING = 'uq_booking_ride_passenger'
+
+class ReservationError(Exception):
+    """Raised when seats on a ride cannot be reserved"""
+
+def _is_duplicate_booking(error):
+    """Whether an IntegrityError is a violation of DUPLICATE_BOOKING"""
+    # PostgreSQL drivers name the constraint; SQLite only lists its columns
+    diag = getattr(error.orig, 'diag', None)
+    if getattr(diag, 'constraint_name', None):
+        return diag.constraint_name == DUPLICATE_BOOKING
+    message = str(error.orig)
+    return DUPLICATE_BOOKING in message or 'booking.ride_id, booking.passenger_id' in message
+
+def reserve_seats(ride_id, passenger_id, seats):
+    """
+    Atomically take seats from a ride and record a pending booking
+
+    The seat check and decrement are a single conditional UPDATE, so
+    concurrent bookings can never oversell a ride, and the unique
+    (ride_id, passenger_id) constraint rejects duplicate bookings. Both
+    happen in one transaction: if either fails nothing is changed.
+
+    Args:
+        ride_id: ID of the ride
+        passenger_id: ID of the booking user
+        seats: Number of seats to reserve
+
+    Returns:
+        The committed Booking
+
+    Raises:
+        ReservationError: If the ride is inactive, lacks seats, or the
+            passenger already has a booking on it
+        IntegrityError: For any other constraint violation
+    """
+    if seats <= 0:
+        raise ReservationError('Seat count must be positive')
+
+    try:
+        result = db.session.execute(
+            update(Ride)
+            .where(Ride.id == ride_id,
+                   Ride.is_active == True,
+                   Ride.available_seats >= seats)
+            .values(available_seats=Ride.available_seats - seats)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            raise ReservationError('Not enough seats available on this ride')
+
+        booking = Booking(
+            ride_id=ride_id,
+            passenger_id=passenger_id,
+            status='pending',
+            seats_booked=seats
+        )
+        db.session.add(booking)
+        db.session.flush()
+
+        # Bulk UPDATEs skip the mapper events that track API versions
+        bump_collection_version(db.session.connection())
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_duplicate_booking(e):
+            raise ReservationError('You have already booked this ride')
+        logger.error(f"Booking ride {ride_id} for user {passenger_id} failed: {str(e.orig)}")
+        raise
+
+    logger.info(f"Reserved {seats} seat(s) on ride {ride_id} for user {passenger_id}")
+    return booking
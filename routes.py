@@ -1,13 +1,26 @@
 import logging
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, jsonify, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import update, select, exists
 
 from app import app, db
-from models import User, Ride, Booking, Review
+from models import User, Ride, Booking, Review, ChainJob, ProfilePublish
 from blockchain_service import blockchain_service
 from ipfs_service import ipfs_storage
+from ipfs_cache import SAFE_KEY
+from location_search import search_rides
+import pagination
+import http_cache
+from feed_cache import feed_cache
+from user_cache import user_cache
+import loaders
+from reservations import reserve_seats, ReservationError
+from tx_pipeline import tx_pipeline, job_to_dict, DuplicateJobError
+from chain_indexer import chain_indexer
+from reconciliation import reconciler
+from profile_outbox import profile_outbox
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +28,7 @@ logger = logging.getLogger(__name__)
 @app.route('/')
 def home():
     # Get latest rides
-    latest_rides = Ride.query.filter_by(is_active=True).order_by(Ride.created_at.desc()).limit(5).all()
+    latest_rides = feed_cache.get_latest_rides(limit=5)
     return render_template('home.html', latest_rides=latest_rides)
 
 # User authentication routes
@@ -131,16 +144,9 @@ def register():
             'created_at': datetime.utcnow().isoformat()
         }
         
-        ipfs_hash = ipfs_storage.add_json(user_profile)
-        if ipfs_hash:
-            new_user.ipfs_profile_hash = ipfs_hash
-            logger.info(f"User profile saved to IPFS with hash: {ipfs_hash}")
-        else:
-            logger.warning("Failed to save user profile to IPFS")
-        
-        # Save to database
+        # Save to database; the profile is uploaded to IPFS in the background
         db.session.add(new_user)
-        db.session.commit()
+        profile_outbox.enqueue(new_user, user_profile)
         
         # Log in the new user
         login_user(new_user)
@@ -201,30 +207,25 @@ def offer_ride():
         
         db.session.add(new_ride)
         db.session.commit()
+        feed_cache.invalidate()
         
         # Check if ethereum address is set
         if not current_user.ethereum_address:
             flash('You need to set up your Ethereum address in your profile to create blockchain rides', 'warning')
             return redirect(url_for('ride_details', ride_id=new_ride.id))
         
-        # Create ride on blockchain
-        if blockchain_service.w3 and blockchain_service.contract:
-            result = blockchain_service.create_ride(
-                driver_address=current_user.ethereum_address,
-                start_location=start_location,
-                end_location=end_location,
-                price=price,
-                available_seats=available_seats
-            )
+        # Create ride on blockchain in the background
+        if blockchain_service.available:
+            job = tx_pipeline.enqueue('create_ride', ride_id=new_ride.id, payload={
+                'driver_address': current_user.ethereum_address,
+                'start_location': start_location,
+                'end_location': end_location,
+                'price': price,
+                'available_seats': available_seats
+            })
             
-            if result:
-                # Update ride with blockchain data
-                new_ride.smart_contract_id = result['ride_id']
-                db.session.commit()
-                
-                flash('Ride created successfully on blockchain!', 'success')
-            else:
-                flash('Ride created in database but blockchain transaction failed', 'warning')
+            flash(f'Ride created! Blockchain transaction submitted (job #{job.id}), '
+                  'it will be linked once confirmed', 'success')
         else:
             flash('Ride created in database but blockchain service is not available', 'warning')
         
@@ -243,13 +244,7 @@ def search_ride():
         date_str = request.form.get('date', '')
         
         # Build query
-        query = Ride.query.filter_by(is_active=True)
-        
-        if start_location:
-            query = query.filter(Ride.start_location.ilike(f'%{start_location}%'))
-        
-        if end_location:
-            query = query.filter(Ride.end_location.ilike(f'%{end_location}%'))
+        query = Ride.query.options(*loaders.RIDE_WITH_DRIVER).filter_by(is_active=True)
         
         if date_str:
             try:
@@ -262,8 +257,8 @@ def search_ride():
             except ValueError:
                 flash('Invalid date format', 'danger')
         
-        # Execute query
-        rides = query.order_by(Ride.departure_time).all()
+        # Match locations through the trigram index, best matches first
+        rides = search_rides(query, start_location, end_location).all()
         
     return render_template('search_ride.html', rides=rides)
 
@@ -282,8 +277,8 @@ def ride_details(ride_id):
     
     # Get blockchain data if available
     blockchain_data = None
-    if ride.smart_contract_id and blockchain_service.w3 and blockchain_service.contract:
-        blockchain_data = blockchain_service.get_ride(ride.smart_contract_id)
+    if ride.smart_contract_id and blockchain_service.available:
+        blockchain_data = chain_indexer.get_ride(ride.smart_contract_id)
     
     return render_template('ride_details.html', ride=ride, user_booking=user_booking, blockchain_data=blockchain_data)
 
@@ -320,36 +315,25 @@ def book_ride(ride_id):
         flash(f'Invalid seat request. Available seats: {ride.available_seats}', 'danger')
         return redirect(url_for('ride_details', ride_id=ride_id))
     
-    new_booking = Booking(
-        ride_id=ride.id,
-        passenger_id=current_user.id,
-        status='pending',
-        seats_booked=seats_requested
-    )
-    
-    # Update available seats
-    ride.available_seats -= seats_requested
-    
-    db.session.add(new_booking)
-    db.session.commit()
-    
-    # Book ride on blockchain
-    if ride.smart_contract_id and blockchain_service.w3 and blockchain_service.contract:
-        result = blockchain_service.book_ride(
-            passenger_address=current_user.ethereum_address,
-            ride_id=ride.smart_contract_id,
-            price=ride.price * seats_requested
-        )
-        
-        if result:
-            # Update booking with transaction hash
-            new_booking.transaction_hash = result['tx_hash']
-            new_booking.status = 'confirmed'
-            db.session.commit()
-            
-            flash('Ride booked successfully on blockchain!', 'success')
-        else:
-            flash('Booking created in database but blockchain transaction failed', 'warning')
+    # Take the seats and create the booking atomically
+    try:
+        new_booking = reserve_seats(ride.id, current_user.id, seats_requested)
+    except ReservationError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('ride_details', ride_id=ride_id))
+    feed_cache.invalidate()
+    
+    # Book ride on blockchain in the background
+    if ride.smart_contract_id and blockchain_service.available:
+        job = tx_pipeline.enqueue('book_ride', ride_id=ride.id, booking_id=new_booking.id, payload={
+            'passenger_address': current_user.ethereum_address,
+            'ride_id': ride.smart_contract_id,
+            'price': ride.price,
+            'seats': seats_requested
+        })
+        
+        flash(f'Ride booked! Blockchain payment submitted (job #{job.id}), '
+              'your booking is confirmed once it is mined', 'success')
     else:
         flash('Booking created in database but blockchain service is not available', 'warning')
     
@@ -366,33 +350,32 @@ def complete_ride(ride_id):
         flash('Only the driver can complete this ride', 'danger')
         return redirect(url_for('ride_details', ride_id=ride_id))
     
-    # Complete ride on blockchain
-    if ride.smart_contract_id and blockchain_service.w3 and blockchain_service.contract:
-        result = blockchain_service.complete_ride(
-            driver_address=current_user.ethereum_address,
-            ride_id=ride.smart_contract_id
-        )
-        
-        if result:
-            # Update ride and bookings
-            ride.is_active = False
-            bookings = Booking.query.filter_by(ride_id=ride.id).all()
-            for booking in bookings:
-                booking.status = 'completed'
-            
-            db.session.commit()
-            
-            flash('Ride completed successfully!', 'success')
-        else:
-            flash('Blockchain transaction failed', 'warning')
+    # Complete ride on blockchain in the background; the ride and its
+    # bookings are closed when the transaction is confirmed
+    if ride.smart_contract_id and blockchain_service.available:
+        # The ride stays active until then, so a repeated POST must not send a second completeRide
+        try:
+            job = tx_pipeline.enqueue('complete_ride', ride_id=ride.id, payload={
+                'driver_address': current_user.ethereum_address,
+                'ride_id': ride.smart_contract_id
+            })
+        except DuplicateJobError:
+            flash('Ride completion is already being processed', 'info')
+            return redirect(url_for('profile'))
+        
+        flash(f'Ride completion submitted to blockchain (job #{job.id})', 'success')
     else:
         # Complete ride in database only
         ride.is_active = False
-        bookings = Booking.query.filter_by(ride_id=ride.id).all()
-        for booking in bookings:
-            booking.status = 'completed'
+        db.session.execute(
+            update(Booking)
+            .where(Booking.ride_id == ride.id)
+            .values(status='completed')
+            .execution_options(synchronize_session=False)
+        )
         
         db.session.commit()
+        feed_cache.invalidate()
         
         flash('Ride marked as completed in database', 'success')
     
@@ -401,23 +384,27 @@ def complete_ride(ride_id):
 @app.route('/profile')
 @login_required
 def profile():
-    # Get user's rides and bookings
-    offered_rides = Ride.query.filter_by(driver_id=current_user.id).order_by(Ride.departure_time.desc()).all()
-    bookings = Booking.query.filter_by(passenger_id=current_user.id).order_by(Booking.created_at.desc()).all()
+    # Generate OTP URI for QR code if not already verified; first, as creating the secret commits
+    otp_uri = None
+    if not current_user.otp_verified:
+        otp_uri = current_user.get_otp_uri()
+    
+    # Get user's rides and bookings, with related rows eager-loaded
+    offered_rides = loaders.load_offered_rides(current_user.id)
+    bookings = loaders.load_bookings(current_user.id)
+    ride_stats = loaders.ride_booking_stats(offered_rides)
     
     # Get IPFS profile data if available
     ipfs_profile = None
     if current_user.ipfs_profile_hash:
         ipfs_profile = ipfs_storage.get_json(current_user.ipfs_profile_hash)
     
-    # Generate OTP URI for QR code if not already verified
-    otp_uri = None
-    if not current_user.otp_verified:
-        otp_uri = current_user.get_otp_uri()
-    
+    # profile.html lists passengers from ride.booking_list and counts from
+    # ride_stats[ride.id]; the dynamic ride.bookings would query once per ride
     return render_template('profile.html', 
                           offered_rides=offered_rides, 
                           bookings=bookings, 
+                          ride_stats=ride_stats, 
                           ipfs_profile=ipfs_profile, 
                           otp_uri=otp_uri)
 
@@ -439,11 +426,8 @@ def update_profile():
             'updated_at': datetime.utcnow().isoformat()
         }
         
-        ipfs_hash = ipfs_storage.add_json(user_profile)
-        if ipfs_hash:
-            current_user.ipfs_profile_hash = ipfs_hash
-        
-        db.session.commit()
+        # Commits the address change; the upload happens in the background
+        profile_outbox.enqueue(current_user, user_profile)
         flash('Profile updated successfully!', 'success')
     else:
         flash('Ethereum address is required', 'danger')
@@ -493,25 +477,69 @@ def disable_otp():
 # API endpoints
 @app.route('/api/rides', methods=['GET'])
 def api_rides():
-    # Get all active rides
-    rides = Ride.query.filter_by(is_active=True).all()
-    
-    # Convert to JSON
-    rides_json = [{
-        'id': ride.id,
-        'start_location': ride.start_location,
-        'end_location': ride.end_location,
-        'departure_time': ride.departure_time.isoformat(),
-        'price': ride.price,
-        'available_seats': ride.available_seats,
-        'driver_id': ride.driver_id,
-        'smart_contract_id': ride.smart_contract_id
-    } for ride in rides]
+    # Active rides ordered by (departure_time, id); `cursor` resumes after a previous page
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    
+    # Answer conditional requests from the collection version alone
+    version, last_modified = http_cache.get_collection_version()
+    etag = http_cache.make_etag('rides', version, request.query_string.decode(),
+                                request.accept_mimetypes.best)
+    cached = http_cache.not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    try:
+        # Stream every remaining ride as newline-delimited JSON
+        if request.args.get('format') == 'ndjson' or \
+                request.accept_mimetypes.best == 'application/x-ndjson':
+            if cursor:
+                # Validate up front, while a 400 can still be returned
+                pagination.decode_cursor(cursor)
+            rides = pagination.iter_rides(cursor)
+            response = Response(stream_with_context(pagination.stream_ndjson(rides)),
+                                mimetype='application/x-ndjson')
+        
+        # Keyset-paginated page
+        elif cursor or limit:
+            rides, next_cursor = pagination.get_page(cursor, limit or pagination.DEFAULT_PAGE_SIZE)
+            response = jsonify({'rides': rides, 'next_cursor': next_cursor})
+        
+        # Full list as a plain JSON array, streamed row by row
+        else:
+            rides = pagination.iter_rides()
+            response = Response(stream_with_context(pagination.stream_json_array(rides)),
+                                mimetype='application/json')
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(rides_json)
+    return http_cache.add_validators(response, etag, last_modified)
 
 @app.route('/api/ride/<int:ride_id>', methods=['GET'])
 def api_ride(ride_id):
+    # Check the client's cached copy against the ride version before loading it
+    ride_version = http_cache.get_ride_version(ride_id)
+    if ride_version is None:
+        abort(404)
+    
+    # The body embeds on-chain data, which changes without bumping the ride
+    # version; the indexer's mirror row versions that part
+    with_chain = bool(ride_version.smart_contract_id) and blockchain_service.available
+    etag = last_modified = None
+    if not with_chain:
+        etag = http_cache.make_etag('ride', ride_id, ride_version.version)
+        last_modified = ride_version.updated_at
+    elif ride_version.chain_block is not None:
+        etag = http_cache.make_etag('ride', ride_id, ride_version.version,
+                                    ride_version.chain_block, ride_version.chain_updated_at)
+        last_modified = max(filter(None, (ride_version.updated_at, ride_version.chain_updated_at)), default=None)
+    # Otherwise the ride is not indexed yet and blockchain_data is read live, so nothing validates it
+    
+    if etag:
+        cached = http_cache.not_modified(etag, last_modified)
+        if cached:
+            return cached
+    
     # Get ride from database
     ride = Ride.query.get_or_404(ride_id)
     
@@ -529,17 +557,19 @@ def api_ride(ride_id):
     }
     
     # Get blockchain data if available
-    if ride.smart_contract_id and blockchain_service.w3 and blockchain_service.contract:
-        blockchain_data = blockchain_service.get_ride(ride.smart_contract_id)
+    if ride.smart_contract_id and blockchain_service.available:
+        blockchain_data = chain_indexer.get_ride(ride.smart_contract_id)
         if blockchain_data:
             ride_json['blockchain_data'] = blockchain_data
     
-    return jsonify(ride_json)
+    if not etag:
+        return jsonify(ride_json)
+    return http_cache.add_validators(jsonify(ride_json), etag, last_modified)
 
 @app.route('/api/blockchain/rides', methods=['GET'])
 def api_blockchain_rides():
     # Get active rides from blockchain
-    if blockchain_service.w3 and blockchain_service.contract:
+    if blockchain_service.available:
         offset = int(request.args.get('offset', 0))
         limit = int(request.args.get('limit', 10))
         
@@ -551,6 +581,72 @@ def api_blockchain_rides():
     else:
         return jsonify({'rides': [], 'error': 'Blockchain service not available'})
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def api_job(job_id):
+    # Poll the status of a background blockchain transaction
+    job = ChainJob.query.get_or_404(job_id)
+    return jsonify(job_to_dict(job))
+
+@app.route('/api/ride/<int:ride_id>/jobs', methods=['GET'])
+def api_ride_jobs(ride_id):
+    # Background blockchain transactions for a ride, newest first
+    jobs = ChainJob.query.filter_by(ride_id=ride_id).order_by(ChainJob.id.desc()).all()
+    return jsonify({'jobs': [job_to_dict(job) for job in jobs]})
+
+@app.route('/ipfs/<ipfs_hash>', methods=['GET'])
+def ipfs_content(ipfs_hash):
+    # Proxy IPFS content chunk by chunk, so large files use constant memory
+    if not SAFE_KEY.match(ipfs_hash) or not _is_known_hash(ipfs_hash):
+        abort(404)
+    # Content never changes for a hash, so clients may keep it indefinitely
+    cached = http_cache.not_modified(ipfs_hash)
+    if cached is not None:
+        return _immutable(cached)
+    
+    stream = ipfs_storage.open_stream(ipfs_hash)
+    if stream is None:
+        abort(404)
+    response = Response(stream, mimetype='application/octet-stream')
+    if stream.length is not None:
+        response.content_length = stream.length
+    response.set_etag(ipfs_hash)
+    return _immutable(response)
+
+def _is_known_hash(ipfs_hash):
+    """Whether a profile refers to the hash; the proxy serves nothing else"""
+    return db.session.execute(select(
+        exists().where(User.ipfs_profile_hash == ipfs_hash)
+        | exists().where(ProfilePublish.ipfs_hash == ipfs_hash)
+    )).scalar()
+
+def _immutable(response):
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    # Cache and pipeline counters for this worker process
+    return jsonify({
+        'services': {'blockchain': blockchain_service.health(), 'ipfs': ipfs_storage.health()},
+        'ipfs_cache': ipfs_storage.cache.stats(),
+        'ipfs_gateways': ipfs_storage.gateways.stats(),
+        'home_feed_cache': feed_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'chain_read_cache': blockchain_service.read_cache.stats(),
+        'ethereum_rpc': blockchain_service.provider_stats(),
+        'nonces': blockchain_service.nonces.stats(),
+        'gas_estimates': blockchain_service.gas_estimates.stats(),
+        'dev_chain': blockchain_service.simulator.stats() if blockchain_service.dev_mode else None,
+        'dev_ipfs': ipfs_storage.blockstore.stats() if ipfs_storage.dev_mode else None,
+        'tx_pipeline': tx_pipeline.stats(),
+        'chain_indexer': chain_indexer.stats(),
+        'reconciliation': reconciler.stats(),
+        'profile_publish': profile_outbox.stats()
+    })
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
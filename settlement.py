@@ -0,0 +1,243 @@
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update
+from app import app, db, create_app
+from models import User, Ride, Booking, ChainJob, CHAIN_JOB_IN_FLIGHT
+from blockchain_service import blockchain_service, TransactionMaybeSentError
+from feed_cache import feed_cache
+from http_cache import bump_collection_version
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Rides per IN (...) list, well under SQLite's bound-parameter limit
+UPDATE_CHUNK_SIZE = 500
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def close_rides(ride_ids):
+    """Mark rides inactive and their bookings completed with bulk UPDATEs, then commit"""
+    ride_ids = list(ride_ids)
+    if not ride_ids:
+        return
+    for chunk in _chunks(ride_ids, UPDATE_CHUNK_SIZE):
+        db.session.execute(
+            update(Ride)
+            .where(Ride.id.in_(chunk))
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Booking)
+            .where(Booking.ride_id.in_(chunk))
+            .values(status='completed')
+            .execution_options(synchronize_session=False)
+        )
+    # Core UPDATEs skip the ORM hooks that track the active ride set
+    bump_collection_version(db.session.connection())
+    db.session.commit()
+    feed_cache.invalidate()
+
+class RideSettlement:
+    """
+    Complete many rides on chain and in the database in one pass
+
+    Rides are grouped by driver and completed with completeRides
+    transactions of up to SETTLEMENT_BATCH_SIZE rides when the contract has
+    that function, or one completeRide transaction per ride otherwise.
+    Every transaction is submitted before any receipt is awaited (nonces are
+    allocated locally, so a driver's transactions don't wait on each other)
+    and receipts are then polled concurrently. A batch that reverts is
+    retried one ride per transaction, so one bad ride does not hold back the
+    rest. Confirmed rides and their bookings are closed with bulk UPDATEs in
+    a single commit.
+    """
+
+    def __init__(self, batch_size=None, concurrency=None, receipt_timeout=None, poll_interval=1.0):
+        config = get_config()
+        self.batch_size = batch_size or config.SETTLEMENT_BATCH_SIZE
+        self.concurrency = concurrency or config.SETTLEMENT_CONCURRENCY
+        self.receipt_timeout = receipt_timeout or config.SETTLEMENT_RECEIPT_TIMEOUT
+        self.poll_interval = poll_interval
+
+    def settle(self, ride_ids, use_batch_call=True):
+        """
+        Complete rides on chain, then close them and their bookings locally
+
+        Rides without an on-chain ID are only closed locally. Rides that are
+        already inactive or have a complete_ride job in flight are skipped.
+
+        Args:
+            ride_ids: Local Ride IDs
+            use_batch_call: Use completeRides when the contract supports it
+
+        Returns:
+            Dict of local Ride ID lists: completed, failed (still active),
+            unconfirmed (no receipt within SETTLEMENT_RECEIPT_TIMEOUT; check
+            again later) and skipped
+        """
+        ride_ids = list(dict.fromkeys(ride_ids))
+        rides = self._load(ride_ids)
+        result = {'completed': [], 'failed': [], 'unconfirmed': [],
+                  'skipped': [ride_id for ride_id in ride_ids if ride_id not in rides]}
+
+        on_chain = []
+        for ride_id, (contract_id, driver_address) in rides.items():
+            if contract_id is None:
+                result['completed'].append(ride_id)
+            elif driver_address and blockchain_service.available:
+                on_chain.append((driver_address, ride_id, contract_id))
+            else:
+                # Closing it locally would leave the payments in escrow
+                result['failed'].append(ride_id)
+
+        if on_chain:
+            confirmed, failed, unconfirmed = self._complete_on_chain(on_chain, use_batch_call)
+            result['completed'].extend(confirmed)
+            result['failed'].extend(failed)
+            result['unconfirmed'].extend(unconfirmed)
+            confirmed = set(confirmed)
+            blockchain_service.invalidate_rides(
+                contract_id for _, ride_id, contract_id in on_chain if ride_id in confirmed)
+
+        close_rides(result['completed'])
+        logger.info(f"Settled {len(result['completed'])} rides, {len(result['failed'])} failed, "
+                    f"{len(result['unconfirmed'])} unconfirmed, {len(result['skipped'])} skipped")
+        return result
+
+    def _load(self, ride_ids):
+        """{ride_id: (smart_contract_id, driver address)} for active rides with no completion in flight"""
+        rides = {}
+        for chunk in _chunks(ride_ids, UPDATE_CHUNK_SIZE):
+            in_flight = select(ChainJob.ride_id).where(
+                ChainJob.kind == 'complete_ride',
+                ChainJob.status.in_(CHAIN_JOB_IN_FLIGHT))
+            rows = db.session.execute(
+                select(Ride.id, Ride.smart_contract_id, User.ethereum_address)
+                .join(User, User.id == Ride.driver_id)
+                .where(Ride.id.in_(chunk), Ride.is_active == True, Ride.id.not_in(in_flight))
+            ).all()
+            rides.update((ride_id, (contract_id, address)) for ride_id, contract_id, address in rows)
+        return rides
+
+    def _submit(self, batch):
+        driver_address, rides = batch
+        contract_ids = [contract_id for _, contract_id in rides]
+        try:
+            if len(contract_ids) == 1:
+                return blockchain_service.submit_complete_ride(driver_address, contract_ids[0])
+            return blockchain_service.submit_complete_rides(driver_address, contract_ids)
+        except TransactionMaybeSentError as e:
+            # Polled like any other; reported as unconfirmed if it never shows up
+            return e.tx_hash
+        except Exception as e:
+            logger.error(f"Error submitting settlement for {driver_address}: {str(e)}")
+            return None
+
+    def _receipt(self, tx_hash):
+        try:
+            return blockchain_service.get_receipt(tx_hash)
+        except Exception as e:
+            logger.warning(f"Error fetching receipt for {tx_hash}: {str(e)}")
+            return None
+
+    def _await_receipts(self, pool, tx_hashes):
+        """Poll receipts of all transactions concurrently until mined or timed out"""
+        deadline = time.monotonic() + self.receipt_timeout
+        receipts = {}
+        pending = list(tx_hashes)
+        while pending:
+            for tx_hash, receipt in zip(pending, pool.map(self._receipt, pending)):
+                if receipt is not None:
+                    receipts[tx_hash] = receipt
+            pending = [tx_hash for tx_hash in pending if tx_hash not in receipts]
+            if pending and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+            else:
+                break
+        return receipts
+
+    def _complete_on_chain(self, rides, use_batch_call):
+        """
+        Submit and confirm completions for (driver address, ride ID, contract ID) triples
+
+        Returns:
+            (confirmed, failed, unconfirmed) lists of local Ride IDs
+        """
+        by_driver = {}
+        for driver_address, ride_id, contract_id in rides:
+            by_driver.setdefault(driver_address, []).append((ride_id, contract_id))
+
+        size = self.batch_size if use_batch_call and blockchain_service.supports_batch_complete else 1
+        batches = [(driver_address, chunk)
+                   for driver_address, driver_rides in by_driver.items()
+                   for chunk in _chunks(driver_rides, size)]
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            tx_hashes = list(pool.map(self._submit, batches))
+            receipts = self._await_receipts(pool, [tx_hash for tx_hash in tx_hashes if tx_hash])
+
+        confirmed, failed, unconfirmed, retry = [], [], [], []
+        for (driver_address, batch_rides), tx_hash in zip(batches, tx_hashes):
+            ride_ids = [ride_id for ride_id, _ in batch_rides]
+            receipt = receipts.get(tx_hash) if tx_hash else None
+            if not tx_hash:
+                failed.extend(ride_ids)
+            elif receipt is None:
+                logger.warning(f"No receipt for settlement transaction {tx_hash} (rides {ride_ids})")
+                unconfirmed.extend(ride_ids)
+            elif receipt['status'] == 1:
+                confirmed.extend(ride_ids)
+            elif len(batch_rides) > 1:
+                logger.warning(f"Settlement batch {tx_hash} reverted, retrying its {len(ride_ids)} rides one by one")
+                retry.extend((driver_address, ride_id, contract_id) for ride_id, contract_id in batch_rides)
+            else:
+                failed.extend(ride_ids)
+
+        if retry:
+            more_confirmed, more_failed, more_unconfirmed = self._complete_on_chain(retry, use_batch_call=False)
+            confirmed.extend(more_confirmed)
+            failed.extend(more_failed)
+            unconfirmed.extend(more_unconfirmed)
+        return confirmed, failed, unconfirmed
+
+# Create a singleton instance
+ride_settlement = RideSettlement()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Complete many rides on chain and in the database")
+    parser.add_argument('ride_ids', nargs='*', type=int, help='Local ride IDs to settle')
+    parser.add_argument('--departed-before', type=datetime.fromisoformat,
+                        help='Settle every active ride that departed before this time (ISO format)')
+    parser.add_argument('--no-batch-call', action='store_true',
+                        help='Send one completeRide transaction per ride even if completeRides exists')
+    args = parser.parse_args(argv)
+    if not args.ride_ids and not args.departed_before:
+        parser.error("give ride IDs or --departed-before")
+
+    create_app(start_background=False)
+    with app.app_context():
+        ride_ids = list(args.ride_ids)
+        if args.departed_before:
+            ride_ids += db.session.execute(
+                select(Ride.id)
+                .where(Ride.is_active == True, Ride.departure_time < args.departed_before)
+                .order_by(Ride.id)
+            ).scalars().all()
+        result = ride_settlement.settle(ride_ids, use_batch_call=not args.no_batch_call)
+
+    print(f"Completed {len(result['completed'])} rides")
+    for status in ('failed', 'unconfirmed', 'skipped'):
+        if result[status]:
+            print(f"{status.capitalize()}: {result[status]}")
+    return 1 if result['failed'] or result['unconfirmed'] else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
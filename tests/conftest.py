@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its configuration from the environment at import time
+SCRATCH = tempfile.mkdtemp(prefix='carpool-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(SCRATCH, 'test.db')}"
+os.environ['DEV_MODE'] = 'true'
+os.environ['DEV_CHAIN_STATE_PATH'] = ''
+os.environ['IPFS_CACHE_DIR'] = ''
+os.environ['IPFS_DEV_STORE_DIR'] = os.path.join(SCRATCH, 'ipfs_blocks')
+os.environ['TX_PIPELINE_ENABLED'] = 'false'
+os.environ['PROFILE_PUBLISH_ENABLED'] = 'false'
+os.environ['USER_CACHE_TTL'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Before any test module imports models or services, which need the app set up first
+import app as _app  # noqa: E402,F401
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app(start_background=False)
+
+@pytest.fixture(autouse=True)
+def db(app):
+    """An empty database and a fresh dev chain for every test"""
+    from app import db, init_db
+    from blockchain_service import blockchain_service
+    from feed_cache import feed_cache
+
+    with app.app_context():
+        yield db
+        db.session.remove()
+        db.drop_all()
+        init_db()
+    blockchain_service.simulator.reset()
+    blockchain_service.read_cache.invalidate()
+    feed_cache.invalidate()
+
+@pytest.fixture
+def make_user(db):
+    """Create and commit a user; returns the User"""
+    from models import User
+
+    def make(name, **fields):
+        user = User(username=name, email=f'{name}@example.com', **fields)
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make
+
+@pytest.fixture
+def make_ride(db):
+    """Create and commit an active ride; returns the Ride"""
+    from datetime import datetime, timedelta
+    from models import Ride
+
+    def make(driver, seats=4, price=0.1, **fields):
+        fields.setdefault('start_location', 'Old Town')
+        fields.setdefault('end_location', 'Airport')
+        fields.setdefault('is_active', True)
+        ride = Ride(driver_id=driver.id, departure_time=datetime.utcnow() + timedelta(days=1),
+                    price=price, available_seats=seats, **fields)
+        db.session.add(ride)
+        db.session.commit()
+        return ride
+    return make
+
+@pytest.fixture
+def standin_node():
+    """(url, server) of benchmarks.py's JSON-RPC/IPFS stand-in node on localhost"""
+    from benchmarks import start_standin_node
+    url, server = start_standin_node(0)
+    yield url, server
+    server.shutdown()
+    server.server_close()
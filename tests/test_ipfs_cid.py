@@ -0,0 +1,29 @@
+import io
+
+from ipfs_cid import CHUNK_SIZE, MAX_LINKS, cid_v0, cid_v0_of_file, cid_v0_of_chunks, decode_node, b58decode, is_cid_v0
+
+def test_matches_ipfs_add():
+    # `echo "hello world" | ipfs add` and an empty file
+    assert cid_v0(b'hello world\n') == 'QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o'
+    assert cid_v0(b'') == 'QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH'
+
+def test_file_and_chunk_variants_agree():
+    data = bytes(range(256)) * (CHUNK_SIZE // 256 * 3 + 1)
+    assert cid_v0_of_file(io.BytesIO(data)) == cid_v0(data)
+
+def test_dag_links_every_chunk():
+    # Small chunks force a tree deeper than one level of MAX_LINKS
+    chunk_size = 16
+    data = bytes(range(256)) * ((MAX_LINKS + 5) * chunk_size // 256 + 1)
+    blocks = {}
+    root = cid_v0_of_chunks((data[i:i + chunk_size] for i in range(0, len(data), chunk_size)),
+                            on_block=lambda multihash, block: blocks.setdefault(multihash, block))
+
+    def read(multihash):
+        links, (start, end), filesize = decode_node(blocks[multihash])
+        content = b''.join(read(link) for link in links) if links else blocks[multihash][start:end]
+        assert len(content) == filesize
+        return content
+
+    assert is_cid_v0(root)
+    assert read(b58decode(root)) == data
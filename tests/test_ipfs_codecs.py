@@ -0,0 +1,58 @@
+import pytest
+
+from ipfs_codecs import CODECS, COMPRESSIONS, DocumentCodec, detect, encode_dag_cbor, missing_package
+
+DOCUMENTS = [
+    {},
+    {'username': 'rider', 'email': 'rider@example.com', 'created_at': '2024-01-01T00:00:00'},
+    {'rides': [{'ride_id': 7, 'price': 0.25, 'seats': 2, 'done': True, 'note': None}] * 20,
+     'reputation': -1.5, 'name': 'Zoë'},
+    [],
+    [1, 2, {'nested': ['a', 'b']}],
+]
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_round_trip(codec, compression):
+    if missing_package(codec) or missing_package(compression):
+        pytest.skip(f"{missing_package(codec) or missing_package(compression)} not installed")
+    encoder = DocumentCodec(codec, compression)
+    for document in DOCUMENTS:
+        assert encoder.decode(encoder.encode(document)) == document
+
+@pytest.mark.parametrize('codec', [codec for codec in CODECS if codec != 'json'])
+def test_detects_codec_of_arrays_and_maps(codec):
+    if missing_package(codec):
+        pytest.skip(f"{missing_package(codec)} not installed")
+    encoder = DocumentCodec(codec, '')
+    for document in DOCUMENTS:
+        assert detect(encoder.encode(document)) == codec
+
+@pytest.mark.parametrize('codec, prefix', [('dag-cbor', b'\x71'), ('msgpack', b'\x81\x04')])
+def test_binary_documents_start_with_multicodec_prefix(codec, prefix):
+    if missing_package(codec):
+        pytest.skip(f"{missing_package(codec)} not installed")
+    encoder = DocumentCodec(codec, '')
+    assert encoder.encode([1, 2]).startswith(prefix)
+
+def test_json_is_read_by_any_codec():
+    # Documents from before IPFS_CODEC existed keep their bytes and hash
+    assert DocumentCodec('json', '').encode({'a': 1}) == b'{"a": 1}'
+    for codec in CODECS:
+        if not missing_package(codec):
+            assert DocumentCodec(codec, '').decode(b'{"a": 1}') == {'a': 1}
+
+def test_dag_cbor_is_deterministic():
+    if missing_package('dag-cbor'):
+        pytest.skip("cbor2 not installed")
+    # Shorter keys first, then bytewise; floats always 64 bits
+    assert encode_dag_cbor({'bb': 1, 'a': 1.5, 'c': None}) == \
+        bytes.fromhex('a3') + b'\x61a' + bytes.fromhex('fb3ff8000000000000') + b'\x61c\xf6' + b'\x62bb\x01'
+    with pytest.raises(ValueError):
+        encode_dag_cbor({'x': float('nan')})
+    with pytest.raises(TypeError):
+        encode_dag_cbor({1: 'x'})
+
+def test_unknown_codec_is_refused():
+    with pytest.raises(ValueError):
+        DocumentCodec('yaml', '')
@@ -0,0 +1,24 @@
+from benchmarks import count_queries
+from location_search import search_rides
+from models import Ride
+
+def search(start=None, end=None):
+    return search_rides(Ride.query.filter_by(is_active=True), start, end).all()
+
+def test_prefix_and_substring_words_match(db, make_user, make_ride):
+    driver = make_user('driver')
+    lonavala = make_ride(driver, start_location='Lonavala Hills', end_location='Khandala Station')
+    make_ride(driver, start_location='Panvel Old Town', end_location='Alibag Beach')
+
+    assert search('lonav hills', 'khandala') == [lonavala]
+    # 'avala' starts no word, so it falls back to a substring match
+    assert search('avala', 'khand') == [lonavala]
+    assert search('avala', 'alibag') == []
+
+def test_search_runs_two_statements_whatever_the_word_count(db, make_user, make_ride):
+    make_ride(make_user('driver'), start_location='Lonavala Hills Top', end_location='Khandala Station Road')
+
+    for start, end in (('lonav', 'khand'), ('lonavala hills avala top', 'khandala station oad road')):
+        with count_queries(db.engine) as statements:
+            assert len(search(start, end)) == 1
+        assert len(statements) == 2
@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from jinja2 import DictLoader
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+import loaders
+from models import Ride, Booking
+
+# What templates/profile.html reads for each offered ride and booking
+PROFILE_TEMPLATE = (
+    "{% for ride in offered_rides %}{{ ride.driver.username }}"
+    "{% for booking in ride.booking_list %}{{ booking.passenger.username }}{% endfor %}"
+    "{{ ride_stats[ride.id].seats_booked }}{% endfor %}"
+    "{% for booking in bookings %}{{ booking.ride.start_location }}{{ booking.ride.driver.username }}{% endfor %}"
+)
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+@pytest.fixture
+def profile_client(app):
+    loader = app.jinja_env.loader
+    app.jinja_env.loader = DictLoader({'profile.html': PROFILE_TEMPLATE})
+    app.jinja_env.cache.clear()
+    yield app.test_client()
+    app.jinja_env.loader = loader
+    app.jinja_env.cache.clear()
+
+def profile_queries(client, db, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    client.get('/profile')  # the first visit creates the OTP secret
+    with count_queries(db.engine) as statements:
+        response = client.get('/profile')
+    assert response.status_code == 200
+    return len(statements)
+
+def seed(db, make_user, make_ride, size):
+    """A driver with size rides, each booked by a passenger who also rides with another driver"""
+    driver, other = make_user(f'driver{size}'), make_user(f'other{size}')
+    passenger = make_user(f'passenger{size}')
+    rides = [Ride(driver_id=user.id, start_location='Old Town', end_location='Airport',
+                  departure_time=datetime.utcnow(), price=0.1, available_seats=4)
+             for user in (driver, other) for _ in range(size)]
+    db.session.add_all(rides)
+    db.session.flush()
+    db.session.add_all(Booking(ride_id=ride.id, passenger_id=passenger.id, seats_booked=1) for ride in rides)
+    db.session.commit()
+    return driver.id, passenger.id
+
+def test_profile_query_count_does_not_grow_with_rides(db, make_user, make_ride, profile_client):
+    # 600 rides is past selectinload's 500-id batches
+    counts = [[profile_queries(profile_client, db, user_id) for user_id in seed(db, make_user, make_ride, size)]
+              for size in (3, 600)]
+    assert counts[0] == counts[1]
+
+def test_offered_rides_carry_bookings_and_stats(db, make_user, make_ride):
+    driver = make_user('driver')
+    booked, empty = make_ride(driver), make_ride(driver)
+    db.session.add(Booking(ride_id=booked.id, passenger_id=make_user('rider').id, seats_booked=2))
+    db.session.commit()
+    db.session.expire_all()
+
+    rides = loaders.load_offered_rides(driver.id)
+    stats = loaders.ride_booking_stats(rides)
+    assert {ride.id: [b.passenger.username for b in ride.booking_list] for ride in rides} == \
+        {booked.id: ['rider'], empty.id: []}
+    assert (stats[booked.id].booking_count, stats[booked.id].seats_booked) == (1, 2)
+    assert (stats[empty.id].booking_count, stats[empty.id].seats_booked) == (0, 0)
+
+def test_booking_list_is_never_lazy_loaded(db, make_user, make_ride):
+    ride_id = make_ride(make_user('driver')).id
+    db.session.expire_all()
+    with pytest.raises(InvalidRequestError):
+        db.session.get(Ride, ride_id).booking_list
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from models import ChainJob
+from reconciliation import Reconciler
+from tx_pipeline import RECEIPT_TIMEOUT_ERROR
+
+DRIVER = '0x' + '11' * 20
+
+def unlinked_ride(make_user, make_ride, name='driver'):
+    return make_ride(make_user(name, ethereum_address=DRIVER), created_at=datetime.utcnow() - timedelta(days=1))
+
+def failed_job(db, ride, error):
+    job = ChainJob(kind='create_ride', ride_id=ride.id, payload='{}', status='failed', error=error,
+                   tx_hash='0x' + 'ab' * 32, attempts=1)
+    db.session.add(job)
+    db.session.commit()
+
+def test_ride_whose_transaction_timed_out_is_not_requeued(db, make_user, make_ride):
+    failed_job(db, unlinked_ride(make_user, make_ride), RECEIPT_TIMEOUT_ERROR)
+    reconciler = Reconciler()
+    reconciler.reconcile_rides()
+    assert ChainJob.query.count() == 1
+    assert (reconciler.repairs['create_requeued'], reconciler.problems['stuck']) == (0, 1)
+
+def test_ride_whose_transaction_failed_is_requeued(db, make_user, make_ride):
+    failed_job(db, unlinked_ride(make_user, make_ride), 'Transaction reverted')
+    reconciler = Reconciler()
+    reconciler.reconcile_rides()
+    assert ChainJob.query.filter_by(status='queued').count() == 1
+    assert reconciler.repairs['create_requeued'] == 1
+
+def test_backlog_after_a_full_pass_counts_only_new_rows(db, make_user, make_ride):
+    for i in range(3):
+        make_ride(make_user(f'driver{i}'))
+    reconciler = Reconciler()
+    assert reconciler.backlog()['rides_to_scan'] == 3
+
+    reconciler.run_pass()
+    assert reconciler.passes == 1
+    assert reconciler.backlog()['rides_to_scan'] == 0
+
+    make_ride(make_user('late'))
+    assert reconciler.backlog()['rides_to_scan'] == 1
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from app import app
+from models import Ride, Booking
+from reservations import reserve_seats, ReservationError
+
+def test_concurrent_bookings_never_oversell(db, make_user, make_ride):
+    seats = 5
+    ride_id = make_ride(make_user('driver'), seats=seats).id
+    passenger_ids = [make_user(f'rider{i}').id for i in range(seats * 3)]
+    outcomes = []
+    barrier = threading.Barrier(4)
+
+    def worker(ids):
+        barrier.wait()
+        for passenger_id in ids:
+            with app.app_context():
+                try:
+                    reserve_seats(ride_id, passenger_id, 1)
+                    outcomes.append('booked')
+                except ReservationError:
+                    outcomes.append('rejected')
+                except Exception:
+                    # SQLite "database is locked" under contention; not a booking
+                    db.session.rollback()
+                    outcomes.append('error')
+
+    threads = [threading.Thread(target=worker, args=(passenger_ids[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    booked = db.session.query(db.func.sum(Booking.seats_booked)).filter_by(ride_id=ride_id).scalar()
+    assert booked == outcomes.count('booked') <= seats
+    assert db.session.get(Ride, ride_id).available_seats == seats - booked
+
+def test_rejects_booking_beyond_available_seats(make_user, make_ride):
+    ride = make_ride(make_user('driver'), seats=2)
+    with pytest.raises(ReservationError):
+        reserve_seats(ride.id, make_user('rider').id, 3)
+
+def test_rejects_second_booking_by_same_passenger(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'), seats=4)
+    passenger = make_user('rider')
+    reserve_seats(ride.id, passenger.id, 1)
+    with pytest.raises(ReservationError):
+        reserve_seats(ride.id, passenger.id, 1)
+    db.session.expire_all()
+    assert db.session.get(Ride, ride.id).available_seats == 3
+
+def test_rejects_inactive_ride(make_user, make_ride):
+    ride = make_ride(make_user('driver'), is_active=False)
+    with pytest.raises(ReservationError):
+        reserve_seats(ride.id, make_user('rider').id, 1)
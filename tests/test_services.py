@@ -0,0 +1,45 @@
+import pytest
+
+import tx_pipeline as tx_pipeline_module
+from blockchain_service import BlockchainService, TransactionNotSentError
+from config import get_config
+from ipfs_service import IPFSStorage
+from models import ChainJob
+from tx_pipeline import tx_pipeline
+
+DRIVER = '0x' + '11' * 20
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    """Real-node configuration pointing at a closed port"""
+    config = get_config()
+    monkeypatch.setenv('DEV_MODE', 'false')
+    monkeypatch.setattr(config, 'ETHEREUM_NODE_URL', 'http://127.0.0.1:9')
+    monkeypatch.setattr(config, 'IPFS_API_URL', 'http://127.0.0.1:9')
+    monkeypatch.setattr(config, 'IPFS_API_KEY', 'key')
+    monkeypatch.setattr(config, 'IPFS_API_SECRET', 'secret')
+    monkeypatch.setattr(config, 'SERVICE_PROBE_TIMEOUT', 0.5)
+
+def test_unreachable_node_is_unavailable_not_simulated(unreachable):
+    service = BlockchainService()
+    assert not service.available
+    assert not service.dev_mode
+    assert service.health()['last_error']
+    with pytest.raises(TransactionNotSentError):
+        service.submit_create_ride(DRIVER, 'A', 'B', 0.1, 3)
+    assert service.simulator.transaction_count(DRIVER) == 0
+
+def test_unreachable_ipfs_is_not_simulated(unreachable):
+    storage = IPFSStorage()
+    assert not storage.dev_mode
+    assert storage.health()['last_error']
+
+def test_jobs_stay_queued_while_node_is_unreachable(unreachable, monkeypatch, db, make_user, make_ride):
+    monkeypatch.setattr(tx_pipeline_module, 'blockchain_service', BlockchainService())
+    ride = make_ride(make_user('driver'))
+    job = tx_pipeline.enqueue('complete_ride', ride_id=ride.id, payload={'driver_address': DRIVER, 'ride_id': 1})
+
+    assert tx_pipeline.submit_queued() == 0
+    db.session.expire_all()
+    job = db.session.get(ChainJob, job.id)
+    assert (job.status, job.attempts) == ('queued', 0)
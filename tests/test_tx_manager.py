@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from web3 import Web3
+from web3.exceptions import ContractLogicError
+
+from benchmarks import STANDIN_CONTRACT, STANDIN_RIDE_ABI
+from tx_manager import NonceManager, GasEstimateCache
+
+DRIVER = Web3.to_checksum_address('0x' + '22' * 20)
+OTHER = Web3.to_checksum_address('0x' + '33' * 20)
+
+@pytest.fixture
+def contract(standin_node):
+    url, server = standin_node
+    w3 = Web3(Web3.HTTPProvider(url))
+    return w3.eth.contract(address=Web3.to_checksum_address(STANDIN_CONTRACT), abi=STANDIN_RIDE_ABI), server
+
+def test_cached_estimate_still_refuses_reverting_calls(contract):
+    contract, server = contract
+    cache = GasEstimateCache(ttl=60, margin=1.0)
+    assert cache.estimate(contract.functions.completeRide(1), {'from': DRIVER}) == 150000
+    assert cache.estimate(contract.functions.completeRide(2), {'from': DRIVER}) == 150000
+    assert (cache.hits, server.calls['eth_estimateGas']) == (1, 1)
+
+    server.reverting_rides.add(3)
+    with pytest.raises(ContractLogicError):
+        cache.estimate(contract.functions.completeRide(3), {'from': DRIVER})
+
+def test_estimates_are_kept_per_sender(contract):
+    contract, server = contract
+    cache = GasEstimateCache(ttl=60, margin=1.0)
+    cache.estimate(contract.functions.completeRide(1), {'from': DRIVER})
+    cache.estimate(contract.functions.completeRide(1), {'from': OTHER})
+    assert cache.misses == 2
+
+class Node:
+    """Pending transaction counts per account, as eth_getTransactionCount reports them"""
+
+    def __init__(self):
+        self.pending = {}
+        self.filled = []
+
+    def count(self, address):
+        return self.pending.get(address, 0)
+
+    def fill(self, address, nonce):
+        self.filled.append(nonce)
+
+def test_allocates_in_order_and_reuses_released_nonces():
+    nonces = NonceManager(Node().count, gap_timeout=60)
+    assert [nonces.allocate('a') for _ in range(3)] == [0, 1, 2]
+    nonces.release('a', 1)
+    assert nonces.allocate('a') == 1
+    # Releasing the newest nonce leaves no gap
+    nonces.release('a', 2)
+    assert nonces.allocate('a') == 2
+
+def test_stale_nonce_error_resyncs_from_node():
+    node = Node()
+    nonces = NonceManager(node.count, gap_timeout=60)
+    assert nonces.allocate('a') == 0
+    node.pending['a'] = 5
+    assert nonces.release('a', 0, ValueError('nonce too low')) is True
+    assert nonces.allocate('a') == 5
+
+def test_unused_released_nonces_are_filled():
+    node = Node()
+    nonces = NonceManager(node.count, fill_gap=node.fill, gap_timeout=0)
+    for _ in range(3):
+        nonces.allocate('a')
+    nonces.release('a', 1)
+    time.sleep(0.01)
+    assert nonces.fill_gaps() == 1
+    assert node.filled == [1]
+    assert nonces.allocate('a') == 3
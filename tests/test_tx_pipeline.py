@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from web3 import Web3
+
+import tx_pipeline as tx_pipeline_module
+from benchmarks import STANDIN_CONTRACT, STANDIN_RIDE_ABI
+from blockchain_service import BlockchainService, blockchain_service
+from models import Ride, Booking, ChainJob
+from tx_pipeline import tx_pipeline, DuplicateJobError
+from web3_provider import PooledHTTPProvider
+
+DRIVER = '0x' + '11' * 20
+PASSENGER = '0x' + '22' * 20
+NODE_DRIVER = Web3.to_checksum_address(DRIVER)
+
+def create_ride_job(ride):
+    return tx_pipeline.enqueue('create_ride', ride_id=ride.id, payload={
+        'driver_address': DRIVER, 'start_location': ride.start_location,
+        'end_location': ride.end_location, 'price': ride.price, 'available_seats': ride.available_seats})
+
+def reload(db, model, row_id):
+    db.session.expire_all()
+    return db.session.get(model, row_id)
+
+def test_create_ride_job_is_submitted_then_confirmed(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'))
+    job_id = create_ride_job(ride).id
+    assert reload(db, ChainJob, job_id).status == 'queued'
+
+    assert tx_pipeline.submit_queued() == 1
+    job = reload(db, ChainJob, job_id)
+    assert job.status == 'submitted' and job.tx_hash and job.sender == DRIVER and job.nonce == 0
+
+    assert tx_pipeline.confirm_submitted() == 1
+    assert reload(db, ChainJob, job_id).status == 'confirmed'
+    assert reload(db, Ride, ride.id).smart_contract_id == 1
+
+def test_book_ride_job_confirms_booking(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'))
+    create_ride_job(ride)
+    tx_pipeline.submit_queued()
+    tx_pipeline.confirm_submitted()
+    booking = Booking(ride_id=ride.id, passenger_id=make_user('rider').id, seats_booked=2)
+    db.session.add(booking)
+    db.session.commit()
+
+    job_id = tx_pipeline.enqueue('book_ride', ride_id=ride.id, booking_id=booking.id, payload={
+        'passenger_address': PASSENGER, 'ride_id': 1, 'price': ride.price, 'seats': 2}).id
+    tx_pipeline.submit_queued()
+    tx_pipeline.confirm_submitted()
+    assert reload(db, ChainJob, job_id).status == 'confirmed'
+    assert reload(db, Booking, booking.id).status == 'confirmed'
+
+def test_reverted_transaction_fails_the_job(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'))
+    # No ride 7 on the chain
+    job_id = tx_pipeline.enqueue('complete_ride', ride_id=ride.id,
+                                 payload={'driver_address': DRIVER, 'ride_id': 7}).id
+    tx_pipeline.submit_queued()
+    tx_pipeline.confirm_submitted()
+    job = reload(db, ChainJob, job_id)
+    assert (job.status, job.error) == ('failed', 'Transaction reverted')
+
+def test_second_in_flight_job_for_a_ride_is_refused(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'))
+    create_ride_job(ride)
+    with pytest.raises(DuplicateJobError):
+        create_ride_job(ride)
+    assert ChainJob.query.count() == 1
+
+def stuck_submitting(db, job_id, **values):
+    """Make a job look like its worker died mid-submission"""
+    db.session.execute(db.update(ChainJob).where(ChainJob.id == job_id).values(
+        status='submitting', updated_at=datetime.utcnow() - timedelta(hours=1), **values))
+    db.session.commit()
+
+def test_stale_submission_that_was_never_signed_is_requeued(db, make_user, make_ride):
+    job_id = create_ride_job(make_ride(make_user('driver'))).id
+    stuck_submitting(db, job_id)
+    assert tx_pipeline.requeue_stale() == 1
+    assert reload(db, ChainJob, job_id).status == 'queued'
+
+def test_stale_submission_with_sent_transaction_is_recovered(db, make_user, make_ride):
+    ride = make_ride(make_user('driver'))
+    job_id = create_ride_job(ride).id
+    sent = []
+    tx_hash = blockchain_service.submit_create_ride(DRIVER, 'Old Town', 'Airport', 0.1, 4,
+                                                    on_nonce=lambda *args: sent.append(args))
+    sender, nonce, recorded = sent[0]
+    stuck_submitting(db, job_id, sender=sender, nonce=nonce, tx_hash=recorded)
+
+    assert tx_pipeline.requeue_stale() == 1
+    job = reload(db, ChainJob, job_id)
+    assert (job.status, job.tx_hash) == ('submitted', tx_hash)
+    # Confirmed from the original transaction, not sent again
+    tx_pipeline.confirm_submitted()
+    assert blockchain_service.simulator.stats()['transactions'] == 1
+    assert reload(db, Ride, ride.id).smart_contract_id == 1
+
+def test_stale_submission_unknown_to_the_node_is_requeued(db, make_user, make_ride):
+    job_id = create_ride_job(make_ride(make_user('driver'))).id
+    # Signed for nonce 0, which another transaction then used
+    blockchain_service.submit_create_ride(DRIVER, 'Old Town', 'Airport', 0.1, 4)
+    stuck_submitting(db, job_id, sender=DRIVER, nonce=0, tx_hash='0x' + 'ab' * 32)
+
+    assert tx_pipeline.requeue_stale() == 1
+    job = reload(db, ChainJob, job_id)
+    assert (job.status, job.nonce, job.tx_hash) == ('queued', None, None)
+
+@pytest.fixture
+def node_pipeline(standin_node, monkeypatch):
+    """The pipeline sending to the stand-in node instead of the dev mode simulator"""
+    url, server = standin_node
+    service = BlockchainService()
+    service.dev_mode = False
+    service.w3 = Web3(PooledHTTPProvider(url))
+    service.contract = service.w3.eth.contract(address=Web3.to_checksum_address(STANDIN_CONTRACT),
+                                               abi=STANDIN_RIDE_ABI)
+    monkeypatch.setattr(tx_pipeline_module, 'blockchain_service', service)
+    return server
+
+def complete_ride_job(ride, ride_id):
+    return tx_pipeline.enqueue('complete_ride', ride_id=ride.id,
+                               payload={'driver_address': NODE_DRIVER, 'ride_id': ride_id})
+
+def test_lost_send_reply_is_recovered_without_resending(db, make_user, make_ride, node_pipeline):
+    server = node_pipeline
+    job_id = complete_ride_job(make_ride(make_user('driver')), 1).id
+    server.lost_replies = 1
+
+    assert tx_pipeline.submit_queued() == 0
+    job = reload(db, ChainJob, job_id)
+    assert job.status == 'submitting' and job.tx_hash in server.transactions
+
+    stuck_submitting(db, job_id)
+    assert tx_pipeline.requeue_stale() == 1
+    tx_pipeline.submit_queued()
+    job = reload(db, ChainJob, job_id)
+    assert (job.status, job.attempts) == ('submitted', 1)
+    assert len(server.transactions) == 1
+
+def test_send_refused_by_the_node_is_requeued(db, make_user, make_ride, node_pipeline):
+    server = node_pipeline
+    server.reverting_rides.add(5)
+    job_id = complete_ride_job(make_ride(make_user('driver')), 5).id
+
+    assert tx_pipeline.submit_queued() == 0
+    job = reload(db, ChainJob, job_id)
+    assert (job.status, job.attempts, job.tx_hash) == ('queued', 1, None)
+    assert not server.transactions
@@ -0,0 +1,36 @@
+import user_cache as user_cache_module
+from user_cache import UserCache
+
+def test_load_that_raced_an_invalidation_is_not_stored(db, make_user, monkeypatch):
+    user = make_user('rider')
+    cache = UserCache()
+    cache.ttl = 60
+    get = user_cache_module.db.session.get
+
+    def get_after_concurrent_update(model, user_id):
+        # Another request commits a change to the user between our cache miss and our read
+        cache.invalidate(user_id)
+        return get(model, user_id)
+
+    monkeypatch.setattr(user_cache_module.db.session, 'get', get_after_concurrent_update)
+    assert cache.load(user.id).id == user.id
+    monkeypatch.undo()
+    assert user.id not in cache._local
+
+    cache.load(user.id)
+    cache.load(user.id)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_committed_update_drops_cached_user(db, make_user, monkeypatch):
+    user = make_user('rider', reputation=1)
+    cache = UserCache()
+    cache.ttl = 60
+    monkeypatch.setattr(user_cache_module, 'user_cache', cache)
+    cache.load(user.id)
+    assert user.id in cache._local
+
+    user.reputation = 5
+    db.session.commit()
+    assert user.id not in cache._local
+    db.session.remove()
+    assert cache.load(user.id).reputation == 5
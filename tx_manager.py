@@ -0,0 +1,275 @@
+import time
+import heapq
+import logging
+import threading
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Node errors meaning our local nonce is behind the account's real one
+STALE_NONCE_ERRORS = ('nonce too low', 'already known', 'replacement transaction underpriced',
+                      'known transaction', 'invalid nonce')
+
+def is_stale_nonce_error(error):
+    message = str(error).lower()
+    return any(text in message for text in STALE_NONCE_ERRORS)
+
+class NonceManager:
+    """
+    Thread-safe local nonce allocation per sending account
+
+    The first allocation for an account reads eth_getTransactionCount(address,
+    'pending'), e.g. after a restart; after that nonces are handed out from
+    memory, so concurrent submissions never wait on the node or receive the
+    same nonce. Nonces of transactions the node did not accept are reused
+    first. When the node reports a nonce as used, e.g. because another
+    process sent from the account, allocation jumps ahead to its pending
+    count.
+
+    A released nonce that no transaction reuses within NONCE_GAP_TIMEOUT
+    seconds would hold back every later transaction from the account.
+    fill_gaps() resyncs such accounts from the node, which drops nonces it
+    already has. It then uses up the rest with fill_gap(address, nonce),
+    e.g. a zero-value transfer to self.
+    """
+
+    def __init__(self, pending_count, fill_gap=None, gap_timeout=None):
+        self.pending_count = pending_count
+        self.fill_gap = fill_gap
+        self.gap_timeout = gap_timeout if gap_timeout is not None else get_config().NONCE_GAP_TIMEOUT
+        self._next = {}
+        self._released = {}
+        self._released_at = {}  # (address, nonce) -> monotonic time it was released
+        self._behind = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.resyncs = 0
+        self.gaps_filled = 0
+
+    def _account_lock(self, address):
+        with self._lock:
+            return self._locks.setdefault(address, threading.Lock())
+
+    def _sync(self, address):
+        pending = self.pending_count(address)
+        # Nonces still in flight locally stay allocated
+        self._next[address] = max(pending, self._next.get(address, 0))
+        released = self._released.get(address, [])
+        for nonce in released:
+            if nonce < pending:
+                self._released_at.pop((address, nonce), None)
+        self._released[address] = [nonce for nonce in released if nonce >= pending]
+        heapq.heapify(self._released[address])
+        self._behind.discard(address)
+        self.resyncs += 1
+
+    def _forget(self, address, nonce):
+        self._released[address].remove(nonce)
+        heapq.heapify(self._released[address])
+        self._released_at.pop((address, nonce), None)
+
+    def allocate(self, address):
+        """Reserve the next nonce for address"""
+        with self._account_lock(address):
+            if address not in self._next or address in self._behind:
+                self._sync(address)
+            self.allocated += 1
+            if self._released[address]:
+                nonce = heapq.heappop(self._released[address])
+                self._released_at.pop((address, nonce), None)
+                return nonce
+            nonce = self._next[address]
+            self._next[address] = nonce + 1
+            return nonce
+
+    def release(self, address, nonce, error=None):
+        """
+        Give back a nonce whose transaction was not accepted
+
+        Returns:
+            True if the node said the nonce was already used (the account
+            jumps ahead on its next allocation), False otherwise
+        """
+        with self._account_lock(address):
+            if error is not None and is_stale_nonce_error(error):
+                self._behind.add(address)
+                return True
+            released = self._released.setdefault(address, [])
+            if nonce == self._next.get(address, 0) - 1:
+                # Nothing was allocated after it, so no gap: shrink the range instead
+                self._next[address] = nonce
+                while self._next[address] - 1 in released:
+                    self._next[address] -= 1
+                    self._forget(address, self._next[address])
+            else:
+                heapq.heappush(released, nonce)
+                self._released_at[(address, nonce)] = time.monotonic()
+            return False
+
+    def fill_gaps(self):
+        """
+        Resolve released nonces that were not reused within gap_timeout
+
+        Returns:
+            Number of nonces used up with fill_gap
+        """
+        now = time.monotonic()
+        stale = {address for (address, nonce), released_at in list(self._released_at.items())
+                 if now - released_at >= self.gap_timeout}
+        filled = 0
+        for address in stale:
+            with self._account_lock(address):
+                self._sync(address)
+                for nonce in sorted(self._released.get(address, [])):
+                    if self.fill_gap is None:
+                        break
+                    try:
+                        self.fill_gap(address, nonce)
+                    except Exception as e:
+                        if not is_stale_nonce_error(e):
+                            logger.warning(f"Could not fill nonce {nonce} of {address}: {str(e)}")
+                            continue
+                    self._forget(address, nonce)
+                    filled += 1
+        self.gaps_filled += filled
+        return filled
+
+    def reset(self, address=None):
+        """Forget local state so the next allocation starts from the node's pending count"""
+        with self._lock:
+            for key in ([address] if address else list(self._next)):
+                self._next.pop(key, None)
+                self._released.pop(key, None)
+                self._behind.discard(key)
+            for key in list(self._released_at):
+                if address is None or key[0] == address:
+                    del self._released_at[key]
+
+    def stats(self):
+        return {
+            'accounts': len(self._next),
+            'allocated': self.allocated,
+            'resyncs': self.resyncs,
+            'gaps_filled': self.gaps_filled,
+        }
+
+class GasEstimateCache:
+    """
+    Reuse eth_estimateGas results for calls of the same shape
+
+    Calls are keyed by sender, function selector, whether they send value,
+    and the shape of their arguments: the number of 32-byte words for
+    strings and bytes, and zero/non-zero for integers, which is what changes
+    the gas a call needs. Cached estimates are padded by GAS_ESTIMATE_MARGIN
+    and re-estimated after GAS_ESTIMATE_TTL seconds.
+
+    eth_estimateGas also rejects calls that would revert (completeRide from
+    someone other than the driver, bookRide on a full ride). On a cache
+    hit the call is still run once with eth_call, which is cheaper than an
+    estimate, so those are refused before they are sent and burn gas.
+    """
+
+    def __init__(self, ttl=None, margin=None):
+        config = get_config()
+        self.ttl = ttl if ttl is not None else config.GAS_ESTIMATE_TTL
+        self.margin = margin if margin is not None else config.GAS_ESTIMATE_MARGIN
+        self._estimates = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.preflights = 0
+
+    @staticmethod
+    def _shape(value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int):
+            return value != 0
+        if isinstance(value, str):
+            value = value.encode()
+        if isinstance(value, (bytes, bytearray)):
+            return ('words', (len(value) + 31) // 32)
+        if isinstance(value, (list, tuple)):
+            return tuple(GasEstimateCache._shape(item) for item in value)
+        return type(value).__name__
+
+    def key(self, call, params):
+        return (call.address, call.selector, params.get('from'), bool(params.get('value')),
+                tuple(self._shape(arg) for arg in call.args))
+
+    @staticmethod
+    def _preflight(call, params):
+        # Raises ContractLogicError, decoded by web3, if the call would revert
+        call.call({key: params[key] for key in ('from', 'value') if params.get(key)}, block_identifier='latest')
+
+    def estimate(self, call, params):
+        """
+        Gas limit for a contract call, from the cache or eth_estimateGas
+
+        Raises:
+            ContractLogicError: If the call would revert
+        """
+        key = self.key(call, params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._estimates.get(key)
+            cached = entry is not None and now - entry[1] < self.ttl
+            if cached:
+                self.hits += 1
+                self.preflights += 1
+            else:
+                self.misses += 1
+        if cached:
+            self._preflight(call, params)
+            return entry[0]
+
+        gas = int(call.estimate_gas(params) * self.margin)
+        with self._lock:
+            self._estimates[key] = (gas, now)
+        return gas
+
+    def invalidate(self):
+        with self._lock:
+            self._estimates.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._estimates),
+            'hits': self.hits,
+            'misses': self.misses,
+            'preflights': self.preflights,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+class GasFeeCache:
+    """
+    EIP-1559 fee fields for outgoing transactions, refreshed every GAS_FEE_TTL seconds
+
+    eth_signTransaction needs the fees filled in. As in web3's default,
+    maxFeePerGas is the priority fee plus twice the latest base fee, which
+    covers several blocks of base fee increases, so one lookup serves every
+    transaction sent within a block or two.
+    """
+
+    def __init__(self, fetch, ttl=None):
+        self.fetch = fetch
+        self.ttl = ttl if ttl is not None else get_config().GAS_FEE_TTL
+        self._fees = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fees(self):
+        """{'maxFeePerGas': ..., 'maxPriorityFeePerGas': ...} for a transaction sent now"""
+        with self._lock:
+            now = time.monotonic()
+            if self._fees is not None and now - self._fetched_at < self.ttl:
+                self.hits += 1
+            else:
+                self._fees = self.fetch()
+                self._fetched_at = now
+                self.misses += 1
+            return dict(self._fees)
@@ -0,0 +1,431 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func
+from sqlalchemy.exc import IntegrityError
+from app import app, db, create_app
+from models import Ride, Booking, ChainJob, CHAIN_JOB_IN_FLIGHT
+from blockchain_service import blockchain_service, TransactionNotSentError
+from feed_cache import feed_cache
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Error recorded on jobs whose transaction may still be mined later
+RECEIPT_TIMEOUT_ERROR = 'Timed out waiting for receipt'
+
+# Job statuses that can still produce a transaction
+IN_FLIGHT = CHAIN_JOB_IN_FLIGHT
+
+# Unique index allowing one in-flight job per kind and ride or booking
+IN_FLIGHT_INDEX = 'uq_chain_job_in_flight'
+
+# Contract call made for each job kind
+SUBMITTERS = {
+    'create_ride': lambda payload, on_nonce: blockchain_service.submit_create_ride(on_nonce=on_nonce, **payload),
+    'book_ride': lambda payload, on_nonce: blockchain_service.submit_book_ride(on_nonce=on_nonce, **payload),
+    'complete_ride': lambda payload, on_nonce: blockchain_service.submit_complete_ride(on_nonce=on_nonce, **payload),
+}
+
+class JobReclaimedError(Exception):
+    """A job stopped being 'submitting' for this worker, e.g. recovered as stale, before its send"""
+
+class DuplicateJobError(Exception):
+    """A job of the same kind for the ride or booking is already in flight"""
+
+def _is_duplicate_job(error):
+    """Whether an IntegrityError is a violation of IN_FLIGHT_INDEX"""
+    diag = getattr(error.orig, 'diag', None)
+    if getattr(diag, 'constraint_name', None):
+        return diag.constraint_name == IN_FLIGHT_INDEX
+    return IN_FLIGHT_INDEX in str(error.orig)
+
+def job_to_dict(job):
+    """JSON representation of a ChainJob for the status API"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'ride_id': job.ride_id,
+        'booking_id': job.booking_id,
+        'tx_hash': job.tx_hash,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'submitted_at': job.submitted_at.isoformat() if job.submitted_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None
+    }
+
+class TransactionPipeline:
+    """
+    Background submission and confirmation of blockchain transactions
+
+    Requests only insert a ChainJob row. A worker thread then moves each job
+    through queued -> submitting -> submitted -> confirmed/failed: it sends
+    the transaction, polls for its receipt, and applies the result to the
+    Ride/Booking rows. Jobs are claimed with conditional UPDATEs, so several
+    gunicorn workers can run pipelines against the same table.
+
+    The sender, nonce and hash of each transaction are stored on the job
+    before it is broadcast. A send that fails before reaching the node
+    re-queues the job. Any other failure, or a dead worker, leaves it in
+    'submitting'; after TX_PIPELINE_SUBMIT_TIMEOUT seconds it is looked up
+    by hash and re-queued only if the transaction can never be mined, so it
+    is never sent twice.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.enabled = config.TX_PIPELINE_ENABLED
+        self.poll_interval = config.TX_PIPELINE_POLL_INTERVAL
+        self.max_attempts = config.TX_PIPELINE_MAX_ATTEMPTS
+        self.receipt_timeout = timedelta(seconds=config.TX_PIPELINE_RECEIPT_TIMEOUT)
+        self.submit_timeout = timedelta(seconds=config.TX_PIPELINE_SUBMIT_TIMEOUT)
+        self.batch_size = 50
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.recovered = 0
+
+    def enqueue(self, kind, ride_id, payload, booking_id=None):
+        """
+        Queue a contract call for background submission
+
+        Args:
+            kind: One of create_ride, book_ride, complete_ride
+            ride_id: Local Ride ID the transaction belongs to
+            payload: Keyword arguments for the matching submit_* call
+            booking_id: Local Booking ID for book_ride jobs
+
+        Returns:
+            The committed ChainJob
+
+        Raises:
+            DuplicateJobError: If a job of this kind for the ride or booking is in flight
+        """
+        if kind not in SUBMITTERS:
+            raise ValueError(f"Unknown transaction kind: {kind}")
+
+        job = ChainJob(kind=kind, ride_id=ride_id, booking_id=booking_id,
+                       payload=json.dumps(payload), status='queued')
+        try:
+            # In a savepoint, so a duplicate leaves the caller's other changes in place
+            with db.session.begin_nested():
+                db.session.add(job)
+        except IntegrityError as e:
+            if _is_duplicate_job(e):
+                raise DuplicateJobError(f"A {kind} job for ride {ride_id} is already in flight")
+            raise
+        db.session.commit()
+        self._wake.set()
+        return job
+
+    def reopen(self, job_id):
+        """Send a failed job back for confirmation, e.g. once its transaction turned out to be mined"""
+        try:
+            with db.session.begin_nested():
+                reopened = db.session.execute(
+                    update(ChainJob)
+                    .where(ChainJob.id == job_id, ChainJob.status == 'failed')
+                    .values(status='submitted', submitted_at=datetime.utcnow(), error=None,
+                            updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                ).rowcount == 1
+        except IntegrityError as e:
+            if not _is_duplicate_job(e):
+                raise
+            # A newer job for the same ride or booking is in flight; let it finish instead
+            reopened = False
+        db.session.commit()
+        if reopened:
+            self._wake.set()
+        return reopened
+
+    def _claim(self, job_id, from_status, to_status, **values):
+        """Move a job between states; False if another worker got there first"""
+        result = db.session.execute(
+            update(ChainJob)
+            .where(ChainJob.id == job_id, ChainJob.status == from_status)
+            .values(status=to_status, updated_at=datetime.utcnow(), **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _nonce_recorder(self, job_id):
+        """on_nonce callback storing a job's sender, nonce and hash before its transaction is sent"""
+        def record(sender, nonce, tx_hash):
+            result = db.session.execute(
+                update(ChainJob)
+                .where(ChainJob.id == job_id, ChainJob.status == 'submitting')
+                .values(sender=sender, nonce=nonce, tx_hash=tx_hash, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount != 1:
+                raise JobReclaimedError(f"Job {job_id} is no longer submitting")
+        return record
+
+    def _record_submitted(self, job_id, tx_hash):
+        """Store a sent transaction's hash, retrying once; the stale sweep covers a second failure"""
+        for attempt in range(2):
+            try:
+                return self._claim(job_id, 'submitting', 'submitted', tx_hash=tx_hash,
+                                   submitted_at=datetime.utcnow(), error=None)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not record transaction {tx_hash} of job {job_id}: {str(e)}")
+        return False
+
+    def _stale_action(self, job):
+        """'submitted', 'queue', 'release' (queue and give back its unused nonce) or None (wait)"""
+        if job.tx_hash is None:
+            # Never signed, so never sent
+            return 'queue'
+        if blockchain_service.has_transaction(job.tx_hash):
+            return 'submitted'
+        if blockchain_service.transaction_count(job.sender) <= job.nonce:
+            return 'release'
+        if blockchain_service.transaction_count(job.sender, 'latest') > job.nonce:
+            # Another transaction with the nonce was mined, so this one never can be
+            return 'queue'
+        # Another transaction holds the nonce but is not mined yet
+        return None
+
+    def requeue_stale(self):
+        """
+        Recover jobs stuck in 'submitting'; returns how many were recovered
+
+        A job whose transaction the node knows is confirmed as usual. One
+        that was never signed, or that the node doesn't know while its nonce
+        is unused or already mined by another transaction, can never be
+        mined and goes back to the queue. Otherwise another transaction with
+        the nonce is pending and the job is checked again on the next pass.
+        """
+        cutoff = datetime.utcnow() - self.submit_timeout
+        jobs = (ChainJob.query
+                .filter(ChainJob.status == 'submitting', ChainJob.updated_at < cutoff)
+                .order_by(ChainJob.id)
+                .limit(self.batch_size)
+                .all())
+
+        recovered = 0
+        for job in jobs:
+            try:
+                action = self._stale_action(job)
+            except Exception as e:
+                logger.warning(f"Error checking stale job {job.id}: {str(e)}")
+                continue
+            if action is None:
+                continue
+            if action == 'submitted':
+                claimed = self._claim(job.id, 'submitting', 'submitted',
+                                      submitted_at=datetime.utcnow(), error=None)
+            else:
+                claimed = self._claim(job.id, 'submitting', 'queued', sender=None, nonce=None, tx_hash=None,
+                                      error='Submission interrupted before sending, retrying')
+                if claimed and action == 'release':
+                    blockchain_service.release_nonce(job.sender, job.nonce)
+            if claimed:
+                logger.warning(f"Recovered job {job.id} stuck in submitting (nonce {job.nonce})")
+                recovered += 1
+
+        self.recovered += recovered
+        return recovered
+
+    def submit_queued(self):
+        """Send transactions for queued jobs; returns how many were submitted"""
+        if not blockchain_service.available:
+            # Node unreachable; the jobs wait in the queue for the reconnect
+            return 0
+
+        job_ids = db.session.execute(
+            select(ChainJob.id)
+            .where(ChainJob.status == 'queued')
+            .order_by(ChainJob.id)
+            .limit(self.batch_size)
+        ).scalars().all()
+
+        submitted = 0
+        for job_id in job_ids:
+            if not self._claim(job_id, 'queued', 'submitting', attempts=ChainJob.attempts + 1,
+                               sender=None, nonce=None, tx_hash=None):
+                continue
+
+            job = db.session.get(ChainJob, job_id)
+            try:
+                tx_hash = SUBMITTERS[job.kind](json.loads(job.payload), self._nonce_recorder(job_id))
+            except JobReclaimedError as e:
+                db.session.rollback()
+                logger.warning(str(e))
+                continue
+            except TransactionNotSentError as e:
+                db.session.rollback()
+                logger.warning(f"Job {job_id} was not sent: {str(e)}")
+                tx_hash = None
+            except Exception as e:
+                # May have been sent; left in 'submitting' for requeue_stale to look up its hash
+                db.session.rollback()
+                logger.error(f"Error submitting job {job_id}: {str(e)}")
+                continue
+
+            if tx_hash:
+                if self._record_submitted(job_id, tx_hash):
+                    submitted += 1
+            elif job.attempts >= self.max_attempts:
+                self._claim(job_id, 'submitting', 'failed', sender=None, nonce=None, tx_hash=None,
+                            error='Transaction submission failed')
+                self.failed += 1
+            else:
+                # Back in the queue for the next pass
+                self._claim(job_id, 'submitting', 'queued', sender=None, nonce=None, tx_hash=None,
+                            error='Transaction submission failed, retrying')
+
+        self.submitted += submitted
+        return submitted
+
+    def confirm_submitted(self):
+        """Check receipts of submitted jobs; returns how many were settled"""
+        jobs = (ChainJob.query
+                .filter_by(status='submitted')
+                .order_by(ChainJob.id)
+                .limit(self.batch_size)
+                .all())
+
+        settled = 0
+        now = datetime.utcnow()
+        for job in jobs:
+            try:
+                receipt = blockchain_service.get_receipt(job.tx_hash)
+            except Exception as e:
+                logger.warning(f"Error fetching receipt for job {job.id}: {str(e)}")
+                continue
+
+            if receipt is None:
+                if job.submitted_at and now - job.submitted_at > self.receipt_timeout:
+                    self._claim(job.id, 'submitted', 'failed', error=RECEIPT_TIMEOUT_ERROR)
+                    self.failed += 1
+                    settled += 1
+                continue
+
+            if receipt['status'] != 1:
+                self._claim(job.id, 'submitted', 'failed', error='Transaction reverted')
+                self.failed += 1
+                settled += 1
+                continue
+
+            if self._apply(job, receipt):
+                self.confirmed += 1
+                settled += 1
+
+        if settled:
+            feed_cache.invalidate()
+        return settled
+
+    def _apply(self, job, receipt):
+        """Record a mined transaction's effects together with the job's confirmation"""
+        result = {'block_number': receipt.get('blockNumber')}
+        if job.kind == 'create_ride':
+            result['smart_contract_id'] = blockchain_service.get_created_ride_id(receipt)
+
+        claimed = db.session.execute(
+            update(ChainJob)
+            .where(ChainJob.id == job.id, ChainJob.status == 'submitted')
+            .values(status='confirmed', result=json.dumps(result), updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed != 1:
+            db.session.rollback()
+            return False
+
+        ride = db.session.get(Ride, job.ride_id)
+        if job.kind == 'create_ride':
+            ride.smart_contract_id = result['smart_contract_id']
+        elif job.kind == 'book_ride':
+            booking = db.session.get(Booking, job.booking_id)
+            booking.transaction_hash = job.tx_hash
+            booking.status = 'confirmed'
+        elif job.kind == 'complete_ride':
+            ride.is_active = False
+            db.session.execute(
+                update(Booking)
+                .where(Booking.ride_id == ride.id)
+                .values(status='completed')
+                .execution_options(synchronize_session=False)
+            )
+
+        db.session.commit()
+        if ride.smart_contract_id is not None:
+            blockchain_service.invalidate_ride(ride.smart_contract_id)
+        logger.info(f"Job {job.id} ({job.kind}) confirmed in transaction {job.tx_hash}")
+        return True
+
+    def run_once(self):
+        """Process one round of submissions and confirmations"""
+        with app.app_context():
+            try:
+                return self.requeue_stale() + self.submit_queued() + self.confirm_submitted()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Transaction pipeline error: {str(e)}")
+                return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start the worker thread (idempotent)"""
+        with self._lock:
+            if not self.enabled or (self._thread and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='tx-pipeline', daemon=True)
+            self._thread.start()
+            logger.info("Transaction pipeline worker started")
+
+    def stop(self, timeout=5):
+        """Stop the worker thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Job counts by status plus this worker's throughput counters"""
+        counts = dict(db.session.execute(
+            select(ChainJob.status, func.count(ChainJob.id)).group_by(ChainJob.status)
+        ).all())
+        return {
+            'jobs': counts,
+            'submitted': self.submitted,
+            'confirmed': self.confirmed,
+            'failed': self.failed,
+            'recovered': self.recovered,
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
+
+# Create a singleton instance
+tx_pipeline = TransactionPipeline()
+
+if __name__ == "__main__":
+    # Run the pipeline in the foreground, e.g. as a dedicated worker process
+    logging.basicConfig(level=logging.INFO)
+    create_app(start_background=False)
+    logger.info("Running transaction pipeline in the foreground")
+    try:
+        while True:
+            if not tx_pipeline.run_once():
+                time.sleep(tx_pipeline.poll_interval)
+    except KeyboardInterrupt:
+        pass
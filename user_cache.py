@@ -0,0 +1,202 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from models import User
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Never copied into the cache; loaded from the database when a request reads them
+PRIVATE_COLUMNS = ('password_hash', 'otp_secret')
+
+def _snapshot(user):
+    """Copy the user's public columns into plain, JSON-safe values"""
+    values = {}
+    for attr in inspect(User).column_attrs:
+        if attr.key in PRIVATE_COLUMNS:
+            continue
+        value = getattr(user, attr.key)
+        values[attr.key] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+def _restore(snapshot):
+    """A detached User built from a snapshot, without touching the database"""
+    user = inspect(User).class_manager.new_instance()
+    for key, value in snapshot.items():
+        if key == 'created_at' and value is not None:
+            value = datetime.fromisoformat(value)
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return user
+
+class UserCache:
+    """
+    Cache of User rows for the login manager's user loader
+
+    Snapshots live in a per-process LRU bounded to USER_CACHE_SIZE entries,
+    or in Redis when USER_CACHE_URL is set so every worker shares (and
+    invalidates) the same copy. Entries expire after USER_CACHE_TTL seconds
+    and are dropped when a transaction that updated or deleted the user
+    commits. Core UPDATEs of the user table bypass the ORM; call
+    invalidate() after committing them.
+
+    As in FeedCache, invalidate() bumps a generation counter, and a user
+    loaded under an older generation is not stored, so a load that raced an
+    invalidation cannot put the stale row back for the whole TTL. In Redis
+    each user has its own generation, read with the entry in one MGET, and
+    entries written under an older generation are ignored.
+    """
+
+    KEY = 'carpool:user'
+
+    def __init__(self):
+        config = get_config()
+        self.ttl = config.USER_CACHE_TTL
+        self.max_entries = config.USER_CACHE_SIZE
+        self.redis = None
+        self._lock = threading.Lock()
+        self._local = OrderedDict()  # user_id -> (expires_at, snapshot), least recently used first
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if config.USER_CACHE_URL:
+            try:
+                import redis
+                self.redis = redis.Redis.from_url(config.USER_CACHE_URL)
+                logger.info("User cache using shared Redis backend")
+            except ImportError:
+                logger.warning("redis package not installed, user cache is per-process")
+
+    def _get_cached(self, user_id):
+        """(generation, snapshot or None); generation is None if the backend is unreachable"""
+        if self.redis is not None:
+            try:
+                generation, raw = self.redis.mget(f'{self.KEY}:generation:{user_id}', f'{self.KEY}:{user_id}')
+            except Exception as e:
+                logger.warning(f"User cache read failed: {str(e)}")
+                return None, None
+            generation = int(generation or 0)
+            entry = json.loads(raw) if raw is not None else None
+            if entry is None or entry['generation'] != generation:
+                return generation, None
+            return generation, entry['user']
+
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry is None:
+                return self._generation, None
+            if entry[0] <= time.monotonic():
+                del self._local[user_id]
+                return self._generation, None
+            self._local.move_to_end(user_id)
+            return self._generation, entry[1]
+
+    def _set_cached(self, user_id, snapshot, generation):
+        if self.redis is not None:
+            # Written after an invalidation, the entry carries the old generation and is never read
+            try:
+                entry = {'generation': generation, 'user': snapshot}
+                self.redis.set(f'{self.KEY}:{user_id}', json.dumps(entry), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"User cache write failed: {str(e)}")
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._local[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def load(self, user_id):
+        """
+        Get a user for the current request
+
+        Args:
+            user_id: User ID
+
+        Returns:
+            The User, attached to the request's session so changes to it
+            commit as usual, or None if there is no such user
+        """
+        if self.ttl <= 0:
+            return db.session.get(User, user_id)
+
+        generation, snapshot = self._get_cached(user_id)
+        if snapshot is None:
+            self.misses += 1
+            user = db.session.get(User, user_id)
+            if user is not None and generation is not None:
+                self._set_cached(user_id, _snapshot(user), generation)
+            return user
+
+        self.hits += 1
+        user = db.session.merge(_restore(snapshot), load=False)
+        # Secrets were not cached; reading them loads them from the database
+        unloaded = inspect(user).unloaded
+        db.session.expire(user, [key for key in PRIVATE_COLUMNS if key in unloaded])
+        return user
+
+    def invalidate(self, *user_ids):
+        """Drop cached users; call after committing a Core UPDATE of the user table"""
+        if not user_ids:
+            return
+        self.invalidations += len(user_ids)
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._local.pop(user_id, None)
+
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                for user_id in user_ids:
+                    pipe.incr(f'{self.KEY}:generation:{user_id}')
+                pipe.delete(*[f'{self.KEY}:{user_id}' for user_id in user_ids])
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"User cache invalidation failed: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'redis' if self.redis is not None else 'local',
+            'entries': len(self._local),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+# Create a singleton instance
+user_cache = UserCache()
+
+# Users changed through the ORM (profile updates, OTP changes, reputation) are
+# collected per session and invalidated once the change is committed
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(user.id)
+
+@event.listens_for(Session, 'after_commit')
+def _session_committed(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        user_cache.invalidate(*changed)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _session_rolled_back(session, previous_transaction):
+    session.info.pop('changed_users', None)
@@ -0,0 +1,226 @@
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# JSON-RPC methods that are safe to send twice
+READ_METHODS = frozenset({
+    'eth_blockNumber', 'eth_call', 'eth_chainId', 'eth_estimateGas', 'eth_feeHistory',
+    'eth_gasPrice', 'eth_getBalance', 'eth_getBlockByHash', 'eth_getBlockByNumber',
+    'eth_getCode', 'eth_getLogs', 'eth_getTransactionByHash', 'eth_getTransactionCount',
+    'eth_getTransactionReceipt', 'eth_maxPriorityFeePerGas', 'eth_signTransaction', 'eth_syncing',
+    'net_version', 'web3_clientVersion',
+})
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Failures worth retrying: the node was unreachable, slow, or overloaded
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout)
+RETRYABLE_STATUS = frozenset({429, 502, 503, 504})
+
+class CircuitOpenError(ConnectionError):
+    """Raised without contacting the node while the circuit breaker is open"""
+
+def parse_timeouts(value):
+    """Parse "eth_getLogs=30,eth_call=5" into {method: seconds}"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        method, _, seconds = item.partition('=')
+        timeouts[method.strip()] = float(seconds)
+    return timeouts
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After `threshold` failed requests in a row the circuit opens and calls
+    fail immediately for `cooldown` seconds. The first call after that is a
+    trial: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.trips += 1
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+class LatencyHistogram:
+    """Request count, errors and latency buckets for one RPC method"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, elapsed_ms, error=False):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = [f'le_{bound}' for bound in LATENCY_BUCKETS] + ['le_inf']
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """
+    HTTPProvider with a shared keep-alive connection pool and latency budgets
+
+    Every request (single or batch) gets the timeout configured for its
+    method. Idempotent reads are retried with jittered exponential backoff;
+    transactions are sent once. Repeated failures open a circuit breaker so
+    callers fail fast instead of tying up workers on a dead node.
+    """
+
+    def __init__(self, endpoint_uri, pool_size=None, timeout=None, timeouts=None,
+                 connect_timeout=None, retries=None, backoff=None,
+                 breaker_threshold=None, breaker_cooldown=None):
+        config = get_config()
+        pool_size = pool_size or config.WEB3_POOL_SIZE
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # Retries are handled here, per method, instead of by web3. The chain ID
+        # never changes, and web3's validation asks for it on every call and
+        # transaction. With no validation threshold web3 caches it as is; the
+        # default threshold lookup toggles cache_allowed_requests and races
+        # between threads, which can leave caching off
+        super().__init__(endpoint_uri, session=session, exception_retry_configuration=None,
+                         cache_allowed_requests=True, cacheable_requests={'eth_chainId'},
+                         request_cache_validation_threshold=None)
+
+        self.pool_size = pool_size
+        self.timeout = timeout if timeout is not None else config.WEB3_TIMEOUT
+        self.timeouts = timeouts if timeouts is not None else parse_timeouts(config.WEB3_METHOD_TIMEOUTS)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else config.WEB3_CONNECT_TIMEOUT
+        self.retries = retries if retries is not None else config.WEB3_RETRIES
+        self.backoff = backoff if backoff is not None else config.WEB3_RETRY_BACKOFF
+        self.breaker = CircuitBreaker(breaker_threshold or config.WEB3_BREAKER_THRESHOLD,
+                                      breaker_cooldown or config.WEB3_BREAKER_COOLDOWN)
+
+        self._histograms = {}
+        self._histograms_lock = threading.Lock()
+        self.retried = 0
+
+    def _observe(self, method, elapsed_ms, error=False):
+        with self._histograms_lock:
+            histogram = self._histograms.get(method)
+            if histogram is None:
+                histogram = self._histograms[method] = LatencyHistogram()
+            histogram.observe(elapsed_ms, error)
+
+    def _post(self, label, request_data, timeout, idempotent):
+        """Send one HTTP request with breaker, timeout, retries and timing"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Ethereum node circuit open, skipping {label}")
+
+        kwargs = self.get_request_kwargs()
+        kwargs['timeout'] = (self.connect_timeout, timeout)
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                response = self._request_session_manager.make_post_request(
+                    self.endpoint_uri, request_data, **kwargs)
+            except Exception as e:
+                self._observe(label, (time.perf_counter() - started) * 1000, error=True)
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                retryable = isinstance(e, RETRYABLE_ERRORS) or status in RETRYABLE_STATUS
+                if not retryable or attempt == attempts - 1:
+                    self.breaker.record_failure()
+                    raise
+                self.retried += 1
+                # Full jitter keeps workers from retrying in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                continue
+
+            self._observe(label, (time.perf_counter() - started) * 1000)
+            self.breaker.record_success()
+            return response
+
+    def _make_request(self, method, request_data):
+        timeout = self.timeouts.get(method, self.timeout)
+        return self._post(method, request_data, timeout, method in READ_METHODS)
+
+    def make_batch_request(self, batch_requests):
+        methods = [method for method, _ in batch_requests]
+        timeout = max(self.timeouts.get(method, self.timeout) for method in methods)
+        request_data = self.encode_batch_rpc_request(batch_requests)
+        raw_response = self._post('batch', request_data, timeout,
+                                  all(method in READ_METHODS for method in methods))
+        response = self.decode_rpc_response(raw_response)
+        if not isinstance(response, list):
+            # RPC errors return only one response with the error object
+            return response
+        return sorted(response, key=lambda item: item.get('id') or 0)
+
+    def stats(self):
+        """Breaker state, pool size and per-method latency histograms"""
+        with self._histograms_lock:
+            methods = {method: histogram.to_dict() for method, histogram in self._histograms.items()}
+        return {
+            # Host only; Infura-style URLs carry the project ID in the path
+            'endpoint': urlsplit(str(self.endpoint_uri)).netloc,
+            'pool_size': self.pool_size,
+            'circuit': self.breaker.state,
+            'circuit_trips': self.breaker.trips,
+            'consecutive_failures': self.breaker.failures,
+            'retries': self.retried,
+            'methods': methods,
+        }